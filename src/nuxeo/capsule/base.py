@@ -16,17 +16,33 @@
 """Capsule basic implementation.
 """
 
+import os
 import re
+import mmap
+import zlib
 import logging
+import tempfile
+import hashlib
+from hashlib import sha256
+from bisect import bisect_left
+from bisect import bisect_right
+from itertools import islice
+from contextlib import contextmanager
 import time
+import weakref
 from datetime import datetime
 from cStringIO import StringIO
 
+import transaction
 import Acquisition
 from Acquisition import aq_base
 from persistent import Persistent
+from persistent.mapping import PersistentMapping
+from BTrees.OOBTree import OOBTree
+from BTrees.Length import Length
 
 import zope.interface
+from zope.interface.common.mapping import IEnumerableMapping
 from nuxeo.capsule.interfaces import IObjectBase
 from nuxeo.capsule.interfaces import IContainerBase
 from nuxeo.capsule.interfaces import IDocument
@@ -43,6 +59,16 @@ from nuxeo.capsule.interfaces import IResource
 from nuxeo.capsule.interfaces import IBlob
 from nuxeo.capsule.interfaces import IReference
 
+from nuxeo.capsule.order import Order
+from nuxeo.capsule.cache import LRUCache
+from nuxeo.capsule.dto import iterDTOEvents
+from nuxeo.capsule.dto import buildDTO
+from nuxeo.capsule.query import Cursor
+from nuxeo.capsule.query import Eq
+from nuxeo.capsule.query import Query
+from nuxeo.capsule.query import QueryContext
+from nuxeo.capsule.query import TYPE_PROPERTY
+
 # Zope 2
 View = 'View'
 ModifyPortalContent = 'Modify portal content'
@@ -65,16 +91,246 @@ _MARKER = object()
 logger = logging.getLogger('nuxeo.capsule.base')
 
 
+def _getCachedPath(ob):
+    """Get the path of a node as a tuple of names.
+
+    The path is memoized in the _v_path attribute of the node, along
+    with the parent path and name it was computed from. As the parent
+    path is itself memoized, checking its identity is enough to detect
+    that the node or one of its ancestors was renamed or moved, without
+    building any new tuple.
+    """
+    name = ob.__name__
+    parent = ob.__parent__
+    if parent is None:
+        ppath = None
+    else:
+        ppath = parent._getPath()
+    cached = ob._v_path
+    if cached is not None and cached[0] is ppath and cached[1] == name:
+        return cached[2]
+    if ppath is None:
+        path = (name,)
+    else:
+        path = ppath + (name,)
+    ob._v_path = (ppath, name, path)
+    return path
+
+
+def _getWorkspace(ob):
+    """Get the workspace holding a node, or None.
+    """
+    while ob is not None:
+        if IWorkspace.providedBy(ob):
+            return ob
+        ob = ob.__parent__
+    return None
+
+
+def _iterLoadedDocuments(doc):
+    """Iterate over a document and its descendants already loaded.
+    """
+    stack = [doc]
+    while stack:
+        doc = stack.pop()
+        yield doc
+        children = doc._children
+        if children is not None:
+            stack.extend(children._children.values())
+
+
+def _iterPropertyMappings(ob):
+    """Iterate over the (object, mapping) holding the properties of a
+    node and all its descendants.
+    """
+    stack = [ob]
+    while stack:
+        ob = stack.pop()
+        if isinstance(ob, ObjectBase):
+            for props in ob._getPropertyMappings():
+                yield ob, props
+                for value in props.itervalues():
+                    if IProperty.providedBy(value):
+                        stack.append(value)
+        if isinstance(ob, ContainerBase) or (isinstance(ob, Document) and
+                                             ob._children is not None):
+            stack.extend(ob.getChildren())
+
+
+def _iterBlobs(ob):
+    """Iterate over the blobs held by a node and all its descendants.
+    """
+    for holder, props in _iterPropertyMappings(ob):
+        for value in props.itervalues():
+            if IBlob.providedBy(value):
+                yield value
+
+
+def _indexProperties(index, doc):
+    uuid = doc.getUUID()
+    index.index(uuid, TYPE_PROPERTY, doc.getTypeName())
+    for name, value in doc._iterPropertyItems():
+        index.index(uuid, name, value)
+
+
+# Property buckets
+
+PROPERTY_BUCKETS = 'nuxeo.capsule.buckets'
+
+_bucket_layouts = {}
+
+def setPropertyBuckets(schema, buckets):
+    """Store some properties of a schema in separate buckets.
+
+    `buckets` maps a bucket name to a sequence of property names, for
+    instance {'body': ('content', 'content_html')}. The other properties
+    are stored in the object itself. This must be done when the schema
+    is defined, before objects are used.
+
+    Schemas extending this one use the same buckets, unless they
+    redefine them.
+    """
+    schema.setTaggedValue(PROPERTY_BUCKETS, buckets)
+    _bucket_layouts.clear()
+
+def _getBucketLayout(schema):
+    """Get the mapping of property name to bucket name for a schema.
+    """
+    try:
+        return _bucket_layouts[schema]
+    except KeyError:
+        pass
+    layout = {}
+    if schema is not None:
+        # Most specific last
+        for iface in reversed(schema.__iro__):
+            buckets = iface.queryTaggedValue(PROPERTY_BUCKETS)
+            if buckets:
+                for bucket, names in buckets.iteritems():
+                    for name in names:
+                        layout[name] = bucket
+    _bucket_layouts[schema] = layout
+    return layout
+
+
+def _splitPath(path):
+    """Split a path relative to the workspace root into a tuple of names.
+    """
+    return tuple([name for name in path.split('/') if name])
+
+
+def _getCachedPathString(ob):
+    """Get the path of a node as a string, memoized in _v_path_string.
+    """
+    path = ob._getPath(True)
+    cached = ob._v_path_string
+    if cached is not None and cached[0] is path:
+        return cached[1]
+    string = '/'.join(path) or '/'
+    ob._v_path_string = (path, string)
+    return string
+
+
+class PropertiesView(object):
+    """A read-only mapping view on the properties of an object.
+
+    The view shares the storage of the object, so it is cheap to get
+    and reflects later changes to the properties.
+    """
+    zope.interface.implements(IEnumerableMapping)
+
+    __roles__ = None
+    __allow_access_to_unprotected_subobjects__ = 1
+
+    def __init__(self, ob):
+        self._ob = ob
+
+    def __getitem__(self, name):
+        return self._ob.getProperty(name)
+
+    def get(self, name, default=None):
+        return self._ob.getProperty(name, default)
+
+    def __contains__(self, name):
+        return self._ob.hasProperty(name)
+
+    has_key = __contains__
+
+    def __len__(self):
+        return sum([len(props)
+                    for props in self._ob._getPropertyMappings()])
+
+    def iteritems(self):
+        return self._ob._iterPropertyItems()
+
+    def iterkeys(self):
+        for name, value in self._ob._iterPropertyItems():
+            yield name
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        for name, value in self._ob._iterPropertyItems():
+            yield value
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def copy(self):
+        return self._ob.getProperties()
+
+    def __eq__(self, other):
+        if isinstance(other, PropertiesView):
+            other = other.copy()
+        return self.copy() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'PropertiesView(%r)' % (self.copy(),)
+
+    def _readonly(self, *args, **kw):
+        raise TypeError("Properties view is read-only")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = update = setdefault = pop = popitem = _readonly
+
+
 class ObjectBase(Persistent):
     """A complex object with properties based on a schema.
 
     Properties are stored in the _props dict. Their value is either a
     python simple type, or an IProperty.
+
+    If the schema defines property buckets (see `setPropertyBuckets`),
+    the properties of a bucket are instead stored in a separate
+    persistent mapping, in the _buckets dict, so that changing them
+    doesn't write the object and the other properties, and the other
+    way around.
+
+    The properties changed, in the object or in its subproperties, are
+    recorded for getDTOChanges in a dict kept by the transaction (see
+    _getDTOChangeRecord), not on the object, as a ghost loses its
+    volatile attributes. The dict maps the name of a changed property to
+    replaced: if it is false, only things under the property changed,
+    and they are recorded in the property itself. The None key means
+    the whole object changed. They are recorded since the start of the
+    transaction or the last markDTOChanges, which forgets those of the
+    object and of its subproperties; marking a subproperty also
+    restarts what its parents report under it.
     """
     zope.interface.implements(IObjectBase)
     security = ClassSecurityInfo()
 
     __parent__ = None
+    _buckets = None
 
     def __init__(self, name, schema):
         self.__name__ = name
@@ -96,18 +352,67 @@ class ObjectBase(Persistent):
         """
         return self.getSchema().getName()
 
+    def _getPropertyMappings(self):
+        """Get the mappings holding the properties.
+        """
+        if self._buckets is None:
+            return (self._props,)
+        return [self._props] + self._buckets.values()
+
+    def _iterPropertyItems(self):
+        """Iterate over the (name, value) of all the properties.
+        """
+        for props in self._getPropertyMappings():
+            for item in props.iteritems():
+                yield item
+
+    def _getStorage(self, name):
+        """Get the mapping holding a property, for reading.
+        """
+        buckets = self._buckets
+        if buckets is not None:
+            bucket = _getBucketLayout(self.getSchema()).get(name)
+            if bucket is not None and bucket in buckets:
+                props = buckets[bucket]
+                if name in props:
+                    return props
+        return self._props
+
+    def _getWriteStorage(self, name):
+        """Get the mapping where a property must be stored.
+        """
+        bucket = _getBucketLayout(self.getSchema()).get(name)
+        if bucket is None:
+            return self._props
+        if self._buckets is None:
+            self._buckets = {}
+        props = self._buckets.get(bucket)
+        if props is None:
+            props = PersistentMapping()
+            self._buckets[bucket] = props
+            self._p_changed = True
+        return props
+
     security.declareProtected(View, 'getProperties')
     def getProperties(self):
         """See `nuxeo.capsule.interfaces.IObjectBase`
         """
-        return self._props.copy()
+        if self._buckets is None:
+            return self._props.copy()
+        return dict(self._iterPropertyItems())
+
+    security.declareProtected(View, 'getPropertiesView')
+    def getPropertiesView(self):
+        """See `nuxeo.capsule.interfaces.IObjectBase`
+        """
+        return PropertiesView(self)
 
     security.declareProtected(View, 'getProperty')
     def getProperty(self, name, default=_MARKER):
         """See `nuxeo.capsule.interfaces.IObjectBase`
         """
         try:
-            return self._props[name]
+            return self._getStorage(name)[name]
         except KeyError:
             if default is not _MARKER:
                 return default
@@ -117,23 +422,197 @@ class ObjectBase(Persistent):
     def hasProperty(self, name):
         """See `nuxeo.capsule.interfaces.IObjectBase`
         """
-        return name in self._props
+        return name in self._getStorage(name)
 
     security.declareProtected(ModifyPortalContent, 'setProperty')
     def setProperty(self, name, value):
         """See `nuxeo.capsule.interfaces.IObjectBase`
+
+        Only the object or the bucket holding the property is changed.
         """
+        props = self._getWriteStorage(name)
+        if props is not self._props and name in self._props:
+            # Stored before the schema had buckets, move it
+            self._p_changed = True
+            props[name] = self._props.pop(name)
         if value is None:
-            if name in self._props:
-                self._p_changed = True
-                del self._props[name]
+            if name in props:
+                if props is self._props:
+                    self._p_changed = True
+                del props[name]
+                self._propertyChanged(name, None)
         else:
-            self._p_changed = True
-            self._props[name] = value
+            if props is self._props:
+                self._p_changed = True
+            props[name] = value
+            self._propertyChanged(name, value)
+
+    def _propertyChanged(self, name, value):
+        """Called after a property is set or removed (value None).
+        """
+        if IProperty.providedBy(value) and value.__parent__ is None:
+            value.__parent__ = self
+        _recordDTOChange(self, name)
+
+    security.declarePrivate('markDTOChanges')
+    def markDTOChanges(self):
+        """See `nuxeo.capsule.interfaces.IObjectBase`
+        """
+        stack = [self]
+        while stack:
+            ob = stack.pop()
+            changes = _getDTOChangeRecord(ob, forget=True)
+            if changes is None:
+                continue
+            for name in changes:
+                if name is None:
+                    continue
+                try:
+                    sub = _walkDTOPath(ob, (name,))
+                except KeyError:
+                    continue
+                if isinstance(sub, ObjectBase):
+                    stack.append(sub)
+
+    def _getDTOChangedPaths(self):
+        """Get the changed path tuples, without those under another.
+        """
+        paths = []
+        stack = [(self, ())]
+        while stack:
+            ob, prefix = stack.pop()
+            changes = _getDTOChangeRecord(ob)
+            if changes is None:
+                continue
+            if None in changes:
+                paths.append(prefix)
+                continue
+            for name, replaced in changes.iteritems():
+                if replaced:
+                    paths.append(prefix + (name,))
+                    continue
+                try:
+                    sub = _walkDTOPath(ob, (name,))
+                except KeyError:
+                    continue
+                stack.append((sub, prefix + (name,)))
+        paths.sort()
+        return paths
+
+    security.declarePrivate('getDTOChanges')
+    def getDTOChanges(self):
+        """See `nuxeo.capsule.interfaces.IObjectBase`
+        """
+        patch = {}
+        for path in self._getDTOChangedPaths():
+            try:
+                ob = _walkDTOPath(self, path[:-1])
+            except KeyError:
+                continue
+            if not path:
+                value = ob
+            elif isinstance(ob, ContainerBase):
+                value = ob.getChild(path[-1], None)
+            else:
+                value = ob.getProperty(path[-1], None)
+            if IProperty.providedBy(value):
+                value = value.getDTO()
+            patch['/'.join(path)] = value
+        return patch
+
+    security.declarePrivate('applyDTOPatch')
+    def applyDTOPatch(self, patch):
+        """See `nuxeo.capsule.interfaces.IObjectBase`
+        """
+        # Sorted so that parents are set before their subproperties
+        for path, value in sorted(patch.iteritems()):
+            if not path:
+                if not IProperty.providedBy(self):
+                    raise ValueError("Only a property can be set as a whole")
+                self.setDTO(value)
+                continue
+            path = tuple(path.split('/'))
+            ob = _walkDTOPath(self, path[:-1])
+            name = path[-1]
+            if isinstance(ob, ContainerBase):
+                ob.getChild(name).setDTO(value)
+                continue
+            current = ob.getProperty(name, None)
+            if IProperty.providedBy(current) and value is not None:
+                current.setDTO(value)
+            else:
+                ob.setProperty(name, value)
 
 InitializeClass(ObjectBase)
 
 
+# The DTO change records of the objects, by transaction, then by object
+# id as (object, dict), the object being kept so that its id stays valid
+_dto_change_records = weakref.WeakKeyDictionary()
+
+def _getDTOChangeRecord(ob, create=False, forget=False):
+    """Get the dict of changes recorded for `ob` in this transaction.
+
+    Returns None if there is none, unless `create` is true. If `forget`
+    is true, the record is dropped from the transaction.
+    """
+    txn = transaction.get()
+    records = _dto_change_records.get(txn)
+    if records is None:
+        if not create:
+            return None
+        records = _dto_change_records[txn] = {}
+    if forget:
+        record = records.pop(id(ob), None)
+    else:
+        record = records.get(id(ob))
+        if record is None and create:
+            record = records[id(ob)] = (ob, {})
+    if record is None:
+        return None
+    return record[1]
+
+
+def _recordDTOChange(ob, name):
+    """Record a change to the property `name` of `ob`, None for `ob`.
+
+    The parent properties, and the document holding them, record that
+    something changed under their subproperty. This stops at the first
+    parent that already knows it, so that building a deep tree costs no
+    more than the depth. As markDTOChanges forgets the changes of a
+    whole subtree, a property that knows something changed under it
+    always has parents that know it too.
+    """
+    replaced = True
+    while True:
+        changes = _getDTOChangeRecord(ob, create=True)
+        known = changes.get(name)
+        if known is not None:
+            if replaced:
+                changes[name] = True
+            break
+        changes[name] = replaced
+        parent = ob.__parent__
+        if not isinstance(ob, Property) or not isinstance(parent, ObjectBase):
+            break
+        name = ob.__name__
+        replaced = False
+        ob = parent
+
+
+def _walkDTOPath(ob, path):
+    """Get the subproperty of `ob` at a path tuple.
+
+    Raises KeyError if there is none.
+    """
+    for name in path:
+        if isinstance(ob, ContainerBase):
+            ob = ob.getChild(name)
+        else:
+            ob = ob.getProperty(name)
+    return ob
+
+
 class ContainerBase(Persistent):
     """A holder of children nodes.
 
@@ -142,8 +621,11 @@ class ContainerBase(Persistent):
     Children are stored inside the _children attribute, which maps a
     unicode name to a IObjectBase.
 
-    For ordered containers, the _order list contains the ordered list of
-    keys. For unordered containers, _order is None.
+    For ordered containers, _order holds the ordered sequence of keys:
+    a plain list stored in the container record while it is shorter
+    than a chunk of Order, and an Order after that (see _getWriteOrder),
+    so that small containers like most lists don't cost three more
+    records. For unordered containers, _order is None.
 
     For unordered containers, the children may be loaded lazily from the
     storage (because these containers can be big). In this case:
@@ -153,6 +635,10 @@ class ContainerBase(Persistent):
     - _missing is a set storing the names of nonexistent children.
 
     If child loading is not lazy, _lazy and _missing are None.
+
+    Lazy containers are set up by calling _setLazy. Connectors then
+    implement the _loadChildren and _loadChildNames hooks, which are
+    called only for the names not already known.
     """
     zope.interface.implements(IContainerBase)
     security = ClassSecurityInfo()
@@ -160,6 +646,7 @@ class ContainerBase(Persistent):
     __parent__ = None
     _lazy = None
     _missing = None
+    _v_path = None
 
     def __init__(self, name):
         self.__name__ = name
@@ -167,25 +654,90 @@ class ContainerBase(Persistent):
         self._order = [] # ordered XXX
 
     def _getPath(self, first=False):
-        if self.__parent__ is None:
-            return (self.__name__,)
-        else:
-            return self.__parent__._getPath() + (self.__name__,)
+        return _getCachedPath(self)
 
     def __repr__(self):
         path = '/'.join(self._getPath(True))
         return '<%s at %s>' % (self.__class__.__name__, path)
 
+    # Lazy loading
+
+    def _setLazy(self):
+        """Switch the container to lazy loading of its children.
+        """
+        self._order = None
+        self._lazy = set()
+        self._missing = set()
+
+    def _loadChildren(self, names):
+        """Load some children from the storage.
+
+        Called with names that are neither loaded nor known to be
+        missing. Returns a mapping of name to child for the names that
+        exist.
+        """
+        raise NotImplementedError("Must be subclassed")
+
+    def _loadChildNames(self):
+        """Get the names of all the children from the storage.
+        """
+        raise NotImplementedError("Must be subclassed")
+
+    def _countChildren(self):
+        """Get the number of children from the storage.
+
+        May be overridden by connectors having a cheaper way.
+        """
+        return len(self._loadChildNames())
+
+    def _getChild(self, name):
+        """Get a child, loading it if needed.
+
+        Returns None if the child doesn't exist.
+        """
+        child = self._children.get(name)
+        if (child is None and self._lazy is not None
+            and name not in self._lazy and name not in self._missing):
+            self.prefetchChildren((name,))
+            child = self._children.get(name)
+        return child
+
+    security.declarePrivate('prefetchChildren')
+    def prefetchChildren(self, names):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        if self._lazy is None:
+            return
+        lazy = self._lazy
+        missing = self._missing
+        names = [name for name in names
+                 if name not in lazy and name not in missing]
+        if not names:
+            return
+        loaded = self._loadChildren(names)
+        for name in names:
+            child = loaded.get(name)
+            if child is None:
+                missing.add(name)
+            else:
+                self._children[name] = child
+                lazy.add(name)
+
+    def _prefetchAll(self):
+        names = self._loadChildNames()
+        self.prefetchChildren(names)
+        return names
+
     security.declarePrivate('getChild')
     def getChild(self, name, default=_MARKER):
         """See `nuxeo.capsule.interfaces.IContainerBase`
         """
-        try:
-            return self._children[name]
-        except KeyError:
+        child = self._getChild(name)
+        if child is None:
             if default is not _MARKER:
                 return default
-            raise
+            raise KeyError(name)
+        return child
 
     def __setitem__(self, name, value):
         """See `nuxeo.capsule.interfaces.IContainerBase`
@@ -195,7 +747,10 @@ class ContainerBase(Persistent):
     def __getitem__(self, name):
         """See `nuxeo.capsule.interfaces.IContainerBase`
         """
-        return self._children[name]
+        child = self._getChild(name)
+        if child is None:
+            raise KeyError(name)
+        return child
 
     security.declarePrivate('getChildren')
     def getChildren(self):
@@ -204,17 +759,72 @@ class ContainerBase(Persistent):
         return iter(self)
 
     security.declareProtected(View, 'keys')
-    def keys(self):
+    def keys(self, start=None, limit=None):
         """See `nuxeo.capsule.interfaces.IContainerBase`
         """
+        if start is not None or limit is not None:
+            return list(self._iterNames(start, None, limit))
+        if self._lazy is not None:
+            return list(self._loadChildNames())
         if self._order is None:
             return self._children.keys()
         else:
             return list(self._order)
 
+    def _iterNames(self, start=None, stop=None, limit=None):
+        """Iterate over a range of children names.
+
+        For ordered containers, `start` and `stop` are positions. For
+        unordered containers they are names, excluded from the range,
+        and names are iterated in sorted order.
+        """
+        order = self._order
+        if isinstance(order, list):
+            names = iter(order[start or 0:stop])
+        elif order is not None:
+            names = order.iterSlice(start or 0, stop)
+        else:
+            names = self._iterSortedNames(start, stop)
+        if limit is not None:
+            names = islice(names, limit)
+        return names
+
+    def _iterSortedNames(self, start, stop):
+        """Iterate in sorted order over the names between two names.
+
+        May be overridden by containers storing their names sorted.
+        """
+        if self._lazy is not None:
+            names = sorted(self._loadChildNames())
+        else:
+            names = sorted(self._children.keys())
+        if start is None:
+            lo = 0
+        else:
+            lo = bisect_right(names, start)
+        if stop is None:
+            hi = len(names)
+        else:
+            hi = bisect_left(names, stop)
+        return iter(names[lo:hi])
+
+    security.declarePrivate('iterChildren')
+    def iterChildren(self, start=None, stop=None, limit=None):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        names = self._iterNames(start, stop, limit)
+        if self._lazy is not None:
+            names = list(names)
+            self.prefetchChildren(names)
+        children = self._children
+        return (children[k] for k in names)
+
     def __iter__(self):
         """See `nuxeo.capsule.interfaces.IContainerBase`
         """
+        if self._lazy is not None:
+            names = self._prefetchAll()
+            return (self._children[k] for k in names)
         if self._order is None:
             return self._children.itervalues()
         else:
@@ -224,18 +834,22 @@ class ContainerBase(Persistent):
     def hasChild(self, name):
         """See `nuxeo.capsule.interfaces.IContainerBase`
         """
-        return name in self._children
+        return self._getChild(name) is not None
 
     def __contains__(self, name):
-        return name in self._children
+        return self._getChild(name) is not None
 
     def __len__(self):
+        if self._lazy is not None:
+            return self._countChildren()
         return len(self._children)
 
     security.declareProtected(View, 'hasChildren')
     def hasChildren(self):
         """See `nuxeo.capsule.interfaces.IContainerBase`
         """
+        if self._lazy is not None:
+            return bool(self._countChildren())
         return bool(self._children)
 
     security.declarePrivate('addChild')
@@ -244,14 +858,32 @@ class ContainerBase(Persistent):
         """
         raise NotImplementedError("Must be subclassed")
 
+    def _setChild(self, name, child):
+        """Store a new child.
+
+        To be called by addChild implementations.
+        """
+        child.__parent__ = self
+        self._children[name] = child
+        if self._order is not None:
+            self._getWriteOrder().append(name)
+        if self._lazy is not None:
+            self._lazy.add(name)
+            self._missing.discard(name)
+        self._childrenChanged()
+
     security.declareProtected(ModifyPortalContent, 'removeChild')
     def removeChild(self, name):
         """See `nuxeo.capsule.interfaces.IContainerBase`
         """
-        child = self._children[name]
+        child = self.getChild(name)
         del self._children[name]
         if self._order is not None:
-            self._order.remove(name)
+            self._getWriteOrder().remove(name)
+        if self._lazy is not None:
+            self._lazy.discard(name)
+            self._missing.add(name)
+        self._childrenChanged()
         return child
 
     def __delitem__(self, name):
@@ -266,6 +898,10 @@ class ContainerBase(Persistent):
         self._children = {}
         if self._order is not None:
             self._order = []
+        if self._lazy is not None:
+            self._lazy = set()
+            self._missing = set()
+        self._childrenChanged()
 
     security.declareProtected(ModifyPortalContent, 'reorder')
     def reorder(self, names):
@@ -273,10 +909,98 @@ class ContainerBase(Persistent):
         """
         if self._order is None:
             raise TypeError("Unordered container")
-        if set(names) != set(self._order):
+        if (len(names) != len(self._order)
+            or set(names) != set(self._order)):
             raise ValueError("Names mismatch (%s to %s)" %
-                             (self._order, names))
-        self._order = list(names)
+                             (list(self._order), names))
+        order = self._getWriteOrder()
+        if isinstance(order, list):
+            order[:] = names
+        else:
+            order.reorder(names)
+        self._childrenChanged()
+
+    def _getWriteOrder(self):
+        """Get the order of an ordered container, to change it.
+
+        A plain list is part of the container record, which is marked
+        changed. It is replaced by an Order once it fills a chunk, which
+        also migrates the long lists of old instances.
+        """
+        order = self._order
+        if isinstance(order, list):
+            self._p_changed = True
+            if len(order) >= Order.chunk_size:
+                order = self._order = Order(order)
+        return order
+
+    def _childrenChanged(self):
+        """Called after children are added, removed or reordered.
+        """
+        pass
+
+    def _checkOrdered(self, names):
+        if self._order is None:
+            raise TypeError("Unordered container")
+        for name in names:
+            if self._getChild(name) is None:
+                raise KeyError(name)
+
+    security.declareProtected(ModifyPortalContent, 'moveChildBefore')
+    def moveChildBefore(self, name, ref):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._checkOrdered((name, ref))
+        if name == ref:
+            return
+        order = self._getWriteOrder()
+        order.remove(name)
+        order.insert(order.index(ref), name)
+        self._childrenChanged()
+
+    security.declareProtected(ModifyPortalContent, 'moveChildAfter')
+    def moveChildAfter(self, name, ref):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._checkOrdered((name, ref))
+        if name == ref:
+            return
+        order = self._getWriteOrder()
+        order.remove(name)
+        order.insert(order.index(ref) + 1, name)
+        self._childrenChanged()
+
+    security.declareProtected(ModifyPortalContent, 'moveChildToPosition')
+    def moveChildToPosition(self, name, index):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._checkOrdered((name,))
+        order = self._getWriteOrder()
+        order.remove(name)
+        order.insert(index, name)
+        self._childrenChanged()
+
+    security.declareProtected(ModifyPortalContent, 'moveChildrenToTop')
+    def moveChildrenToTop(self, names):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._checkOrdered(names)
+        order = self._getWriteOrder()
+        for i, name in enumerate(names):
+            order.remove(name)
+            order.insert(i, name)
+        self._childrenChanged()
+
+    security.declareProtected(ModifyPortalContent, 'moveChildrenToBottom')
+    def moveChildrenToBottom(self, names):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._checkOrdered(names)
+        order = self._getWriteOrder()
+        for name in names:
+            order.remove(name)
+            order.append(name)
+        self._childrenChanged()
 
 InitializeClass(ContainerBase)
 
@@ -303,16 +1027,128 @@ class Children(ContainerBase):
 
     def _getPath(self, first=False):
         if self.__parent__ is None:
-            return (self.__name__,)
+            return _getCachedPath(self)
         ppath = self.__parent__._getPath()
         if first:
             return ppath + (self.__name__,)
         else:
             return ppath
 
+    # The workspace is notified of added and removed documents. Connectors
+    # must store new documents with _setChild, and move them with
+    # _moveChild.
+
+    def _moveChild(self, name, destination, new_name):
+        """Move a child to another holder of children, under a new name.
+
+        To be called by moveDocument implementations. Inside a workspace
+        the indexes are not updated, only the paths are invalidated.
+        """
+        workspace = _getWorkspace(self)
+        if workspace is not None and _getWorkspace(destination) is workspace:
+            workspace._v_moving = self.getChild(name)
+        else:
+            workspace = None
+        try:
+            child = self.removeChild(name)
+            child.__name__ = new_name
+            destination._setChild(new_name, child)
+        finally:
+            if workspace is not None:
+                workspace._v_moving = None
+        return child
+
+    def _setChild(self, name, child):
+        ContainerBase._setChild(self, name, child)
+        workspace = _getWorkspace(self)
+        if workspace is not None:
+            workspace._documentAdded(child)
+
+    security.declareProtected(ModifyPortalContent, 'removeChild')
+    def removeChild(self, name):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        child = ContainerBase.removeChild(self, name)
+        workspace = _getWorkspace(self)
+        if workspace is not None:
+            workspace._documentRemoved(child)
+        return child
+
+    security.declareProtected(ModifyPortalContent, 'clear')
+    def clear(self):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        removed = list(self._children.values())
+        ContainerBase.clear(self)
+        self._cleared(removed)
+
+    def _cleared(self, removed):
+        workspace = _getWorkspace(self)
+        if workspace is not None:
+            for child in removed:
+                workspace._documentRemoved(child)
+
 InitializeClass(Children)
 
 
+class BTreeChildren(Children):
+    """Holder of children nodes for big unordered folders.
+
+    Children are stored in an OOBTree and their number in a Length, so
+    that adding or removing a child only writes one bucket, and
+    concurrent additions in the same folder can be resolved. keys()
+    iterates lazily in sorted order.
+
+    To use it for some folder types, register it with
+    `SchemaManager.setClass` for their children schema.
+    """
+    security = ClassSecurityInfo()
+
+    def __init__(self, name, schema=None):
+        Children.__init__(self, name, schema)
+        self._children = OOBTree()
+        self._count = Length()
+        self._order = None
+
+    def _setChild(self, name, child):
+        Children._setChild(self, name, child)
+        self._count.change(1)
+
+    security.declareProtected(ModifyPortalContent, 'removeChild')
+    def removeChild(self, name):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        child = Children.removeChild(self, name)
+        self._count.change(-1)
+        return child
+
+    security.declareProtected(ModifyPortalContent, 'clear')
+    def clear(self):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        removed = list(self._children.values())
+        self._children.clear()
+        self._count.set(0)
+        self._childrenChanged()
+        self._cleared(removed)
+
+    def __len__(self):
+        return self._count()
+
+    def _iterSortedNames(self, start, stop):
+        return iter(self._children.keys(min=start, max=stop,
+                                         excludemin=start is not None,
+                                         excludemax=stop is not None))
+
+    security.declareProtected(View, 'hasChildren')
+    def hasChildren(self):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        return bool(self._count())
+
+InitializeClass(BTreeChildren)
+
+
 class Document(ObjectBase, Acquisition.Implicit):
     """Capsule Document.
 
@@ -335,18 +1171,14 @@ class Document(ObjectBase, Acquisition.Implicit):
 
     # Derived __init__ must initialize _children
     _children = None
+    _v_path = None
+    _v_path_string = None
 
     def _getPath(self, first=False):
-        if self.__parent__ is None:
-            return (self.__name__,)
-        else:
-            return self.__parent__._getPath() + (self.__name__,)
+        return _getCachedPath(self)
 
     def __repr__(self):
-        path = '/'.join(self._getPath(True))
-        if not path:
-            path = '/'
-        return '<%s at %s>' % (self.__class__.__name__, path)
+        return '<%s at %s>' % (self.__class__.__name__, self.getPath())
 
     def __nonzero__(self):
         # Always return true, even for empty folders
@@ -360,6 +1192,12 @@ class Document(ObjectBase, Acquisition.Implicit):
         """
         return self.__name__
 
+    security.declareProtected(View, 'getPath')
+    def getPath(self):
+        """See `nuxeo.capsule.interfaces.IDocument`
+        """
+        return _getCachedPathString(self)
+
     security.declareProtected(View, 'getUUID')
     def getUUID(self):
         """See `nuxeo.capsule.interfaces.IDocument`
@@ -400,10 +1238,16 @@ class Document(ObjectBase, Acquisition.Implicit):
         return self._children.getChildren()
 
     security.declareProtected(View, 'keys')
-    def keys(self):
+    def keys(self, start=None, limit=None):
         """See `nuxeo.capsule.interfaces.IContainerBase`
         """
-        return self._children.keys()
+        return self._children.keys(start, limit)
+
+    security.declarePrivate('iterChildren')
+    def iterChildren(self, start=None, stop=None, limit=None):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        return self._children.iterChildren(start, stop, limit)
 
     def __iter__(self):
         return iter(self._children)
@@ -426,6 +1270,12 @@ class Document(ObjectBase, Acquisition.Implicit):
         """
         return self._children.hasChildren()
 
+    security.declarePrivate('prefetchChildren')
+    def prefetchChildren(self, names):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._children.prefetchChildren(names)
+
     security.declarePrivate('addChild')
     def addChild(self, name, type_name):
         """See `nuxeo.capsule.interfaces.IContainerBase`
@@ -455,6 +1305,36 @@ class Document(ObjectBase, Acquisition.Implicit):
         """
         self._children.reorder(names)
 
+    security.declareProtected(ModifyPortalContent, 'moveChildBefore')
+    def moveChildBefore(self, name, ref):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._children.moveChildBefore(name, ref)
+
+    security.declareProtected(ModifyPortalContent, 'moveChildAfter')
+    def moveChildAfter(self, name, ref):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._children.moveChildAfter(name, ref)
+
+    security.declareProtected(ModifyPortalContent, 'moveChildToPosition')
+    def moveChildToPosition(self, name, index):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._children.moveChildToPosition(name, index)
+
+    security.declareProtected(ModifyPortalContent, 'moveChildrenToTop')
+    def moveChildrenToTop(self, names):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._children.moveChildrenToTop(names)
+
+    security.declareProtected(ModifyPortalContent, 'moveChildrenToBottom')
+    def moveChildrenToBottom(self, names):
+        """See `nuxeo.capsule.interfaces.IContainerBase`
+        """
+        self._children.moveChildrenToBottom(names)
+
     ##### Move / Copy
 
     security.declarePrivate('moveDocument')
@@ -471,6 +1351,12 @@ class Document(ObjectBase, Acquisition.Implicit):
 
     ##### Properties, see ObjectBase
 
+    def _propertyChanged(self, name, value):
+        ObjectBase._propertyChanged(self, name, value)
+        workspace = _getWorkspace(self)
+        if workspace is not None:
+            workspace._documentPropertyChanged(self, name, value)
+
     ##### Misc
 
     def isReadOnly(self):
@@ -505,48 +1391,346 @@ class Document(ObjectBase, Acquisition.Implicit):
 
     ##### Search
 
+    def _getUUIDIndex(self):
+        workspace = _getWorkspace(self)
+        if workspace is None or workspace._uuid_index is None:
+            raise NotImplementedError("No UUID index")
+        return workspace, workspace._uuid_index
+
     security.declarePrivate('locateUUID')
     def locateUUID(self, uuid):
         """See `nuxeo.capsule.interfaces.IDocument`
         """
-        raise NotImplementedError
+        workspace, index = self._getUUIDIndex()
+        doc = index.get(uuid)
+        if doc is None:
+            return None
+        return doc.getPath()
 
-    security.declarePrivate('searchProperty')
-    def searchProperty(self, prop_name, value):
+    security.declarePrivate('locateUUIDs')
+    def locateUUIDs(self, uuids):
         """See `nuxeo.capsule.interfaces.IDocument`
         """
-        raise NotImplementedError
+        workspace, index = self._getUUIDIndex()
+        paths = []
+        for uuid in uuids:
+            doc = index.get(uuid)
+            if doc is not None:
+                doc = doc.getPath()
+            paths.append(doc)
+        return paths
+
+    security.declarePrivate('searchProperty')
+    def searchProperty(self, prop_name, value):
+        """See `nuxeo.capsule.interfaces.IDocument`
+
+        Uses the property index and the UUID index of the workspace.
+        """
+        workspace = _getWorkspace(self)
+        if workspace is None or workspace._property_index is None:
+            raise NotImplementedError("No property index")
+        uuids = list(workspace._property_index.search(prop_name, value))
+        return zip(uuids, self.locateUUIDs(uuids))
+
+    def _getQueryContext(self):
+        workspace = _getWorkspace(self)
+        if (workspace is None or workspace._property_index is None
+            or workspace._uuid_index is None):
+            raise NotImplementedError("No property index")
+        return QueryContext(workspace)
+
+    security.declarePrivate('searchPropertyCursor')
+    def searchPropertyCursor(self, prop_name, value, token=None):
+        """See `nuxeo.capsule.interfaces.IDocument`
+        """
+        return self.searchQueryCursor(Query(Eq(prop_name, value)), token)
+
+    security.declarePrivate('searchQuery')
+    def searchQuery(self, query):
+        """See `nuxeo.capsule.interfaces.IDocument`
+
+        Uses the property index and the UUID index of the workspace.
+        """
+        uuids = query.execute(self._getQueryContext())
+        return zip(uuids, self.locateUUIDs(uuids))
+
+    security.declarePrivate('searchQueryCursor')
+    def searchQueryCursor(self, query, token=None):
+        """See `nuxeo.capsule.interfaces.IDocument`
+
+        Uses the property index and the UUID index of the workspace.
+        """
+        return Cursor(self._getQueryContext(), query, token)
 
 InitializeClass(Document)
 
 
 class Workspace(Document):
     """Root of a tree of documents.
+
+    The workspace is notified by _documentAdded and _documentRemoved of
+    the documents added or removed in the tree. A document moved inside
+    the tree with Children._moveChild is noted in _v_moving meanwhile,
+    so that only its paths are invalidated: the indexes are keyed by
+    UUID, which doesn't change.
+
+    Resolved paths are kept in a bounded LRU cache of relative path to
+    document, in the volatile _v_path_cache, as (transaction, cache).
+    The cache is dropped when the transaction changes, as moves and
+    removals committed by other connections are only seen then.
+    Removing or clearing children through the API invalidates the paths
+    below them; connectors moving documents by other means must call
+    _invalidatePaths.
+
+    If a UUID index is set with setUUIDIndex, it is kept up to date with
+    the documents in the tree and used by locateUUID. Likewise for a
+    property index set with setPropertyIndex, used by searchProperty.
+    The blobs of resource properties are written to the blob store set
+    with setBlobStore, if any. The store only counts the references of
+    this workspace; connectors keeping frozen versions outside the tree
+    must add them to _iterBlobRoots so that recountBlobs sees them.
     """
     zope.interface.implements(IWorkspace)
+    security = ClassSecurityInfo()
+
+    path_cache_size = 1000
+
+    _v_path_cache = None
+    _v_moving = None
+    _uuid_index = None
+    _property_index = None
+    _blob_store = None
+
+    def _documentAdded(self, doc):
+        """Called when a document is added in the tree.
+        """
+        if doc is self._v_moving:
+            return
+        index = self._uuid_index
+        if index is not None:
+            for ob in _iterLoadedDocuments(doc):
+                index.index(ob.getUUID(), ob)
+        index = self._property_index
+        if index is not None:
+            for ob in _iterLoadedDocuments(doc):
+                _indexProperties(index, ob)
+
+    def _documentRemoved(self, doc):
+        """Called when a document is removed from the tree.
+        """
+        self._invalidatePaths(doc)
+        if doc is self._v_moving:
+            return
+        for index in (self._uuid_index, self._property_index):
+            if index is not None:
+                for ob in _iterLoadedDocuments(doc):
+                    index.unindex(ob.getUUID())
+
+    def _documentPropertyChanged(self, doc, name, value):
+        """Called when a property of a document of the tree is set.
+        """
+        index = self._property_index
+        if index is not None:
+            index.index(doc.getUUID(), name, value)
+
+    security.declarePrivate('getUUIDIndex')
+    def getUUIDIndex(self):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        return self._uuid_index
+
+    security.declarePrivate('setUUIDIndex')
+    def setUUIDIndex(self, index):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        self._uuid_index = index
+        if index is not None:
+            for ob in _iterLoadedDocuments(self):
+                index.index(ob.getUUID(), ob)
+
+    security.declarePrivate('getPropertyIndex')
+    def getPropertyIndex(self):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        return self._property_index
+
+    security.declarePrivate('setPropertyIndex')
+    def setPropertyIndex(self, index):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        self._property_index = index
+        if index is not None:
+            for ob in _iterLoadedDocuments(self):
+                _indexProperties(index, ob)
+
+    security.declarePrivate('getBlobStore')
+    def getBlobStore(self):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        return self._blob_store
+
+    security.declarePrivate('setBlobStore')
+    def setBlobStore(self, store):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        if store is not None:
+            uuid = self.getUUID()
+            if store.workspace is None:
+                store.workspace = uuid
+            elif store.workspace != uuid:
+                raise ValueError("Blob store already used by workspace %s"
+                                 % store.workspace)
+        self._blob_store = store
+
+    def _iterBlobRoots(self):
+        """Iterate over the nodes whose blobs are counted by the store.
+        """
+        yield self
+
+    security.declarePrivate('recountBlobs')
+    def recountBlobs(self):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        store = self._blob_store
+        if store is None:
+            return
+        def digests():
+            for root in self._iterBlobRoots():
+                for blob in _iterBlobs(root):
+                    digest = getattr(blob, 'digest', None)
+                    if digest is not None and digest in store:
+                        yield digest
+        store.recount(digests())
+
+    security.declarePrivate('updateBlobDigests')
+    def updateBlobDigests(self):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        count = 0
+        for holder, props in _iterPropertyMappings(self):
+            changed = False
+            for value in props.itervalues():
+                if (IBlob.providedBy(value) and
+                    'sha256' not in (getattr(value, '_digests', None) or ())):
+                    value.getDigest()
+                    changed = True
+                    count += 1
+            if changed:
+                if props is holder._props:
+                    holder._p_changed = True
+                else:
+                    props._p_changed = True
+        return count
+
+    security.declarePrivate('collectBlobGarbage')
+    def collectBlobGarbage(self):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        store = self._blob_store
+        if store is None:
+            return []
+        self.recountBlobs()
+        return store.collectGarbage()
+
+    def _getPathCache(self):
+        txn = transaction.get()
+        cached = self._v_path_cache
+        if cached is not None and cached[0] is txn:
+            return cached[1]
+        cache = LRUCache(self.path_cache_size)
+        self._v_path_cache = (txn, cache)
+        return cache
+
+    def _invalidatePaths(self, doc):
+        """Invalidate the cached paths of a document and its descendants.
+        """
+        cached = self._v_path_cache
+        if cached is None or cached[0] is not transaction.get():
+            return
+        cache = cached[1]
+        if doc is self:
+            cache.clear()
+        else:
+            cache.invalidatePrefix(doc._getPath()[len(self._getPath()):])
+
+    security.declarePrivate('resolvePathPrefix')
+    def resolvePathPrefix(self, path):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        names = _splitPath(path)
+        cache = self._getPathCache()
+        ob = None
+        i = len(names)
+        while i:
+            ob = cache.get(names[:i])
+            if ob is not None:
+                break
+            i -= 1
+        if ob is None:
+            ob = self
+        while i < len(names):
+            if ob._children is None:
+                break
+            child = ob.getChild(names[i], None)
+            if child is None:
+                break
+            ob = child
+            i += 1
+            cache[names[:i]] = ob
+        return ob, names[i:]
+
+    security.declarePrivate('resolvePath')
+    def resolvePath(self, path, default=_MARKER):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        ob, rest = self.resolvePathPrefix(path)
+        if rest:
+            if default is not _MARKER:
+                return default
+            raise KeyError(path)
+        return ob
+
+    security.declarePrivate('resolvePaths')
+    def resolvePaths(self, paths):
+        """See `nuxeo.capsule.interfaces.IWorkspace`
+        """
+        return [self.resolvePath(path, None) for path in paths]
+
+InitializeClass(Workspace)
 
 
 class Property(Persistent):
     """Base class for a Property.
 
     A property has its own individual persistence in the storage.
+
+    Properties computing their DTO from their subproperties may cache it
+    in _v_dto, as (transaction, dto), so that it's never used across
+    transactions, where other connections may have changed them.
+    Changing a property must call _invalidateDTO, which also invalidates
+    the parent properties.
     """
     security = ClassSecurityInfo()
 
     __name__ = None
     __parent__ = None
+    _v_path = None
+    _v_path_string = None
+    _v_dto = None
 
     def getName(self):
         return self.__name__
 
+    def getPath(self):
+        """See `nuxeo.capsule.interfaces.IProperty`
+        """
+        return _getCachedPathString(self)
+
     def getTypeName(self):
         raise NotImplementedError
 
     def _getPath(self, first=False):
-        if self.__parent__ is None:
-            return (self.__name__,)
-        else:
-            return self.__parent__._getPath() + (self.__name__,)
+        return _getCachedPath(self)
 
     def __repr__(self):
         path = '/'.join(self._getPath(True))
@@ -564,6 +1748,12 @@ class Property(Persistent):
     def emptyDTO(iface, default):
         return default
 
+    def _invalidateDTO(self):
+        ob = self
+        while isinstance(ob, Property):
+            ob._v_dto = None
+            ob = ob.__parent__
+
 InitializeClass(Property)
 
 
@@ -590,15 +1780,28 @@ class ObjectProperty(ObjectBase, Property):
         """See `nuxeo.capsule.interfaces.IProperty`
 
         Returns a mapping.
+
+        Built from the events of `nuxeo.capsule.dto.iterDTOEvents`,
+        and cached until the property or a subproperty changes. The
+        cached DTO is given out, so it is read-only, see
+        `nuxeo.capsule.dto.copyDTO` to get a modifiable copy.
+        """
+        return self._getDTO()
+
+    def _getDTO(self):
+        """Get the cached DTO.
         """
-        value = {}
-        for k, v in self._props.iteritems():
-            if IProperty.providedBy(v):
-                v = v.getDTO()
-            value[k] = v
-        # Name is stored so that setDTO can recognize list items
-        value['__name__'] = self.getName()
-        return value
+        txn = transaction.get()
+        cached = self._v_dto
+        if cached is not None and cached[0] is txn:
+            return cached[1]
+        dto = buildDTO(iterDTOEvents(self, walk=True), readonly=True)
+        self._v_dto = (txn, dto)
+        return dto
+
+    def _propertyChanged(self, name, value):
+        ObjectBase._propertyChanged(self, name, value)
+        self._invalidateDTO()
 
 
 class ContainerProperty(ContainerBase, ObjectProperty):
@@ -616,6 +1819,10 @@ class ContainerProperty(ContainerBase, ObjectProperty):
     def getDTO(self):
         raise NotImplementedError
 
+    def _childrenChanged(self):
+        _recordDTOChange(self, None)
+        self._invalidateDTO()
+
 
 class ListProperty(ContainerProperty):
     """A list of complex properties.
@@ -656,48 +1863,111 @@ class ListProperty(ContainerProperty):
         """See `nuxeo.capsule.interfaces.IProperty`
 
         Returns a list of python simple types.
+
+        Built from the events of `nuxeo.capsule.dto.iterDTOEvents`,
+        and cached until the property or a subproperty changes. The
+        cached DTO is given out, so it is read-only, see
+        `nuxeo.capsule.dto.copyDTO` to get a modifiable copy.
         """
-        l = []
-        for ob in self:
-            assert IProperty.providedBy(ob)
-            v = ob.getDTO()
-            l.append(v)
-        return l
+        return self._getDTO()
 
     def setDTO(self, values):
         """See `nuxeo.capsule.interfaces.IProperty`
 
         `value` is a list of python simple types.
+
+        The values are matched against the current items by name, and
+        unnamed values against the unclaimed items by value. Only the
+        items that have to be added, removed, modified or moved are
+        touched.
+
+        Returns a mapping with keys 'added', 'removed', 'modified' and
+        'moved', whose values are the lists of affected item names.
         """
-        # Find which items to keep
-        kept = []
+        changes = {'added': [], 'removed': [], 'modified': [], 'moved': []}
+        # Claim existing items by name
+        claimed = set()
         for v in values:
             if not isinstance(v, dict):
                 raise ValueError("Not a dict value: %r" % (v,))
             name = v.get('__name__')
-            if name is not None:
-                kept.append(name)
-        # Remove items not kept
-        for name in list(set(self._order) - set(kept)):
+            if name is None:
+                continue
+            if name in claimed:
+                raise ValueError("Duplicate name %r" % (name,))
+            claimed.add(name)
+        # Claim unchanged existing items for unnamed values, the first
+        # unclaimed item with the same DTO being used
+        unclaimed = [name for name in self._order if name not in claimed]
+        by_key = {}
+        for name in reversed(unclaimed):
+            try:
+                by_key.setdefault(_dtoKey(self._children[name]._getDTO()),
+                                  []).append(name)
+            except TypeError:
+                # Unhashable, never matched
+                pass
+        matches = {}
+        for i, v in enumerate(values):
+            if v.get('__name__') is not None:
+                continue
+            try:
+                names = by_key.get(_dtoKey(v))
+            except TypeError:
+                continue
+            if names:
+                matches[i] = names.pop()
+        # Remove items not claimed
+        matched = set(matches.itervalues())
+        for name in unclaimed:
+            if name in matched:
+                continue
             self.removeChild(name)
-        # Modify kept objects, or add new ones
+            changes['removed'].append(name)
+        # Modify claimed objects, or add new ones
         names = []
-        for v in values:
+        for i, v in enumerate(values):
             name = v.get('__name__')
-            if name is not None:
-                # XXX AT: creating a child with a known name is useful when
-                # storing dict-like structure as a list.
-                if self.hasChild(name):
-                    ob = self.getChild(name)
-                else:
-                    ob = self.addValue(name=name)
+            if name is None:
+                name = matches.get(i)
+            if name is not None and self.hasChild(name):
+                ob = self.getChild(name)
+                if _differsFromDTO(ob, v):
+                    ob.setDTO(v)
+                    changes['modified'].append(name)
             else:
-                ob = self.addValue()
-                name = ob.getName()
+                if name is not None:
+                    # XXX AT: creating a child with a known name is useful
+                    # when storing dict-like structure as a list.
+                    ob = self.addValue(name=name)
+                else:
+                    ob = self.addValue()
+                    name = ob.getName()
+                ob.setDTO(v)
+                changes['added'].append(name)
             names.append(name)
-            ob.setDTO(v)
-        # Set final order
-        self.reorder(names)
+        # Move items not already in a sorted position
+        current = list(self._order)
+        if current != names:
+            positions = dict((name, i) for i, name in enumerate(current))
+            kept = set(_longestIncreasing(names, positions))
+            added = set(changes['added'])
+            order = self._getWriteOrder()
+            previous = None
+            for name in names:
+                if name not in kept:
+                    # Removed first, so that the position of previous
+                    # doesn't count it
+                    order.remove(name)
+                    if previous is None:
+                        order.insert(0, name)
+                    else:
+                        order.insert(order.index(previous) + 1, name)
+                    if name not in added:
+                        changes['moved'].append(name)
+                previous = name
+            self._childrenChanged()
+        return changes
 
     def __getitem__(self, index):
         """See `nuxeo.capsule.interfaces.IListProperty`
@@ -719,17 +1989,120 @@ class ListProperty(ContainerProperty):
 InitializeClass(ListProperty)
 
 
+def _differsFromDTO(ob, value):
+    """Tell if setting `value` on the object property `ob` changes it.
+    """
+    for k, v in value.iteritems():
+        if k == '__name__':
+            continue
+        current = ob.getProperty(k, None)
+        if IProperty.providedBy(current):
+            current = current.getDTO()
+        if IResource.providedBy(current) and IResource.providedBy(v):
+            if (len(current) != len(v) or
+                _resourceKey(current) != _resourceKey(v)):
+                return True
+        elif current != v:
+            return True
+    return False
+
+
+def _resourceKey(resource):
+    return ('$resource', len(resource), resource.mime_type,
+            resource.encoding, resource.last_modified, resource.getDigest())
+
+
+def _dtoKey(value):
+    """Get a hashable key for a DTO, equal for equal DTOs.
+
+    The names of dicts and their None values are ignored. Resources and
+    blobs are compared through their digest. Raises TypeError if the
+    DTO holds unhashable values.
+    """
+    if isinstance(value, dict):
+        items = [(k, _dtoKey(v)) for k, v in value.iteritems()
+                 if k != '__name__' and v is not None]
+        items.sort()
+        return ('$dict', tuple(items))
+    if isinstance(value, (list, tuple)):
+        return tuple([_dtoKey(v) for v in value])
+    if IResource.providedBy(value):
+        return _resourceKey(value)
+    if IBlob.providedBy(value):
+        return ('$blob', len(value), value.getDigest())
+    hash(value)
+    return value
+
+
+def _longestIncreasing(names, positions):
+    """Get the longest subsequence of `names` with increasing positions.
+    """
+    tails = [] # tails[k] is the index in names ending a subsequence of k+1
+    previous = [None] * len(names)
+    for i, name in enumerate(names):
+        pos = positions[name]
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if positions[names[tails[mid]]] < pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo:
+            previous[i] = tails[lo-1]
+        if lo == len(tails):
+            tails.append(i)
+        else:
+            tails[lo] = i
+    result = []
+    if tails:
+        i = tails[-1]
+    else:
+        i = None
+    while i is not None:
+        result.append(names[i])
+        i = previous[i]
+    result.reverse()
+    return result
+
+
 CONTENT_TYPE_MATCHER = re.compile('([^;\s]+)\s*(?:;\s*charset=([^\s]+)\s*)?$',
                                   re.I)
 
+COMPRESSIBLE_TYPE_MATCHER = re.compile(
+    'text/|application/(.*[+])?(xml|json)$|application/(x-)?javascript$',
+    re.I)
+
+
+def iterPdataChunks(data):
+    """Iterate over the chunks of a chain of Zope 2 Pdata objects, or
+    of BlobChunk objects.
+
+    Each Pdata is deactivated once read, so that the chain is never
+    loaded in memory as a whole.
+    """
+    while data is not None:
+        chunk = data.data
+        next = data.next
+        if getattr(data, '_p_jar', None) is not None:
+            data._p_deactivate()
+        if chunk:
+            yield chunk
+        data = next
+
 
 class ResourceProperty(ObjectProperty):
     """A resource property.
 
     Designed to hold a JCR nt:resource.
+
+    Text-like blobs of at least compress_min_size bytes are stored as a
+    CompressedBlob, unless the workspace has a blob store.
     """
     zope.interface.implements(IResourceProperty)
 
+    compress_min_size = 4096
+
     def getTypeName(self):
         """See `nuxeo.capsule.interfaces.IObjectBase`
         """
@@ -739,6 +2112,12 @@ class ResourceProperty(ObjectProperty):
         """See `nuxeo.capsule.interfaces.IProperty`
 
         `value` is a IResource or a Zope 2 File object.
+
+        If the workspace has a blob store, the blob is written to it.
+        Otherwise a temporary FileBlob, as made for big Zope 2 files,
+        is stored as a ChunkedBlob, and other blobs may be compressed,
+        depending on their MIME type. The SHA-256 digest of the data is
+        computed now so that it is stored with the blob.
         """
         if value is None:
             raise ValueError('None')
@@ -751,7 +2130,12 @@ class ResourceProperty(ObjectProperty):
             # XXX zope 2 dependency...
             from OFS.Image import File
             if isinstance(value, File):
-                blob = Blob(str(value.data))
+                data = value.data
+                if isinstance(data, str):
+                    blob = Blob(data)
+                else:
+                    # Big files are a Pdata chain, stream it
+                    blob = FileBlob.fromChunks(iterPdataChunks(data))
                 match = CONTENT_TYPE_MATCHER.match(value.content_type)
                 if match is None:
                     logger.warning("Bad content-type %r" % value.content_type)
@@ -766,11 +2150,46 @@ class ResourceProperty(ObjectProperty):
                     last_modified = datetime(2000, 1, 1)
             else:
                 raise TypeError(value)
+        workspace = _getWorkspace(self)
+        if workspace is not None and workspace._blob_store is not None:
+            blob = self._storeBlob(workspace._blob_store, blob)
+        else:
+            if isinstance(blob, FileBlob) and blob.temporary:
+                # The file would be removed with the blob, copy it to
+                # the database without loading it in memory
+                jar = self._p_jar
+                if jar is None and workspace is not None:
+                    jar = workspace._p_jar
+                blob = ChunkedBlob.fromBlob(blob, jar)
+            elif self._shouldCompress(blob, mime_type):
+                compressed = CompressedBlob.fromBlob(blob)
+                if len(compressed.compressed) < len(blob):
+                    blob = compressed
+            # Persisted with the blob, for conditional requests
+            blob.getDigest()
         self.setProperty('jcr:data', blob)
         self.setProperty('jcr:mimeType', mime_type)
         self.setProperty('jcr:encoding', encoding)
         self.setProperty('jcr:lastModified', last_modified)
 
+    def _shouldCompress(self, blob, mime_type):
+        if isinstance(blob, CompressedBlob) or mime_type is None:
+            return False
+        if len(blob) < self.compress_min_size:
+            return False
+        return COMPRESSIBLE_TYPE_MATCHER.match(mime_type) is not None
+
+    def _storeBlob(self, store, blob):
+        """Write a blob through the blob store, and count references.
+        """
+        blob = store.store(blob)
+        store.incref(blob.digest)
+        old = self.getProperty('jcr:data', None)
+        digest = getattr(old, 'digest', None)
+        if digest is not None:
+            store.decref(digest)
+        return blob
+
     def getDTO(self):
         """See `nuxeo.capsule.interfaces.IProperty`
 
@@ -795,6 +2214,9 @@ class ResourceProperty(ObjectProperty):
 ##################################################
 # Plain objects
 
+# Size of the chunks when reading or copying blobs
+BLOB_CHUNK_SIZE = 1 << 16
+
 class Resource(object):
     """A file object.
 
@@ -806,7 +2228,7 @@ class Resource(object):
 
     def __init__(self, blob, mime_type=None, encoding=None,
                  last_modified=None):
-        if not isinstance(blob, Blob):
+        if not IBlob.providedBy(blob):
             print 'XXX', repr(blob)
             raise ValueError("%s data forbidden" % type(blob))
         self.blob = blob
@@ -828,23 +2250,53 @@ class Resource(object):
     def open(self):
         """See `nuxeo.capsule.interfaces.IResourceProperty`
         """
-        return StringIO(str(self.blob))
+        return self.blob.open()
+
+    def openRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IResource`
+        """
+        return self.blob.openRange(offset, length)
+
+    def readRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IResource`
+        """
+        return self.blob.readRange(offset, length)
+
+    def getBuffer(self):
+        """See `nuxeo.capsule.interfaces.IResource`
+        """
+        return self.blob.getBuffer()
+
+    def openBuffer(self):
+        """See `nuxeo.capsule.interfaces.IResource`
+        """
+        return self.blob.openBuffer()
+
+    def getDigest(self, algorithm='sha256'):
+        """See `nuxeo.capsule.interfaces.IResource`
+        """
+        return self.blob.getDigest(algorithm)
+
+    def getETag(self):
+        """See `nuxeo.capsule.interfaces.IResource`
+        """
+        return self.blob.getETag()
 
     def getFileUpload(self):
         """See `nuxeo.capsule.interfaces.IResourceProperty`
 
-        Used by widgets. XXX should be lazy on the open/fetching!
+        Used by widgets. The blob is only opened when the upload is
+        read, size and content type come from the resource.
         """
         # XXX zope 2 dependency...
         from ZPublisher.HTTPRequest import FileUpload
         from Products.CPSUtil.file import SimpleFieldStorage
-        if self.encoding is None:
-            content_type = self.mime_type
-        else:
-            content_type = '%s; charset=%s' % (self.mime_type, self.encoding)
-        headers = {'content-type': content_type}
+        content_type = self.getContentType()
+        headers = {'content-type': content_type,
+                   'content-length': str(len(self))}
         filename = 'noname.bin'
-        fs = SimpleFieldStorage(self.open(), filename, headers)
+        file = LazyFile(self.open, len(self), content_type)
+        fs = SimpleFieldStorage(file, filename, headers)
         return FileUpload(fs)
 
     def getContentType(self):
@@ -854,7 +2306,55 @@ class Resource(object):
             return '%s; charset=%s' % (self.mime_type, self.encoding)
 
 
-class Blob(object):
+DIGEST_ALGORITHMS = ('sha1', 'sha256')
+
+class BlobBase(object):
+    """Base class for blobs, caching the digests of their data.
+
+    Digests are kept in the blob, so they are persisted along with it
+    when its holder is written. A blob is not persistent: a digest
+    computed later, for blobs stored before digests existed, is only
+    cached in the current connection, so that reads never write. The
+    updateBlobDigests of the workspace stores them.
+    """
+
+    # Hex digests, by algorithm name
+    _digests = None
+
+    def getDigest(self, algorithm='sha256'):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        digests = self._digests or {}
+        if algorithm not in digests:
+            if algorithm not in DIGEST_ALGORITHMS:
+                raise ValueError("Unknown digest algorithm %r" % algorithm)
+            h = hashlib.new(algorithm)
+            for data in self.iterChunks():
+                h.update(data)
+            digests = dict(digests)
+            digests[algorithm] = h.hexdigest()
+            self._digests = digests
+        return digests[algorithm]
+
+    def getETag(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        return '"%s"' % self.getDigest('sha256')
+
+    @contextmanager
+    def openBuffer(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        buf = self.getBuffer()
+        try:
+            yield buf
+        finally:
+            close = getattr(buf, 'close', None)
+            if close is not None:
+                close()
+
+
+class Blob(BlobBase):
     """A binary blob.
 
     This is the DTO of a JCR Binary property.
@@ -872,10 +2372,547 @@ class Blob(object):
     def __len__(self):
         return len(self.data)
 
+    def open(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        return StringIO(self.data)
+
+    def openRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        return RangeFile(self.open(), offset, length, len(self))
+
+    def readRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        offset = max(offset, 0)
+        if length is None:
+            return self.data[offset:]
+        return self.data[offset:offset+max(length, 0)]
+
+    def getBuffer(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+
+        Returns a memoryview on the data.
+        """
+        return memoryview(self.data)
+
+    def iterChunks(self, chunk_size=BLOB_CHUNK_SIZE):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        data = self.data
+        for i in xrange(0, len(data), chunk_size):
+            yield data[i:i+chunk_size]
+
     def __repr__(self):
         return "<Blob at 0x%08x>" % id(self)
 
 
+class RangeFile(object):
+    """A read-only file-like object for a range of another file.
+
+    Positions are relative to the start of the range. `size` is the size
+    of the underlying file, to which the range is clipped.
+    """
+
+    def __init__(self, file, offset, length, size):
+        offset = min(max(offset, 0), size)
+        if length is None or offset + length > size:
+            length = size - offset
+        self._file = file
+        self._offset = offset
+        self._length = max(length, 0)
+        self._pos = 0
+        file.seek(offset)
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        remaining = self._length - self._pos
+        if size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return ''
+        self._file.seek(self._offset + self._pos)
+        data = self._file.read(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            pos += self._length
+        self._pos = min(max(pos, 0), self._length)
+
+    def tell(self):
+        return self._pos
+
+    def __iter__(self):
+        while True:
+            data = self.read(BLOB_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self._file.close()
+
+
+class StreamFile(object):
+    """A read-only file-like object over a stream of chunks.
+
+    `factory` returns a new iterator over the chunks of the data, of
+    total length `size`. Seeking forward skips data, seeking backward
+    starts again from a new iterator.
+    """
+
+    def __init__(self, factory, size):
+        self._factory = factory
+        self._size = size
+        self._restart()
+
+    def _restart(self):
+        self._chunks = self._factory()
+        self._buf = ''
+        self._pos = 0
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        parts = [self._buf]
+        have = len(self._buf)
+        while size < 0 or have < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            have += len(chunk)
+        data = ''.join(parts)
+        if 0 <= size < len(data):
+            self._buf = data[size:]
+            data = data[:size]
+        else:
+            self._buf = ''
+        self._pos += len(data)
+        return data
+
+    def readline(self, size=-1):
+        parts = []
+        have = 0
+        while size < 0 or have < size:
+            if not self._buf:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buf = chunk
+                continue
+            # Up to and including the end of line, if in the buffer
+            end = self._buf.find('\n') + 1 or len(self._buf)
+            if size >= 0:
+                end = min(end, size - have)
+            part = self._buf[:end]
+            self._buf = self._buf[end:]
+            parts.append(part)
+            have += len(part)
+            if part.endswith('\n'):
+                break
+        self._pos += have
+        return ''.join(parts)
+
+    def readlines(self, sizehint=0):
+        lines = []
+        total = 0
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            total += len(line)
+            if 0 < sizehint <= total:
+                break
+        return lines
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            pos += self._size
+        pos = min(max(pos, 0), self._size)
+        if pos < self._pos:
+            self._restart()
+        while self._pos < pos:
+            if not self.read(min(pos - self._pos, BLOB_CHUNK_SIZE)):
+                break
+
+    def tell(self):
+        return self._pos
+
+    def __iter__(self):
+        while True:
+            data = self.read(BLOB_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self._chunks = iter(())
+        self._buf = ''
+
+
+class LazyFile(object):
+    """A read-only file-like object that opens its data when first read.
+
+    `opener` returns the real file-like object. The size and content
+    type are known beforehand, and seeking and telling don't need the
+    data.
+    """
+
+    def __init__(self, opener, size, content_type=None):
+        self._opener = opener
+        self._size = size
+        self.content_type = content_type
+        self._file = None
+        self._pos = 0
+
+    def _getFile(self):
+        if self._file is None:
+            self._file = self._opener()
+            if self._pos:
+                self._file.seek(self._pos)
+        return self._file
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        return self._getFile().read(size)
+
+    def readline(self, size=-1):
+        return self._getFile().readline(size)
+
+    def readlines(self, sizehint=0):
+        return self._getFile().readlines(sizehint)
+
+    def __iter__(self):
+        return iter(self._getFile())
+
+    def seek(self, pos, whence=0):
+        if self._file is not None:
+            return self._file.seek(pos, whence)
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            pos += self._size
+        self._pos = max(pos, 0)
+
+    def tell(self):
+        if self._file is not None:
+            return self._file.tell()
+        return self._pos
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._pos = 0
+
+
+class CompressedBlob(BlobBase):
+    """A binary blob stored compressed with zlib.
+
+    The uncompressed length is kept, so that len() doesn't need to
+    decompress. Reading decompresses as a stream.
+    """
+    zope.interface.implements(IBlob)
+
+    def __init__(self, compressed, size):
+        self.compressed = compressed
+        self.size = size
+
+    @classmethod
+    def fromBlob(cls, blob, level=6):
+        """Make a compressed blob from another IBlob.
+
+        The data is compressed by chunks, and its SHA-256 digest is
+        computed at the same time.
+        """
+        compressor = zlib.compressobj(level)
+        h = sha256()
+        parts = []
+        size = 0
+        for data in blob.iterChunks():
+            size += len(data)
+            h.update(data)
+            parts.append(compressor.compress(data))
+        parts.append(compressor.flush())
+        result = cls(''.join(parts), size)
+        result._digests = dict(getattr(blob, '_digests', None) or {})
+        result._digests['sha256'] = h.hexdigest()
+        return result
+
+    def __str__(self):
+        return zlib.decompress(self.compressed)
+
+    def __len__(self):
+        return self.size
+
+    def open(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+
+        Seeking backward decompresses again from the start.
+        """
+        return StreamFile(self.iterChunks, self.size)
+
+    def iterChunks(self, chunk_size=BLOB_CHUNK_SIZE):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        decompressor = zlib.decompressobj()
+        data = self.compressed
+        while data:
+            out = decompressor.decompress(data, chunk_size)
+            data = decompressor.unconsumed_tail
+            if out:
+                yield out
+        out = decompressor.flush()
+        if out:
+            yield out
+
+    def openRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        return RangeFile(self.open(), offset, length, self.size)
+
+    def readRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        return self.openRange(offset, length).read()
+
+    def getBuffer(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+
+        The data has to be decompressed in memory.
+        """
+        return memoryview(str(self))
+
+    def __repr__(self):
+        return "<CompressedBlob at 0x%08x>" % id(self)
+
+
+class BlobChunk(Persistent):
+    """A chunk of the data of a ChunkedBlob, linked to the next one.
+    """
+
+    def __init__(self, data, next=None):
+        self.data = data
+        self.next = next
+
+
+class ChunkedBlob(BlobBase):
+    """A binary blob stored as a chain of persistent chunks.
+
+    Like the Pdata of Zope 2 files, each chunk is a separate database
+    record, so that the data is never loaded in memory as a whole,
+    except by __str__ and getBuffer.
+    """
+    zope.interface.implements(IBlob)
+
+    def __init__(self, first, size):
+        self._first = first
+        self.size = size
+
+    @classmethod
+    def fromBlob(cls, blob, jar=None, chunk_size=BLOB_CHUNK_SIZE):
+        """Make a chunked blob from another IBlob, read by ranges.
+
+        The chain is built from the end. If `jar` is given, each chunk
+        is added to it and written by a savepoint, then deactivated, so
+        that only one chunk is in memory at a time.
+        """
+        size = len(blob)
+        next = None
+        end = size
+        while end > 0:
+            pos = max(end - chunk_size, 0)
+            chunk = BlobChunk(blob.readRange(pos, end - pos), next)
+            if jar is not None:
+                jar.add(chunk)
+                transaction.savepoint(optimistic=True)
+                chunk._p_deactivate()
+            next = chunk
+            end = pos
+        result = cls(next, size)
+        result._digests = dict(getattr(blob, '_digests', None) or {})
+        return result
+
+    def __str__(self):
+        return ''.join(self.iterChunks())
+
+    def __len__(self):
+        return self.size
+
+    def open(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+
+        Seeking backward reads again from the first chunk.
+        """
+        return StreamFile(self.iterChunks, self.size)
+
+    def iterChunks(self, chunk_size=BLOB_CHUNK_SIZE):
+        """See `nuxeo.capsule.interfaces.IBlob`
+
+        Chunks are deactivated once read.
+        """
+        for data in iterPdataChunks(self._first):
+            for i in xrange(0, len(data), chunk_size):
+                yield data[i:i+chunk_size]
+
+    def openRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        return RangeFile(self.open(), offset, length, self.size)
+
+    def readRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        return self.openRange(offset, length).read()
+
+    def getBuffer(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+
+        The chunks have to be joined in memory.
+        """
+        return memoryview(str(self))
+
+    def __repr__(self):
+        return "<ChunkedBlob at 0x%08x>" % id(self)
+
+
+class FileBlob(BlobBase):
+    """A binary blob whose data is in a file.
+
+    The data is never loaded in memory as a whole, except by __str__.
+
+    If `temporary` is true, the file belongs to the blob and is removed
+    when the blob is deleted. Copies and unpickled blobs don't own the
+    file, they share it with the original.
+    """
+    zope.interface.implements(IBlob)
+
+    temporary = False
+
+    def __init__(self, filename, temporary=False):
+        self.filename = filename
+        self.temporary = temporary
+        self._size = os.path.getsize(filename)
+
+    @classmethod
+    def fromFile(cls, file, chunk_size=BLOB_CHUNK_SIZE):
+        """Make a blob in a temporary file from a file-like object.
+
+        The data is copied by chunks.
+        """
+        return cls.fromChunks(iter(lambda: file.read(chunk_size), ''))
+
+    @classmethod
+    def fromChunks(cls, chunks):
+        """Make a blob in a temporary file from an iterable of strings.
+
+        The SHA-256 digest of the data is computed while it is written.
+        """
+        fd, filename = tempfile.mkstemp(prefix='capsule-blob-')
+        f = os.fdopen(fd, 'wb')
+        h = sha256()
+        try:
+            try:
+                for data in chunks:
+                    h.update(data)
+                    f.write(data)
+            finally:
+                f.close()
+        except:
+            os.remove(filename)
+            raise
+        blob = cls(filename, temporary=True)
+        blob._digests = {'sha256': h.hexdigest()}
+        return blob
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('temporary', None)
+        return state
+
+    def __del__(self):
+        if self.temporary:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+    def __str__(self):
+        f = self.open()
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def __len__(self):
+        return self._size
+
+    def open(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        return open(self.filename, 'rb')
+
+    def openRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        return RangeFile(self.open(), offset, length, len(self))
+
+    def readRange(self, offset, length=None):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        f = self.openRange(offset, length)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def getBuffer(self):
+        """See `nuxeo.capsule.interfaces.IBlob`
+
+        Returns a read-only mmap of the file. Slicing it copies the
+        slice, use buffer() for a view. The mapping stays open until
+        the mmap is closed or garbage collected, use openBuffer to have
+        it closed.
+        """
+        if not self._size:
+            return memoryview('')
+        f = self.open()
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    def iterChunks(self, chunk_size=BLOB_CHUNK_SIZE):
+        """See `nuxeo.capsule.interfaces.IBlob`
+        """
+        f = self.open()
+        try:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                yield data
+        finally:
+            f.close()
+
+    def __repr__(self):
+        return "<FileBlob %s at 0x%08x>" % (self.filename, id(self))
+
+
 class Reference(object):
     """A reference to another object through its UUID.
 
@@ -903,4 +2940,7 @@ class Reference(object):
             return 1
         return cmp(self._target, other.getTargetUUID())
 
+    def __hash__(self):
+        return hash(self._target)
+
 InitializeClass(Reference)
@@ -0,0 +1,178 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Content-addressed blob stores.
+"""
+
+import os
+import tempfile
+from hashlib import sha256
+
+from persistent import Persistent
+from BTrees.OOBTree import OOBTree
+
+import zope.interface
+from nuxeo.capsule.interfaces import IBlobStore
+from nuxeo.capsule.base import FileBlob
+
+
+def _getFilename(directory, digest):
+    return os.path.join(directory, digest[:2], digest[2:4], digest)
+
+
+class StoredBlob(FileBlob):
+    """A blob held by a blob store.
+
+    The directory of the store, the digest, the size and the cached
+    digests are pickled, the file is found from the directory and the
+    digest. The store itself isn't referenced, so that copying a
+    document, for instance through a ZODB export, doesn't copy it.
+    """
+
+    temporary = False
+
+    def __init__(self, directory, digest):
+        self.directory = directory
+        self.digest = digest
+        self._digests = {'sha256': digest}
+        self._size = os.path.getsize(self.filename)
+
+    @property
+    def filename(self):
+        return _getFilename(self.directory, self.digest)
+
+    def __repr__(self):
+        return "<StoredBlob %s at 0x%08x>" % (self.digest, id(self))
+
+
+class FileSystemBlobStore(Persistent):
+    """A blob store keeping the blobs as files in a directory.
+
+    Blobs are keyed by the SHA-256 of their content, so that identical
+    content is stored once. The file of a blob is in a subdirectory
+    named after the start of its digest.
+
+    Reference counts are kept in the ZODB with the store, so they follow
+    transactions, but files are written immediately: the files of
+    aborted transactions, and of blobs whose count drops to zero, are
+    removed by collectGarbage, which must be run offline. Counts are
+    only decremented when a blob replaces another, the references of
+    removed content are dropped by the recountBlobs of the workspace.
+
+    The directory identifies the store in the blobs it holds, so it
+    must not change once blobs are stored.
+
+    A store belongs to a single workspace, whose UUID is kept in
+    `workspace`: a recount only sees the content of that workspace, so
+    sharing the store would lose the references of the others.
+    """
+    zope.interface.implements(IBlobStore)
+
+    workspace = None
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._refs = OOBTree()
+
+    def _getFilename(self, digest):
+        return _getFilename(self.directory, digest)
+
+    def _getTempDirectory(self):
+        path = os.path.join(self.directory, 'tmp')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def __contains__(self, digest):
+        return os.path.exists(self._getFilename(digest))
+
+    def get(self, digest, default=None):
+        """See `nuxeo.capsule.interfaces.IBlobStore`
+        """
+        filename = self._getFilename(digest)
+        if not os.path.exists(filename):
+            return default
+        return StoredBlob(self.directory, digest)
+
+    def store(self, blob):
+        """See `nuxeo.capsule.interfaces.IBlobStore`
+        """
+        if isinstance(blob, StoredBlob) and blob.digest in self:
+            return self.get(blob.digest)
+        # The blob may already know its digest
+        digests = getattr(blob, '_digests', None)
+        if digests and digests.get('sha256') in self:
+            return self.get(digests['sha256'])
+        fd, temp = tempfile.mkstemp(dir=self._getTempDirectory())
+        f = os.fdopen(fd, 'wb')
+        try:
+            h = sha256()
+            for data in blob.iterChunks():
+                h.update(data)
+                f.write(data)
+        finally:
+            f.close()
+        digest = h.hexdigest()
+        filename = self._getFilename(digest)
+        if os.path.exists(filename):
+            os.remove(temp)
+        else:
+            dirname = os.path.dirname(filename)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            os.rename(temp, filename)
+        return StoredBlob(self.directory, digest)
+
+    def getRefCount(self, digest):
+        """See `nuxeo.capsule.interfaces.IBlobStore`
+        """
+        return self._refs.get(digest, 0)
+
+    def incref(self, digest):
+        """See `nuxeo.capsule.interfaces.IBlobStore`
+        """
+        self._refs[digest] = self._refs.get(digest, 0) + 1
+
+    def decref(self, digest):
+        """See `nuxeo.capsule.interfaces.IBlobStore`
+        """
+        count = self._refs.get(digest, 0) - 1
+        if count > 0:
+            self._refs[digest] = count
+        elif digest in self._refs:
+            del self._refs[digest]
+
+    def recount(self, digests):
+        """See `nuxeo.capsule.interfaces.IBlobStore`
+        """
+        self._refs.clear()
+        for digest in digests:
+            self.incref(digest)
+
+    def collectGarbage(self):
+        """See `nuxeo.capsule.interfaces.IBlobStore`
+        """
+        removed = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            if dirpath == os.path.join(self.directory, 'tmp'):
+                for name in filenames:
+                    os.remove(os.path.join(dirpath, name))
+                continue
+            for digest in filenames:
+                if digest not in self._refs:
+                    os.remove(os.path.join(dirpath, digest))
+                    removed.append(digest)
+        removed.sort()
+        return removed
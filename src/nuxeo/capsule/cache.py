@@ -0,0 +1,93 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Caches.
+"""
+
+_MARKER = object()
+
+# Link fields
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+    """A mapping of bounded size, dropping the least recently used keys.
+
+    Entries are kept in a circular doubly linked list, most recently
+    used first, so that all operations are O(1).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._clear()
+
+    def _clear(self):
+        self._data = {}
+        root = self._root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        return self._data.keys()
+
+    def get(self, key, default=None):
+        link = self._data.get(key)
+        if link is None:
+            return default
+        # Move to front
+        root = self._root
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+        first = root[NEXT]
+        link[PREV] = root
+        link[NEXT] = first
+        first[PREV] = root[NEXT] = link
+        return link[VALUE]
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            self.get(key)
+            self._data[key][VALUE] = value
+            return
+        root = self._root
+        first = root[NEXT]
+        link = [root, first, key, value]
+        first[PREV] = root[NEXT] = self._data[key] = link
+        if len(self._data) > self.size:
+            # Drop the last one
+            last = root[PREV]
+            last[PREV][NEXT] = root
+            root[PREV] = last[PREV]
+            del self._data[last[KEY]]
+
+    def __delitem__(self, key):
+        link = self._data.pop(key)
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+
+    def clear(self):
+        self._clear()
+
+    def invalidatePrefix(self, prefix):
+        """Remove all the tuple keys starting with the tuple `prefix`.
+        """
+        n = len(prefix)
+        for key in [key for key in self._data if key[:n] == prefix]:
+            del self[key]
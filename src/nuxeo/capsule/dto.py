@@ -0,0 +1,286 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Streaming serialization of property DTOs.
+
+The DTO of a property is described by a stream of events, (event, value)
+pairs, generated without recursion so that deep property trees don't
+hit the recursion limit nor need the whole DTO in memory::
+
+  START_OBJECT, KEY 'title', VALUE u'Foo', KEY 'items', START_LIST,
+  START_OBJECT, ..., END_OBJECT, END_LIST, KEY '__name__', VALUE 'ob',
+  END_OBJECT
+
+The values of the VALUE events are what getDTO would give: python simple
+types, sequences of them for multi-valued properties, IBlob, IResource
+or IReference.
+
+buildDTO rebuilds the DTO from the events, writeJSON writes them as JSON
+to a file, referencing the blobs instead of inlining them. A DTO built
+read-only, as cached by the properties, is made of ReadOnlyDict and
+ReadOnlyList, and copyDTO gives a modifiable copy of it.
+"""
+
+from datetime import datetime
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from nuxeo.capsule.interfaces import IProperty
+from nuxeo.capsule.interfaces import IObjectProperty
+from nuxeo.capsule.interfaces import IContainerProperty
+from nuxeo.capsule.interfaces import IListProperty
+from nuxeo.capsule.interfaces import IResourceProperty
+from nuxeo.capsule.interfaces import IBlob
+from nuxeo.capsule.interfaces import IResource
+from nuxeo.capsule.interfaces import IReference
+
+START_OBJECT = 'start_object'
+END_OBJECT = 'end_object'
+START_LIST = 'start_list'
+END_LIST = 'end_list'
+KEY = 'key'
+VALUE = 'value'
+
+
+class _Key(object):
+    """Marker for a key in the items of an object.
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _iterObjectItems(ob):
+    for name, value in ob._iterPropertyItems():
+        yield _Key(name)
+        yield value
+    # Name is stored so that setDTO can recognize list items
+    yield _Key('__name__')
+    yield ob.getName()
+
+
+def iterDTOEvents(prop, walk=False):
+    """Iterate over the events describing the DTO of an IProperty.
+
+    Object and list properties are walked, other properties give their
+    DTO in a single VALUE event, as do those whose class overrides
+    getDTO, so that the events describe what getDTO gives. If `walk` is
+    true, `prop` itself is walked anyway, as done by the base getDTO.
+    """
+    # Circular import
+    from nuxeo.capsule.base import ObjectProperty
+    from nuxeo.capsule.base import ListProperty
+    list_getDTO = ListProperty.getDTO.im_func
+    object_getDTO = ObjectProperty.getDTO.im_func
+    # Stack of (iterator over items, end event)
+    stack = [(iter((prop,)), None)]
+    while stack:
+        items, end = stack[-1]
+        for item in items:
+            break
+        else:
+            stack.pop()
+            if end is not None:
+                yield end, None
+            continue
+        if isinstance(item, _Key):
+            yield KEY, item.name
+            continue
+        if not IProperty.providedBy(item):
+            yield VALUE, item
+            continue
+        walked = walk and item is prop
+        getDTO = getattr(type(item).getDTO, 'im_func', None)
+        if IListProperty.providedBy(item):
+            if walked or getDTO is list_getDTO:
+                yield START_LIST, None
+                stack.append((iter(item), END_LIST))
+                continue
+        elif (IObjectProperty.providedBy(item) and
+              not IResourceProperty.providedBy(item) and
+              not IContainerProperty.providedBy(item)):
+            if walked or getDTO is object_getDTO:
+                yield START_OBJECT, None
+                stack.append((_iterObjectItems(item), END_OBJECT))
+                continue
+        yield VALUE, item.getDTO()
+
+
+class ReadOnlyDict(dict):
+    """A dict of a read-only DTO.
+    """
+
+    def _readonly(self, *args, **kw):
+        raise TypeError("DTO is read-only")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = update = setdefault = pop = popitem = _readonly
+
+    def __reduce__(self):
+        return (ReadOnlyDict, (dict(self),))
+
+
+class ReadOnlyList(list):
+    """A list of a read-only DTO.
+    """
+
+    def _readonly(self, *args, **kw):
+        raise TypeError("DTO is read-only")
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _readonly
+    __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = reverse = sort = _readonly
+
+    def __reduce__(self):
+        return (ReadOnlyList, (list(self),))
+
+
+def buildDTO(events, readonly=False):
+    """Build a DTO from a stream of events.
+
+    If `readonly` is true, its dicts and lists are read-only.
+    """
+    result = None
+    # Stack of [container, pending key]
+    stack = []
+    for event, value in events:
+        if event == KEY:
+            stack[-1][1] = value
+            continue
+        if event in (END_OBJECT, END_LIST):
+            value = stack.pop()[0]
+            if readonly:
+                if event == END_OBJECT:
+                    value = ReadOnlyDict(value)
+                else:
+                    value = ReadOnlyList(value)
+        elif event == START_OBJECT:
+            stack.append([{}, None])
+            continue
+        elif event == START_LIST:
+            stack.append([[], None])
+            continue
+        if not stack:
+            result = value
+        else:
+            container, key = stack[-1]
+            if key is None:
+                container.append(value)
+            else:
+                container[key] = value
+    return result
+
+
+def _copyContainer(value):
+    if isinstance(value, dict):
+        return dict(value)
+    return list(value)
+
+def copyDTO(dto):
+    """Copy the dicts and lists of a DTO, sharing the other values.
+
+    The copy is made of plain dicts and lists, that can be modified.
+    """
+    if not isinstance(dto, (dict, list)):
+        return dto
+    result = _copyContainer(dto)
+    stack = [result]
+    while stack:
+        container = stack.pop()
+        if isinstance(container, dict):
+            items = container.items()
+        else:
+            items = enumerate(container)
+        for key, value in items:
+            if isinstance(value, (dict, list)):
+                value = container[key] = _copyContainer(value)
+                stack.append(value)
+    return result
+
+
+def _jsonValue(value, blob_ref):
+    if IBlob.providedBy(value):
+        return {'$blob': blob_ref(value)}
+    if IResource.providedBy(value):
+        last_modified = value.last_modified
+        if last_modified is not None:
+            last_modified = last_modified.isoformat()
+        return {'$resource': {
+            'data': blob_ref(value.blob),
+            'length': len(value),
+            'mimeType': value.mime_type,
+            'encoding': value.encoding,
+            'lastModified': last_modified,
+            }}
+    if IReference.providedBy(value):
+        return {'$ref': value.getTargetUUID()}
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonValue(v, blob_ref) for v in value]
+    return value
+
+
+def writeJSON(prop, file, blob_ref=None):
+    """Write the DTO of an IProperty as JSON to the file-like `file`.
+
+    Blobs are not inlined but written as {"$blob": ref}, where ref is
+    given by `blob_ref(blob)`, by default the position of the blob in
+    the returned list. References, dates and resources are likewise
+    written as objects with a "$ref", "$date" or "$resource" key.
+
+    Returns the list of blobs referenced, in order.
+    """
+    blobs = []
+    if blob_ref is None:
+        def blob_ref(blob):
+            return len(blobs) - 1
+    def ref(blob):
+        blobs.append(blob)
+        return blob_ref(blob)
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    write = file.write
+    # For each open object or list, True until an item is written
+    firsts = []
+    after_key = False
+    for event, value in iterDTOEvents(prop):
+        if event in (END_OBJECT, END_LIST):
+            firsts.pop()
+            write(event == END_OBJECT and '}' or ']')
+            continue
+        if after_key:
+            after_key = False
+        elif firsts:
+            if firsts[-1]:
+                firsts[-1] = False
+            else:
+                write(',')
+        if event == KEY:
+            write(encode(value))
+            write(':')
+            after_key = True
+        elif event == START_OBJECT:
+            write('{')
+            firsts.append(True)
+        elif event == START_LIST:
+            write('[')
+            firsts.append(True)
+        else:
+            write(encode(_jsonValue(value, ref)))
+    return blobs
@@ -35,6 +35,9 @@ from nuxeo.capsule.base import ContainerProperty
 from nuxeo.capsule.base import ListProperty
 from nuxeo.capsule.base import ResourceProperty
 from nuxeo.capsule.base import Blob
+from nuxeo.capsule.base import FileBlob
+from nuxeo.capsule.base import ChunkedBlob
+from nuxeo.capsule.base import CompressedBlob
 from nuxeo.capsule.base import Reference
 
 
@@ -77,7 +80,7 @@ class BlobField(MinMaxLen, Field):
     """A field containing a python file-like seekable object.
     """
     zope.interface.implements(IBlobField)
-    _type = Blob
+    _type = (Blob, FileBlob, CompressedBlob, ChunkedBlob)
 
 
 class ReferenceField(Field):
@@ -0,0 +1,302 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Indexes of documents.
+
+These are reference implementations, connectors may provide their own
+backed by the storage.
+"""
+
+from datetime import date
+from datetime import datetime
+
+from persistent import Persistent
+from BTrees.OOBTree import OOBTree
+from BTrees.Length import Length
+from BTrees.OOBTree import OOTreeSet
+
+import zope.interface
+from nuxeo.capsule.interfaces import IUUIDIndex
+from nuxeo.capsule.interfaces import IPropertyIndex
+from nuxeo.capsule.interfaces import IProperty
+from nuxeo.capsule.interfaces import IReference
+
+
+class UUIDIndex(Persistent):
+    """An index of documents by UUID.
+
+    Documents are stored rather than paths, so that moves don't require
+    reindexing; paths are computed from the documents. They are kept in
+    an OOBTree, so that an update only writes a bucket.
+    """
+    zope.interface.implements(IUUIDIndex)
+
+    def __init__(self):
+        self._docs = OOBTree()
+        self._len = Length()
+
+    def index(self, uuid, doc):
+        """See `nuxeo.capsule.interfaces.IUUIDIndex`
+        """
+        if self._docs.insert(uuid, doc):
+            self._len.change(1)
+        else:
+            self._docs[uuid] = doc
+
+    def unindex(self, uuid):
+        """See `nuxeo.capsule.interfaces.IUUIDIndex`
+        """
+        if uuid in self._docs:
+            del self._docs[uuid]
+            self._len.change(-1)
+
+    def get(self, uuid, default=None):
+        """See `nuxeo.capsule.interfaces.IUUIDIndex`
+        """
+        return self._docs.get(uuid, default)
+
+    def uuids(self):
+        """See `nuxeo.capsule.interfaces.IUUIDIndex`
+        """
+        return iter(self._docs.keys())
+
+    def __len__(self):
+        return self._len()
+
+
+def _indexKey(value):
+    """Get the key of a value in the index, or None if it's not indexed.
+
+    Keys are (group, value), the values of a group being comparable with
+    an order that doesn't change across processes: numbers, text as
+    unicode (str being decoded as UTF-8), naive datetimes (aware ones
+    being converted to UTC), dates, booleans, and references by target
+    UUID. Other values aren't indexed.
+    """
+    if isinstance(value, bool):
+        return ('bool', value)
+    if isinstance(value, (int, long, float)):
+        return ('number', value)
+    if isinstance(value, str):
+        try:
+            value = value.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+    if isinstance(value, unicode):
+        return ('string', value)
+    if isinstance(value, datetime):
+        offset = value.utcoffset()
+        if offset is not None:
+            value = value.replace(tzinfo=None) - offset
+        return ('datetime', value)
+    if isinstance(value, date):
+        return ('date', value)
+    if IReference.providedBy(value):
+        return ('reference', value.getTargetUUID())
+    return None
+
+
+def _inRange(value, min, max, excludemin, excludemax):
+    key = _indexKey(value)
+    if key is None:
+        return False
+    if min is not None:
+        bound = _indexKey(min)
+        if bound is None or bound[0] != key[0]:
+            return False
+        if key < bound or (excludemin and key == bound):
+            return False
+    if max is not None:
+        bound = _indexKey(max)
+        if bound is None or bound[0] != key[0]:
+            return False
+        if key > bound or (excludemax and key == bound):
+            return False
+    return True
+
+
+def _getIndexValues(value):
+    """Get the distinct values to index for a property value.
+
+    Values that can't be indexed, see `_indexKey`, are skipped.
+    """
+    if value is None or IProperty.providedBy(value):
+        return ()
+    if isinstance(value, (list, tuple)):
+        values = value
+    else:
+        values = (value,)
+    result = []
+    keys = set()
+    for v in values:
+        key = _indexKey(v)
+        if key is None or key in keys:
+            continue
+        keys.add(key)
+        result.append(v)
+    return tuple(result)
+
+
+class PropertyIndex(Persistent):
+    """An index of documents by property value.
+
+    _postings maps a property name to an OOBTree of key, as given by
+    `_indexKey`, to the sorted set of UUIDs having that value, the group
+    of the key keeping apart values that can't be compared, for range
+    searches. Values without a stable order aren't indexed, nor are
+    strings longer than max_length, like text bodies, which are not
+    looked up by equality and would make large keys. _values maps a
+    UUID to a dict of property name to the values indexed, to be able
+    to unindex them; the dict is replaced rather than changed, so that
+    the OOBTree bucket holding it is written.
+    """
+    zope.interface.implements(IPropertyIndex)
+
+    max_length = 256
+
+    def __init__(self, names=None):
+        """Create an index for the given property names, or all of them.
+        """
+        if names is not None:
+            names = set(names)
+        self._names = names
+        self._postings = OOBTree()
+        self._values = OOBTree()
+
+    def isIndexed(self, name):
+        """See `nuxeo.capsule.interfaces.IPropertyIndex`
+        """
+        return self._names is None or name in self._names
+
+    def index(self, uuid, name, value):
+        """See `nuxeo.capsule.interfaces.IPropertyIndex`
+        """
+        if not self.isIndexed(name):
+            return
+        self._unindexProperty(uuid, name)
+        values = tuple([v for v in _getIndexValues(value)
+                        if not isinstance(v, basestring)
+                        or len(v) <= self.max_length])
+        if not values:
+            return
+        postings = self._postings.get(name)
+        if postings is None:
+            postings = self._postings[name] = OOBTree()
+        for v in values:
+            key = _indexKey(v)
+            uuids = postings.get(key)
+            if uuids is None:
+                uuids = postings[key] = OOTreeSet()
+            uuids.insert(uuid)
+        indexed = dict(self._values.get(uuid, ()))
+        indexed[name] = values
+        self._values[uuid] = indexed
+
+    def _unindexProperty(self, uuid, name):
+        indexed = self._values.get(uuid)
+        if indexed is None or name not in indexed:
+            return
+        indexed = dict(indexed)
+        postings = self._postings[name]
+        for v in indexed.pop(name):
+            key = _indexKey(v)
+            uuids = postings[key]
+            uuids.remove(uuid)
+            if not uuids:
+                del postings[key]
+        if indexed:
+            self._values[uuid] = indexed
+        else:
+            del self._values[uuid]
+
+    def unindex(self, uuid):
+        """See `nuxeo.capsule.interfaces.IPropertyIndex`
+        """
+        for name in self._values.get(uuid, {}).keys():
+            self._unindexProperty(uuid, name)
+
+    def _getUUIDs(self, name, value):
+        """Get the set of UUIDs having a value, which must not be modified.
+        """
+        postings = self._postings.get(name)
+        key = _indexKey(value)
+        if postings is None or key is None:
+            return ()
+        return postings.get(key, ())
+
+    def search(self, name, value):
+        """See `nuxeo.capsule.interfaces.IPropertyIndex`
+
+        Returns a copy of the indexed set.
+        """
+        return OOTreeSet(self._getUUIDs(name, value))
+
+    def count(self, name, value):
+        """See `nuxeo.capsule.interfaces.IPropertyIndex`
+        """
+        return len(self._getUUIDs(name, value))
+
+    def _iterRange(self, name, min, max, excludemin, excludemax):
+        postings = self._postings.get(name)
+        if postings is None:
+            return
+        if min is None and max is None:
+            for uuids in postings.values():
+                yield uuids
+            return
+        lo = hi = None
+        if min is not None:
+            lo = _indexKey(min)
+            if lo is None:
+                return
+            group = lo[0]
+        if max is not None:
+            hi = _indexKey(max)
+            if hi is None or (lo is not None and hi[0] != group):
+                return
+            group = hi[0]
+        # (group,) sorts before all the keys of the group
+        if lo is None:
+            lo, excludemin = (group,), False
+        if hi is None:
+            items = postings.items(lo, excludemin=excludemin)
+        else:
+            items = postings.items(lo, hi, excludemin=excludemin,
+                                   excludemax=excludemax)
+        for key, uuids in items:
+            if key[0] != group:
+                break
+            yield uuids
+
+    def searchRange(self, name, min=None, max=None,
+                    excludemin=False, excludemax=False):
+        """See `nuxeo.capsule.interfaces.IPropertyIndex`
+        """
+        result = OOTreeSet()
+        for uuids in self._iterRange(name, min, max, excludemin, excludemax):
+            result.update(uuids)
+        return result
+
+    def countRange(self, name, min=None, max=None,
+                   excludemin=False, excludemax=False):
+        """See `nuxeo.capsule.interfaces.IPropertyIndex`
+        """
+        return sum([len(uuids) for uuids in
+                    self._iterRange(name, min, max, excludemin, excludemax)])
+
+    def getValues(self, uuid, name):
+        """See `nuxeo.capsule.interfaces.IPropertyIndex`
+        """
+        return self._values.get(uuid, {}).get(name, ())
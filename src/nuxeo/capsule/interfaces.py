@@ -61,6 +61,13 @@ class IObjectBase(Interface):
         Returns a mapping of name to a IProperty or a basic python type.
         """
 
+    def getPropertiesView():
+        """Get all the properties, without copying them.
+
+        Returns a read-only mapping of name to a IProperty or a basic
+        python type, reflecting later changes to the properties.
+        """
+
     def getProperty(name, default=_MARKER):
         """Get a specific field.
 
@@ -82,6 +89,31 @@ class IObjectBase(Interface):
         If the value is None, the property is removed.
         """
 
+    def markDTOChanges():
+        """Start recording the changed properties from now on.
+
+        Otherwise they are recorded from the start of the transaction.
+        The changes already recorded by the subproperties are forgotten
+        too.
+        """
+
+    def getDTOChanges():
+        """Get the properties changed since the transaction start or the
+        last `markDTOChanges`, including changes to subproperties.
+
+        Returns a mapping of '/'-separated path to the DTO of the
+        property, None for a removed one. The path of a list item is
+        made of the item name; a list whose items were added, removed
+        or reordered is given as a whole. The changes to the object
+        itself have an empty path.
+        """
+
+    def applyDTOPatch(patch):
+        """Apply changes as returned by `getDTOChanges`.
+
+        Only the properties in the patch are set.
+        """
+
 ##     def __getattr__(name):
 ##         """Get a specific field.
 ##
@@ -115,8 +147,28 @@ class IContainerBase(Interface):
         Returns an iterable of children implementing IObjectBase.
         """
 
-    def keys():
+    def keys(start=None, limit=None):
         """Get the list of children names.
+
+        If `start` or `limit` is passed, only a range of names is
+        returned, as for `iterChildren`.
+        """
+
+    def iterChildren(start=None, stop=None, limit=None):
+        """Get an iterable over a range of children.
+
+        For ordered containers, `start` and `stop` are positions, as in
+        a slice.
+
+        For unordered containers, the children are iterated in the
+        sorted order of their names, and `start` and `stop` are names
+        excluded from the range. The name of the last child returned
+        can be passed as `start` to get the next ones.
+
+        At most `limit` children are returned. For ordered containers
+        and containers keeping their names sorted, the cost depends on
+        the number of children returned, not on the size of the
+        container.
         """
 
     def __iter__():
@@ -143,6 +195,15 @@ class IContainerBase(Interface):
         Returns a boolean.
         """
 
+    def prefetchChildren(names):
+        """Load several children at once.
+
+        For containers loading their children lazily, fetches in one
+        batch the children not already loaded, so that later accesses
+        don't hit the storage one child at a time. Nonexistent names are
+        ignored. Does nothing for other containers.
+        """
+
     def addChild(name, type_name):
         """Add a new empty child to the document.
 
@@ -155,6 +216,9 @@ class IContainerBase(Interface):
           An IContainerModifiedEvent event on the container is sent.
 
         Raises KeyError if a child with the same name already exists.
+
+        Implementations must store the child with `_setChild`, which
+        notifies the workspace so that its indexes are updated.
         """
 
     def removeChild(name):
@@ -179,6 +243,44 @@ class IContainerBase(Interface):
         `names` must be a permutation of the current names.
         """
 
+    def moveChildBefore(name, ref):
+        """Move a child just before another one.
+
+        Only the positions of the moved child change. The order of a
+        large container is kept in chunks (see `nuxeo.capsule.order.Order`):
+        a move writes the chunks it touches and the small table of chunks,
+        and locating a chunk is linear in the number of chunks, that is
+        the number of children divided by the chunk size. A small order
+        is stored with the container, which a move writes.
+
+        Raises TypeError for an unordered container, and KeyError if
+        one of the children doesn't exist.
+        """
+
+    def moveChildAfter(name, ref):
+        """Move a child just after another one.
+
+        Same errors as `moveChildBefore`.
+        """
+
+    def moveChildToPosition(name, index):
+        """Move a child so that it ends up at position `index`.
+
+        Same errors as `moveChildBefore`.
+        """
+
+    def moveChildrenToTop(names):
+        """Move some children to the top, in the order given.
+
+        Same errors as `moveChildBefore`.
+        """
+
+    def moveChildrenToBottom(names):
+        """Move some children to the bottom, in the order given.
+
+        Same errors as `moveChildBefore`.
+        """
+
 
 ##################################################
 # Properties
@@ -201,6 +303,13 @@ class IProperty(Interface):
         Returns a unicode string.
         """
 
+    def getPath():
+        """Get the path of the property, including the document path.
+
+        Returns a string. The path is memoized, and recomputed only
+        when the property or one of its ancestors is renamed or moved.
+        """
+
     def setDTO(value):
         """Set a property from a DTO.
 
@@ -212,6 +321,8 @@ class IProperty(Interface):
         """Get a DTO from a property.
 
         Returns a Data Transfer Object, usually a basic python datastructure.
+        The DTO of object and list properties is shared and read-only,
+        `nuxeo.capsule.dto.copyDTO` gives a modifiable copy.
         """
 
 
@@ -293,6 +404,39 @@ class IResource(Interface):
         """Get a seekable file-like object for this resource.
         """
 
+    def openRange(offset, length=None):
+        """Get a seekable file-like object for a range of the resource.
+
+        The range is clipped to the resource, `length` None means up to
+        the end. Positions are relative to the start of the range.
+        """
+
+    def readRange(offset, length=None):
+        """Get a string containing a range of the resource.
+        """
+
+    def getBuffer():
+        """Get an object giving access to the data without copying it.
+
+        See `IBlob.getBuffer`.
+        """
+
+    def openBuffer():
+        """Get a context manager for the result of `getBuffer`.
+
+        See `IBlob.openBuffer`.
+        """
+
+    def getDigest(algorithm='sha256'):
+        """Get the hex digest of the data of the resource.
+
+        See `IBlob.getDigest`.
+        """
+
+    def getETag():
+        """Get an HTTP entity tag for the data of the resource.
+        """
+
     def getFileUpload():
         """Get a (fake) file upload for this resource.
         """
@@ -304,6 +448,63 @@ class IBlob(Interface):
     This is the DTO of a JCR Binary property.
     """
 
+    def __len__():
+        """Get the length of the data.
+        """
+
+    def __str__():
+        """Get a string containing the data.
+        """
+
+    def open():
+        """Get a seekable file-like object for the data.
+        """
+
+    def openRange(offset, length=None):
+        """Get a seekable file-like object for a range of the data.
+
+        The range is clipped to the data, `length` None means up to the
+        end. Positions are relative to the start of the range.
+        """
+
+    def readRange(offset, length=None):
+        """Get a string containing a range of the data.
+        """
+
+    def getBuffer():
+        """Get an object giving access to the data without copying it.
+
+        It has the buffer interface and supports len and slicing:
+        a memoryview, or for data in a file a read-only mmap. Slicing
+        an mmap copies the slice. An mmap holds the file mapped until
+        it is closed, so prefer `openBuffer`.
+        """
+
+    def openBuffer():
+        """Get a context manager for the result of `getBuffer`.
+
+        The buffer is closed on exit if it has to be.
+        """
+
+    def iterChunks(chunk_size):
+        """Iterate over the data by strings of `chunk_size` at most.
+        """
+
+    def getDigest(algorithm='sha256'):
+        """Get the hex digest of the data.
+
+        `algorithm` is 'sha1' or 'sha256'. The digest is computed once
+        and kept with the blob; the SHA-256 is usually computed while
+        the data is written.
+        """
+
+    def getETag():
+        """Get an HTTP entity tag for the data.
+
+        It is a quoted string derived from the SHA-256 digest, so that
+        conditional requests don't need to read the data.
+        """
+
 
 class IReference(Interface):
     """A reference to another object by UUID.
@@ -328,6 +529,14 @@ class IDocument(IObjectBase, IContainerBase):
         Returns a unicode string.
         """
 
+    def getPath():
+        """Get the path of the document.
+
+        Returns a string, '/' for the root. The path is memoized, and
+        recomputed only when the document or one of its ancestors is
+        renamed or moved.
+        """
+
     def getUUID():
         """Get the UUID for this document.
 
@@ -362,6 +571,9 @@ class IDocument(IObjectBase, IContainerBase):
         An IObjectWillBeMovedEvent event is sent.
         An IObjectMovedEvent event is sent.
         An IContainerModifiedEvent event on the container(s) is sent.
+
+        Implementations must move the document with `_moveChild` of the
+        children holder, which keeps the indexes of the workspace.
         """
 
     def copyDocument(destination, name):
@@ -418,7 +630,13 @@ class IDocument(IObjectBase, IContainerBase):
 
         Return None if the UUID does not exist.
 
-        The path is relative to the JCR workspace root.
+        The path is the one given by `getPath`.
+        """
+
+    def locateUUIDs(uuids):
+        """Get the paths of the docs with the given UUIDs.
+
+        Returns a list of paths, with None for nonexistent UUIDs.
         """
 
     def searchProperty(prop_name, value):
@@ -426,7 +644,31 @@ class IDocument(IObjectBase, IContainerBase):
 
         Returns a sequence of (uuid, path).
 
-        The paths are relative to the JCR workspace root.
+        The paths are those given by `getPath`.
+        """
+
+    def searchPropertyCursor(prop_name, value, token=None):
+        """Search the JCR for nodes where prop_name == 'value'.
+
+        Returns an ICursor giving the results lazily, resumed after the
+        results already seen if a `token` from a previous cursor is
+        passed.
+        """
+
+    def searchQuery(query):
+        """Search for nodes matching a `nuxeo.capsule.query.Query`.
+
+        Returns a sequence of (uuid, path), sorted as asked by the query.
+
+        The paths are those given by `getPath`.
+        """
+
+    def searchQueryCursor(query, token=None):
+        """Search for nodes matching a `nuxeo.capsule.query.Query`.
+
+        Returns an ICursor giving the results lazily, resumed after the
+        results already seen if a `token` from a previous cursor is
+        passed. The query must not be sorted.
         """
 
 
@@ -466,6 +708,180 @@ class IWorkspace(IDocument):
     """Capsule workspace, root of a tree of documents.
     """
 
+    def resolvePath(path, default=_MARKER):
+        """Get the document at a given path.
+
+        The path is relative to the workspace root. Resolved paths are
+        cached, so that resolving many paths sharing the same ancestors
+        doesn't walk the tree again.
+
+        If the document doesn't exist, returns the default or raises
+        KeyError if there is no default.
+        """
+
+    def resolvePaths(paths):
+        """Get the documents at several paths.
+
+        Returns a list of documents, with None for nonexistent paths.
+        """
+
+    def resolvePathPrefix(path):
+        """Get the deepest existing document on a path.
+
+        Returns a tuple (doc, rest), where `rest` is the tuple of the
+        names that could not be resolved below `doc`. `rest` is empty
+        if the whole path exists.
+        """
+
+    def getUUIDIndex():
+        """Get the UUID index used by `locateUUID`, or None.
+        """
+
+    def setUUIDIndex(index):
+        """Set the IUUIDIndex used by `locateUUID`.
+
+        The documents already in the tree are indexed, and the index is
+        then updated when documents are added or removed.
+        """
+
+    def getPropertyIndex():
+        """Get the property index used by `searchProperty`, or None.
+        """
+
+    def setPropertyIndex(index):
+        """Set the IPropertyIndex used by `searchProperty`.
+
+        The documents already in the tree are indexed, and the index is
+        then updated when documents are added or removed and when their
+        properties are set.
+
+        `searchProperty` also needs a UUID index to get the paths.
+        """
+
+    def getBlobStore():
+        """Get the IBlobStore used for resources, or None.
+        """
+
+    def setBlobStore(store):
+        """Set the IBlobStore used for resources.
+
+        The blobs of the resource properties set afterwards are written
+        to the store, and counted as references.
+
+        A store counts the references of one workspace only: raises
+        ValueError if the store is already used by another workspace.
+        """
+
+    def recountBlobs():
+        """Recount the references to the blobs of the blob store.
+
+        All the documents and properties of the workspace are walked,
+        loading them if needed, as well as the frozen versions that the
+        connector keeps outside the tree. References are only released
+        when a blob replaces another, and documents copied by a
+        connector don't add any, so the counts are only complete after
+        a recount.
+        """
+
+    def updateBlobDigests():
+        """Compute and store the missing digests of the blobs.
+
+        Blobs stored before digests existed don't have them, and a
+        digest computed when reading is not stored, so that reads never
+        write. All the documents and properties of the workspace are
+        walked, and the objects holding blobs that were updated are
+        written.
+
+        Returns the number of blobs updated.
+        """
+
+    def collectBlobGarbage():
+        """Remove the blobs of the blob store that are not referenced.
+
+        The references are recounted first, see `recountBlobs`.
+
+        Returns the sorted list of removed digests.
+        """
+
+
+class IBlobStore(Interface):
+    """A content-addressed store of blobs.
+
+    Blobs are keyed by a digest of their content, identical content is
+    stored once.
+    """
+
+    workspace = Attribute("The UUID of the workspace holding the "
+                          "references, set by its setBlobStore")
+
+    def __contains__(digest):
+        """Tell if a blob with this digest is stored.
+        """
+
+    def get(digest, default=None):
+        """Get the IBlob with this digest.
+        """
+
+    def store(blob):
+        """Store the content of an IBlob.
+
+        Returns the stored IBlob, whose `digest` attribute is its key.
+        """
+
+    def getRefCount(digest):
+        """Get the number of references to a blob.
+        """
+
+    def incref(digest):
+        """Add a reference to a blob.
+        """
+
+    def decref(digest):
+        """Remove a reference to a blob.
+        """
+
+    def recount(digests):
+        """Reset the references to those in an iterable of digests.
+
+        This is used to fix the counts after a scan of the content.
+        """
+
+    def collectGarbage():
+        """Remove the blobs that have no reference.
+
+        The counts must be complete, so this is normally called through
+        the `collectBlobGarbage` of the workspace.
+
+        Returns the sorted list of removed digests.
+        """
+
+
+class ICursor(Interface):
+    """Lazy results of a search.
+
+    Results are (uuid, path), in UUID order.
+    """
+
+    def __iter__():
+        """Iterate over the remaining results.
+        """
+
+    def fetch(size):
+        """Get the next `size` results at most.
+
+        Returns a list of (uuid, path), empty when there are no more.
+        """
+
+    def getToken():
+        """Get an opaque token to resume after the last fetched result.
+
+        Returns None if nothing has been fetched.
+        """
+
+    def count():
+        """Get the total number of results, without building them.
+        """
+
 
 ##################################################
 # Children (internal implementation detail of the Document class)
@@ -482,6 +898,101 @@ class IChildren(IContainerBase):
         """Get the type of this intermediate object.
         """
 
+##################################################
+# Indexes
+
+class IUUIDIndex(Interface):
+    """An index of documents by UUID.
+    """
+
+    def index(uuid, doc):
+        """Index a document under its UUID.
+        """
+
+    def unindex(uuid):
+        """Remove a UUID from the index.
+
+        Does nothing if the UUID is not indexed.
+        """
+
+    def get(uuid, default=None):
+        """Get the document with a given UUID, or the default.
+        """
+
+    def uuids():
+        """Get an iterable of all the UUIDs indexed.
+        """
+
+    def __len__():
+        """Get the number of documents indexed.
+        """
+
+
+class IPropertyIndex(Interface):
+    """An index of documents by property value.
+
+    Multi-valued properties are indexed under each of their values.
+    Complex properties are not indexed, nor are values that have no
+    stable order, like blobs. Implementations may also skip long
+    strings, like text bodies, that are not searched by equality; such
+    values are then not found by searches.
+    """
+
+    def isIndexed(name):
+        """Test if a property name is indexed.
+        """
+
+    def index(uuid, name, value):
+        """Index the value of a property of a document.
+
+        Replaces the value previously indexed for this property of this
+        document. A value of None just unindexes it.
+        """
+
+    def unindex(uuid):
+        """Remove all the indexed values for a document.
+        """
+
+    def search(name, value):
+        """Get the UUIDs of the documents where property `name` has
+        `value`, or one of its values for a multi-valued property.
+
+        Returns an iterable of UUIDs, in sorted order, that the caller
+        may keep or modify without changing the index.
+        """
+
+    def count(name, value):
+        """Get the number of UUIDs `search` would return.
+        """
+
+    def searchRange(name, min=None, max=None,
+                    excludemin=False, excludemax=False):
+        """Get the UUIDs of the documents where property `name` has a
+        value in a range. A bound of None means no bound.
+
+        Values not comparable with the bounds are ignored: numbers are
+        comparable with numbers, strings with strings, and other values
+        with values of the same class.
+
+        Returns an iterable of UUIDs, in sorted order.
+        """
+
+    def countRange(name, min=None, max=None,
+                   excludemin=False, excludemax=False):
+        """Get the number of UUIDs `searchRange` would return, without
+        building them.
+
+        A document with several values in the range, for a multi-valued
+        property, is counted once per value, so this is an upper bound
+        for multi-valued properties.
+        """
+
+    def getValues(uuid, name):
+        """Get the values indexed for a property of a document.
+
+        Returns a tuple, empty if nothing is indexed.
+        """
+
 ##################################################
 # Typing
 
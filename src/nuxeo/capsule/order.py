@@ -0,0 +1,219 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Order of children in ordered containers.
+"""
+
+from persistent import Persistent
+from persistent.list import PersistentList
+from BTrees.OOBTree import OOBTree
+
+
+class Order(Persistent):
+    """An ordered sequence of distinct names.
+
+    Names are stored in chunks of bounded size, each chunk being a
+    separate persistent list. The _where mapping gives the chunk holding
+    each name, and _sizes holds the length of each chunk, so that
+    finding, removing or accessing a name by position only touches one
+    chunk and never the whole sequence.
+
+    _chunks and _sizes are plain lists in the Order record, scanned to
+    find a chunk: operations are linear in the number of chunks, about
+    len / chunk_size, and each change writes that record again along
+    with the chunks modified.
+
+    The API is a subset of the list API, for compatibility with code
+    that used a plain list.
+    """
+
+    chunk_size = 128
+
+    def __init__(self, names=()):
+        self._setNames(names)
+
+    def _setNames(self, names):
+        self._chunks = []
+        self._sizes = []
+        self._where = OOBTree()
+        self._len = 0
+        chunk_size = self.chunk_size
+        chunk = None
+        for name in names:
+            if name in self._where:
+                raise ValueError("Duplicate name %r" % (name,))
+            if chunk is None or len(chunk) == chunk_size:
+                chunk = PersistentList()
+                self._chunks.append(chunk)
+                self._sizes.append(0)
+            chunk.append(name)
+            self._sizes[-1] += 1
+            self._where[name] = chunk
+            self._len += 1
+
+    def _locate(self, index):
+        """Find the chunk number and offset for a position.
+        """
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+        for i, size in enumerate(self._sizes):
+            if index < size:
+                return i, index
+            index -= size
+        raise IndexError(index)
+
+    def _chunkIndex(self, chunk):
+        for i, c in enumerate(self._chunks):
+            if c is chunk:
+                return i
+        raise ValueError(chunk)
+
+    def _changed(self):
+        # _sizes is a plain list
+        self._p_changed = True
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            for name in chunk:
+                yield name
+
+    def __contains__(self, name):
+        return name in self._where
+
+    def __getitem__(self, index):
+        i, offset = self._locate(index)
+        return self._chunks[i][offset]
+
+    def __repr__(self):
+        return 'Order(%r)' % list(self)
+
+    def iterSlice(self, start=0, stop=None):
+        """Iterate over the names from position `start` to `stop`.
+
+        Only the chunks concerned are accessed.
+        """
+        if start < 0:
+            start = max(0, start + self._len)
+        if stop is None or stop > self._len:
+            stop = self._len
+        elif stop < 0:
+            stop += self._len
+        count = stop - start
+        if count <= 0:
+            return
+        i, offset = self._locate(start)
+        for chunk in self._chunks[i:]:
+            names = chunk[offset:offset+count]
+            for name in names:
+                yield name
+            count -= len(names)
+            if not count:
+                break
+            offset = 0
+
+    def index(self, name):
+        """Get the position of a name.
+
+        Raises ValueError if the name is absent.
+        """
+        chunk = self._where.get(name)
+        if chunk is None:
+            raise ValueError("%r not in order" % (name,))
+        i = self._chunkIndex(chunk)
+        return sum(self._sizes[:i]) + chunk.index(name)
+
+    def append(self, name):
+        """Add a name at the end.
+        """
+        if name in self._where:
+            raise ValueError("Duplicate name %r" % (name,))
+        if self._chunks and self._sizes[-1] < self.chunk_size:
+            chunk = self._chunks[-1]
+            chunk.append(name)
+            self._sizes[-1] += 1
+        else:
+            chunk = PersistentList([name])
+            self._chunks.append(chunk)
+            self._sizes.append(1)
+        self._where[name] = chunk
+        self._len += 1
+        self._changed()
+
+    def insert(self, index, name):
+        """Insert a name before a position.
+
+        Like list.insert, an index past the end appends.
+        """
+        if name in self._where:
+            raise ValueError("Duplicate name %r" % (name,))
+        if index < 0:
+            index = max(0, index + self._len)
+        if index >= self._len:
+            self.append(name)
+            return
+        i, offset = self._locate(index)
+        chunk = self._chunks[i]
+        chunk.insert(offset, name)
+        self._sizes[i] += 1
+        self._where[name] = chunk
+        self._len += 1
+        if self._sizes[i] > 2 * self.chunk_size:
+            self._split(i)
+        self._changed()
+
+    def _split(self, i):
+        chunk = self._chunks[i]
+        half = len(chunk) // 2
+        new = PersistentList(chunk[half:])
+        del chunk[half:]
+        for name in new:
+            self._where[name] = new
+        self._chunks.insert(i + 1, new)
+        self._sizes[i] = len(chunk)
+        self._sizes.insert(i + 1, len(new))
+
+    def move(self, name, index):
+        """Move a name so that it ends up at the given position.
+        """
+        self.remove(name)
+        self.insert(index, name)
+
+    def remove(self, name):
+        """Remove a name.
+
+        Raises ValueError if the name is absent.
+        """
+        chunk = self._where.get(name)
+        if chunk is None:
+            raise ValueError("%r not in order" % (name,))
+        i = self._chunkIndex(chunk)
+        chunk.remove(name)
+        del self._where[name]
+        self._sizes[i] -= 1
+        self._len -= 1
+        if not self._sizes[i]:
+            del self._chunks[i]
+            del self._sizes[i]
+        self._changed()
+
+    def reorder(self, names):
+        """Replace the whole order.
+        """
+        self._setNames(names)
@@ -0,0 +1,537 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Queries over document properties.
+
+A query is made of predicates combined with And and Or, for instance::
+
+  Query(And(TypeIs('Article'), Range('dc:modified', min=t),
+            PathPrefix('sections/news')),
+        sort_on='dc:modified', reverse=True, limit=20)
+
+Queries are executed against the property index and the UUID index of a
+workspace. For an And, the planner starts from the most selective
+predicate using an index, intersects the candidates with the other
+selective ones, and checks the remaining predicates on each candidate.
+
+Candidate sets are sorted sets of UUIDs.
+
+A Cursor gives the results of a query without sorting lazily, in
+batches, and can be resumed from an opaque token.
+"""
+
+import heapq
+import binascii
+from base64 import urlsafe_b64encode
+from base64 import urlsafe_b64decode
+from itertools import islice
+
+from BTrees.OOBTree import OOSet
+from BTrees.OOBTree import OOTreeSet
+from BTrees.OOBTree import intersection
+from BTrees.OOBTree import union
+
+import zope.interface
+from nuxeo.capsule.interfaces import ICursor
+from nuxeo.capsule.index import _getIndexValues
+from nuxeo.capsule.index import _indexKey
+from nuxeo.capsule.index import _inRange
+
+TYPE_PROPERTY = 'jcr:primaryType'
+
+
+class QueryContext(object):
+    """What a query needs to run: the indexes of a workspace.
+
+    The plan attribute lists the steps taken, for introspection.
+    """
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.index = workspace.getPropertyIndex()
+        self.uuid_index = workspace.getUUIDIndex()
+        self.plan = []
+
+    def getValues(self, uuid, name):
+        if self.index.isIndexed(name):
+            return self.index.getValues(uuid, name)
+        doc = self.uuid_index.get(uuid)
+        if doc is None:
+            return ()
+        if name == TYPE_PROPERTY:
+            return (doc.getTypeName(),)
+        return _getIndexValues(doc.getProperty(name, None))
+
+    def getPath(self, uuid):
+        doc = self.uuid_index.get(uuid)
+        if doc is None:
+            return None
+        return doc.getPath()
+
+    def allUUIDs(self):
+        return OOTreeSet(self.uuid_index.uuids())
+
+
+class Predicate(object):
+    """Base class for predicates.
+    """
+
+    def estimate(self, context):
+        """Estimate the number of candidates using an index.
+
+        Returns None if no index can be used.
+        """
+        return None
+
+    def candidates(self, context):
+        """Get the sorted set of UUIDs matching, using an index.
+
+        The set may be the one kept by the index, and must not be
+        modified.
+        """
+        raise NotImplementedError
+
+    def count(self, context):
+        """Count the UUIDs matching using an index, without building them.
+
+        Returns None if the index can't count them exactly.
+        """
+        return None
+
+    def matches(self, context, uuid):
+        """Check if a document matches.
+        """
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+
+class Eq(Predicate):
+    """Property `name` is `value`, or has it for a multi-valued property.
+    """
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        return 'Eq(%r, %r)' % (self.name, self.value)
+
+    def estimate(self, context):
+        if not context.index.isIndexed(self.name):
+            return None
+        return context.index.count(self.name, self.value)
+
+    def candidates(self, context):
+        # Not copied, as search does
+        uuids = context.index._getUUIDs(self.name, self.value)
+        if not uuids:
+            return OOTreeSet()
+        return uuids
+
+    def count(self, context):
+        return self.estimate(context)
+
+    def matches(self, context, uuid):
+        # Compared as index keys, like the index does
+        return _matchesKeys(context, uuid, self.name,
+                            (_indexKey(self.value),))
+
+
+class TypeIs(Eq):
+    """Document has type `type_name`.
+    """
+
+    def __init__(self, type_name):
+        Eq.__init__(self, TYPE_PROPERTY, type_name)
+
+    def __repr__(self):
+        return 'TypeIs(%r)' % (self.value,)
+
+
+class In(Predicate):
+    """Property `name` has one of `values`.
+    """
+
+    def __init__(self, name, values):
+        self.name = name
+        self.values = tuple(values)
+
+    def __repr__(self):
+        return 'In(%r, %r)' % (self.name, self.values)
+
+    def estimate(self, context):
+        if not context.index.isIndexed(self.name):
+            return None
+        return sum([context.index.count(self.name, v) for v in self.values])
+
+    def candidates(self, context):
+        result = OOTreeSet()
+        for v in self.values:
+            result.update(context.index._getUUIDs(self.name, v))
+        return result
+
+    def matches(self, context, uuid):
+        return _matchesKeys(context, uuid, self.name,
+                            [_indexKey(v) for v in self.values])
+
+
+class Range(Predicate):
+    """Property `name` has a value between `min` and `max`.
+
+    A bound of None means no bound.
+    """
+
+    def __init__(self, name, min=None, max=None,
+                 excludemin=False, excludemax=False):
+        self.name = name
+        self.min = min
+        self.max = max
+        self.excludemin = excludemin
+        self.excludemax = excludemax
+
+    def __repr__(self):
+        return 'Range(%r, %r, %r)' % (self.name, self.min, self.max)
+
+    def _args(self):
+        return (self.name, self.min, self.max,
+                self.excludemin, self.excludemax)
+
+    def estimate(self, context):
+        if not context.index.isIndexed(self.name):
+            return None
+        return context.index.countRange(*self._args())
+
+    def candidates(self, context):
+        return context.index.searchRange(*self._args())
+
+    def matches(self, context, uuid):
+        for v in context.getValues(uuid, self.name):
+            if _inRange(v, self.min, self.max,
+                        self.excludemin, self.excludemax):
+                return True
+        return False
+
+
+class PathPrefix(Predicate):
+    """Document is `path` or under it.
+
+    The path is compared to the one given by `getPath`, the leading
+    slash is optional.
+    """
+
+    def __init__(self, path):
+        self.path = '/' + path.strip('/')
+
+    def __repr__(self):
+        return 'PathPrefix(%r)' % (self.path,)
+
+    def matches(self, context, uuid):
+        path = context.getPath(uuid)
+        if path is None:
+            return False
+        if self.path == '/':
+            return True
+        return path == self.path or path.startswith(self.path + '/')
+
+
+class And(Predicate):
+    """All the predicates match.
+    """
+
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def __repr__(self):
+        return 'And%r' % (self.predicates,)
+
+    def estimate(self, context):
+        estimates = [p.estimate(context) for p in self.predicates]
+        estimates = [e for e in estimates if e is not None]
+        if not estimates:
+            return None
+        return min(estimates)
+
+    def _plan(self, context):
+        """Get the candidates from indexes, and the predicates to check.
+        """
+        indexed = []
+        filters = []
+        for i, p in enumerate(self.predicates):
+            estimate = p.estimate(context)
+            if estimate is None:
+                filters.append(p)
+            else:
+                indexed.append((estimate, i, p))
+        indexed.sort()
+        if indexed:
+            estimate, i, p = indexed.pop(0)
+            context.plan.append(('index', p, estimate))
+            result = p.candidates(context)
+            # Bounds the size of the result, which isn't counted as
+            # that walks all of it
+            size = estimate
+        else:
+            context.plan.append(('scan', None, None))
+            result = context.allUUIDs()
+        for estimate, i, p in indexed:
+            if not result:
+                break
+            if estimate <= size:
+                context.plan.append(('intersect', p, estimate))
+                result = intersection(result, p.candidates(context))
+            else:
+                # Cheaper to check the few candidates left
+                filters.append(p)
+        for p in filters:
+            context.plan.append(('filter', p, None))
+        return result, filters
+
+    def candidates(self, context):
+        result, filters = self._plan(context)
+        if filters:
+            result = OOSet([uuid for uuid in result
+                            if _matchesAll(context, filters, uuid)])
+        return result
+
+    def matches(self, context, uuid):
+        for p in self.predicates:
+            if not p.matches(context, uuid):
+                return False
+        return True
+
+
+class Or(Predicate):
+    """One of the predicates matches.
+    """
+
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def __repr__(self):
+        return 'Or%r' % (self.predicates,)
+
+    def estimate(self, context):
+        total = 0
+        for p in self.predicates:
+            estimate = p.estimate(context)
+            if estimate is None:
+                return None
+            total += estimate
+        return total
+
+    def candidates(self, context):
+        if self.estimate(context) is None:
+            context.plan.append(('scan', None, None))
+            return OOSet([uuid for uuid in context.allUUIDs()
+                          if self.matches(context, uuid)])
+        result = OOSet()
+        for p in self.predicates:
+            result = union(result, p.candidates(context))
+        return result
+
+    def matches(self, context, uuid):
+        for p in self.predicates:
+            if p.matches(context, uuid):
+                return True
+        return False
+
+
+def _matchesKeys(context, uuid, name, keys):
+    """Check if a value of property `name` has one of the index `keys`.
+    """
+    keys = set(keys)
+    keys.discard(None)
+    if not keys:
+        return False
+    for v in context.getValues(uuid, name):
+        if _indexKey(v) in keys:
+            return True
+    return False
+
+def _matchesAll(context, predicates, uuid):
+    for p in predicates:
+        if not p.matches(context, uuid):
+            return False
+    return True
+
+
+class Query(object):
+    """A query: a predicate, with optional sorting and limit.
+
+    Without `sort_on`, results are sorted by UUID. With `sort_on`,
+    documents with the same value are sorted by UUID.
+    """
+
+    def __init__(self, where, sort_on=None, reverse=False, limit=None):
+        self.where = where
+        self.sort_on = sort_on
+        self.reverse = reverse
+        self.limit = limit
+
+    def _plan(self, context):
+        """Get the candidates from indexes, and the predicates to check.
+        """
+        where = self.where
+        if not isinstance(where, And):
+            if where.estimate(context) is not None:
+                return where.candidates(context), ()
+            # Let And plan the full scan
+            where = And(where)
+        return where._plan(context)
+
+    def _getUUIDs(self, context):
+        uuids, filters = self._plan(context)
+        if filters:
+            uuids = OOSet([uuid for uuid in uuids
+                           if _matchesAll(context, filters, uuid)])
+        return uuids
+
+    def execute(self, context):
+        """Get the list of matching UUIDs.
+        """
+        uuids = self._getUUIDs(context)
+        limit = self.limit
+        if self.sort_on is None:
+            if self.reverse:
+                uuids = reversed(list(uuids))
+            if limit is not None:
+                result = []
+                for uuid in uuids:
+                    if len(result) == limit:
+                        break
+                    result.append(uuid)
+                return result
+            return list(uuids)
+        name = self.sort_on
+        def key(uuid):
+            # Index keys, so that values of different types are compared
+            # by group rather than raising TypeError
+            keys = [_indexKey(v) for v in context.getValues(uuid, name)]
+            keys = [k for k in keys if k is not None]
+            if not keys:
+                # Sort missing values first without comparing them
+                return (0, None, uuid)
+            return (1, min(keys), uuid)
+        if limit is None:
+            return sorted(uuids, key=key, reverse=self.reverse)
+        if self.reverse:
+            return heapq.nlargest(limit, uuids, key=key)
+        return heapq.nsmallest(limit, uuids, key=key)
+
+
+def _encodeToken(uuid):
+    if isinstance(uuid, unicode):
+        uuid = uuid.encode('utf-8')
+    return urlsafe_b64encode(uuid)
+
+def _decodeToken(token):
+    try:
+        return urlsafe_b64decode(str(token))
+    except (TypeError, binascii.Error):
+        raise ValueError("Invalid token %r" % (token,))
+
+
+class Cursor(object):
+    """Lazy results of a query, as (uuid, path) in UUID order.
+
+    The candidates given by the indexes are walked from the position of
+    the token, and the predicates that could not use an index are
+    checked as results are fetched. Paths are computed by batches. For
+    an Eq, the candidates are the set kept by the index, so a page
+    doesn't cost more than the results it holds.
+
+    Queries with `sort_on` or `reverse` need all the results before
+    returning the first one, and cannot be used with a cursor. The
+    `limit` of the query is not used, fetch gives the size of a page.
+    """
+
+    zope.interface.implements(ICursor)
+
+    batch_size = 100
+
+    def __init__(self, context, query, token=None):
+        if query.sort_on is not None or query.reverse:
+            raise ValueError("Cannot use a cursor on a sorted query")
+        self.context = context
+        self._where = query.where
+        self._uuids, self._filters = query._plan(context)
+        if token is None:
+            self._last = None
+        else:
+            self._last = _decodeToken(token)
+
+    def _iterUUIDs(self):
+        if self._last is None:
+            uuids = self._uuids.keys()
+        else:
+            uuids = self._uuids.keys(min=self._last, excludemin=True)
+        context = self.context
+        filters = self._filters
+        for uuid in uuids:
+            if _matchesAll(context, filters, uuid):
+                yield uuid
+
+    def __iter__(self):
+        while True:
+            batch = self.fetch(self.batch_size)
+            if not batch:
+                break
+            for result in batch:
+                yield result
+
+    def fetch(self, size):
+        """Get the next `size` results at most.
+
+        Returns a list of (uuid, path), empty when there are no more.
+        """
+        uuids = list(islice(self._iterUUIDs(), size))
+        if uuids:
+            self._last = uuids[-1]
+        return [(uuid, self.context.getPath(uuid)) for uuid in uuids]
+
+    def getToken(self):
+        """Get a token to resume after the last fetched result.
+
+        Returns None if nothing has been fetched.
+        """
+        if self._last is None:
+            return None
+        return _encodeToken(self._last)
+
+    def count(self):
+        """Get the total number of results, fetched or not.
+
+        When all the predicates use an index this is counted by the
+        index if it can, or else is the size of the candidate set,
+        otherwise the candidates are checked but the results are not
+        built.
+        """
+        if not self._filters:
+            count = self._where.count(self.context)
+            if count is not None:
+                return count
+            return len(self._uuids)
+        context = self.context
+        filters = self._filters
+        n = 0
+        for uuid in self._uuids:
+            if _matchesAll(context, filters, uuid):
+                n += 1
+        return n
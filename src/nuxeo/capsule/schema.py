@@ -26,6 +26,10 @@ class SchemaManager(object):
     """A Schema Manager knows about registered schemas.
 
     Each schema may be tied to a class too.
+
+    The class of a name is resolved once, by walking the resolution order
+    of its schema, and cached. Setting a class for a schema only clears
+    the cached names whose resolution went through that schema.
     """
     zope.interface.implements(ISchemaManager)
 
@@ -36,7 +40,9 @@ class SchemaManager(object):
         self._schemas = {} # all schemas including aliases
         self._schemas_unaliased = set() # no aliases here
         self._classes_spec = {} # spec of name -> class
+        self._schema_classes = {} # schema -> class, for registered names
         self._classes = {} # resolved name -> class, None means KeyError
+        self._dependents = {} # schema -> names whose resolution used it
 
     def getSchemas(self):
         """See `nuxeo.capsule.interfaces.ISchemaManager`
@@ -64,20 +70,10 @@ class SchemaManager(object):
             if name in self._classes:
                 klass = self._classes[name]
             else:
-                # Find most specific schema extending the one passed
                 if name not in self._schemas:
                     print 'XXX %s not in schemas!' % name
                 schema = self._schemas[name]
-                klass = None
-                for n, k in self._classes_spec.iteritems():
-                    if n not in self._schemas:
-                        #print 'XXX %s in classes but not schemas!' % n
-                        continue
-                    s = self._schemas[n]
-                    if schema.isOrExtends(s):
-                        if klass is None or s.extends(best):
-                            klass = k
-                            best = s
+                klass = self._resolveClass(name, schema)
                 self._classes[name] = klass
             if klass is None:
                 raise KeyError(name)
@@ -87,8 +83,27 @@ class SchemaManager(object):
             raise
         return klass
 
+    def _resolveClass(self, name, schema):
+        """Find the class of the most specific base of a schema.
+
+        The bases are looked at in resolution order, each one noting
+        `name` as a dependent so that setting its class invalidates the
+        resolution.
+        """
+        for base in schema.__iro__:
+            self._dependents.setdefault(base, set()).add(name)
+            klass = self._schema_classes.get(base)
+            if klass is not None:
+                return klass
+        return None
+
     # Management
 
+    def _setSchemaClass(self, schema, klass):
+        self._schema_classes[schema] = klass
+        for name in self._dependents.pop(schema, ()):
+            self._classes.pop(name, None)
+
     def _addSchema(self, name, schema):
         if name in self._schemas:
             if self._schemas[name] == schema:
@@ -98,6 +113,9 @@ class SchemaManager(object):
         if not IInterface.providedBy(schema):
             raise ValueError("Schema %r is not an Interface" % name)
         self._schemas[name] = schema
+        if name in self._classes_spec:
+            # Class set before the schema was known
+            self._setSchemaClass(schema, self._classes_spec[name])
 
     def addSchema(self, name, schema):
         """See `nuxeo.capsule.interfaces.ISchemaManager`
@@ -106,7 +124,6 @@ class SchemaManager(object):
         self._schemas_unaliased.add(name)
         if name != schema.getName():
             self._addSchema(schema.getName(), schema)
-        self._classes = {}
 
     def setClass(self, name, klass):
         """See `nuxeo.capsule.interfaces.ISchemaManager`
@@ -121,4 +138,5 @@ class SchemaManager(object):
                                  (name, prev, klass))
             # New definition can override the old one
         self._classes_spec[name] = klass
-        self._classes = {}
+        if name in self._schemas:
+            self._setSchemaClass(self._schemas[name], klass)
@@ -0,0 +1,103 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Benchmark of compressed blobs: compression ratio and read latency.
+
+Run with:
+
+  python bench_compression.py [directory]
+
+Without a directory, a sample corpus of text, XML, JSON and random
+binary data is generated. Otherwise all the files of the directory are
+used.
+"""
+
+import os
+import sys
+import time
+import random
+
+from nuxeo.capsule.base import Blob
+from nuxeo.capsule.base import CompressedBlob
+from nuxeo.capsule.dto import json
+
+REPEAT = 20
+
+
+def sampleCorpus():
+    rnd = random.Random(42)
+    words = ['document', 'capsule', 'property', 'schema', 'workspace',
+             'version', 'the', 'of', 'and', 'a', 'to', 'in', 'is', 'for']
+    def text(n):
+        return ' '.join([rnd.choice(words) for i in xrange(n)])
+    corpus = {}
+    corpus['text-small'] = text(200)
+    corpus['text-large'] = text(200000)
+    corpus['xml'] = ''.join(['<item id="%d"><title>%s</title></item>\n'
+                             % (i, text(8)) for i in xrange(20000)])
+    corpus['json'] = json.dumps([{'id': i, 'title': text(8), 'tags': words[:3]}
+                                 for i in xrange(20000)])
+    corpus['binary'] = ''.join([chr(rnd.randrange(256))
+                                for i in xrange(1000000)])
+    return corpus
+
+def fileCorpus(directory):
+    corpus = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            corpus[name] = open(path, 'rb').read()
+    return corpus
+
+def timeRead(blob):
+    start = time.time()
+    for i in xrange(REPEAT):
+        f = blob.open()
+        while f.read(65536):
+            pass
+    return (time.time() - start) / REPEAT
+
+def timeRange(blob):
+    start = time.time()
+    for i in xrange(REPEAT):
+        blob.readRange(len(blob) // 2, 4096)
+    return (time.time() - start) / REPEAT
+
+def main(args):
+    if args:
+        corpus = fileCorpus(args[0])
+    else:
+        corpus = sampleCorpus()
+    print '%-16s %10s %10s %6s %10s %10s %10s %10s' % (
+        'name', 'size', 'compr', 'ratio', 'compress', 'read raw',
+        'read zlib', 'range zlib')
+    total = total_compressed = 0
+    for name, data in sorted(corpus.items()):
+        raw = Blob(data)
+        start = time.time()
+        blob = CompressedBlob.fromBlob(raw)
+        compress_time = time.time() - start
+        total += len(data)
+        total_compressed += len(blob.compressed)
+        print '%-16s %10d %10d %5.1f%% %8.2fms %8.2fms %8.2fms %8.2fms' % (
+            name, len(data), len(blob.compressed),
+            100.0 * len(blob.compressed) / max(len(data), 1),
+            compress_time * 1000, timeRead(raw) * 1000,
+            timeRead(blob) * 1000, timeRange(blob) * 1000)
+    print '%-16s %10d %10d %5.1f%%' % ('total', total, total_compressed,
+                                       100.0 * total_compressed / total)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
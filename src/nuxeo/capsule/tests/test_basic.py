@@ -43,11 +43,36 @@ class InterfaceTests(unittest.TestCase):
         from nuxeo.capsule.base import Document
         verifyClass(IDocument, Document)
 
+    def test_Workspace(self):
+        from nuxeo.capsule.interfaces import IWorkspace
+        from nuxeo.capsule.base import Workspace
+        verifyClass(IWorkspace, Workspace)
+
+    def test_UUIDIndex(self):
+        from nuxeo.capsule.interfaces import IUUIDIndex
+        from nuxeo.capsule.index import UUIDIndex
+        verifyClass(IUUIDIndex, UUIDIndex)
+
+    def test_PropertyIndex(self):
+        from nuxeo.capsule.interfaces import IPropertyIndex
+        from nuxeo.capsule.index import PropertyIndex
+        verifyClass(IPropertyIndex, PropertyIndex)
+
+    def test_Cursor(self):
+        from nuxeo.capsule.interfaces import ICursor
+        from nuxeo.capsule.query import Cursor
+        verifyClass(ICursor, Cursor)
+
     def test_Children(self):
         from nuxeo.capsule.interfaces import IChildren
         from nuxeo.capsule.base import Children
         verifyClass(IChildren, Children)
 
+    def test_BTreeChildren(self):
+        from nuxeo.capsule.interfaces import IChildren
+        from nuxeo.capsule.base import BTreeChildren
+        verifyClass(IChildren, BTreeChildren)
+
     def test_ListPropertyField(self):
         from nuxeo.capsule.interfaces import IListPropertyField
         from nuxeo.capsule.field import ListPropertyField
@@ -79,6 +104,26 @@ class InterfaceTests(unittest.TestCase):
         from nuxeo.capsule.base import Blob
         verifyClass(IBlob, Blob)
 
+    def test_FileBlob(self):
+        from nuxeo.capsule.interfaces import IBlob
+        from nuxeo.capsule.base import FileBlob
+        verifyClass(IBlob, FileBlob)
+
+    def test_CompressedBlob(self):
+        from nuxeo.capsule.interfaces import IBlob
+        from nuxeo.capsule.base import CompressedBlob
+        verifyClass(IBlob, CompressedBlob)
+
+    def test_ChunkedBlob(self):
+        from nuxeo.capsule.interfaces import IBlob
+        from nuxeo.capsule.base import ChunkedBlob
+        verifyClass(IBlob, ChunkedBlob)
+
+    def test_FileSystemBlobStore(self):
+        from nuxeo.capsule.interfaces import IBlobStore
+        from nuxeo.capsule.blobstore import FileSystemBlobStore
+        verifyClass(IBlobStore, FileSystemBlobStore)
+
     def test_Resource(self):
         from nuxeo.capsule.interfaces import IResource
         from nuxeo.capsule.base import Resource
@@ -105,6 +150,62 @@ def test_Reference():
     >>> r1, r2 = Reference('abc'), Reference('abc')
     >>> r1 == r2, r1 is r2
     (True, False)
+    >>> hash(r1) == hash(r2)
+    True
+
+    """
+
+def test_LRUCache():
+    """
+    >>> from nuxeo.capsule.cache import LRUCache
+    >>> cache = LRUCache(3)
+    >>> cache['a'] = 1; cache['b'] = 2; cache['c'] = 3
+    >>> cache.get('a')
+    1
+    >>> cache['d'] = 4
+    >>> sorted(cache.keys())
+    ['a', 'c', 'd']
+    >>> cache.get('b', 'no')
+    'no'
+    >>> cache['c'] = 33; cache['e'] = 5
+    >>> sorted(cache.keys())
+    ['c', 'd', 'e']
+    >>> del cache['d']
+    >>> len(cache), 'd' in cache
+    (2, False)
+    >>> cache[('x',)] = 1; cache[('x', 'y')] = 2; cache[('z',)] = 3
+    >>> cache.invalidatePrefix(('x',))
+    >>> sorted(cache.keys())
+    [('z',)]
+
+    """
+
+def test_PropertiesView():
+    """
+    >>> from zope.interface import Interface
+    >>> from nuxeo.capsule.base import ObjectBase
+    >>> ob = ObjectBase('ob', Interface)
+    >>> ob.setProperty('a', 1)
+    >>> view = ob.getPropertiesView()
+    >>> view['a'], view.get('b'), 'a' in view, len(view)
+    (1, None, True, 1)
+    >>> ob.setProperty('b', 2)
+    >>> sorted(view.items())
+    [('a', 1), ('b', 2)]
+    >>> view == ob.getProperties()
+    True
+    >>> view['c'] = 3
+    Traceback (most recent call last):
+    ...
+    TypeError: Properties view is read-only
+    >>> view.update({'c': 3})
+    Traceback (most recent call last):
+    ...
+    TypeError: Properties view is read-only
+    >>> from zope.interface.common.mapping import IEnumerableMapping
+    >>> from zope.interface.verify import verifyObject
+    >>> verifyObject(IEnumerableMapping, view)
+    True
 
     """
 
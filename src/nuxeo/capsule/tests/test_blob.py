@@ -0,0 +1,438 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Blob tests.
+"""
+
+import os
+import copy
+import cPickle
+import unittest
+import tempfile
+from hashlib import sha1
+from hashlib import sha256
+from cStringIO import StringIO
+
+from zope.interface import Interface
+
+from nuxeo.capsule.base import Blob
+from nuxeo.capsule.base import FileBlob
+from nuxeo.capsule.base import CompressedBlob
+from nuxeo.capsule.base import ChunkedBlob
+from nuxeo.capsule.base import LazyFile
+from nuxeo.capsule.base import Resource
+from nuxeo.capsule.base import ResourceProperty
+from nuxeo.capsule.base import iterPdataChunks
+from nuxeo.capsule.tests.test_document import makeTree
+
+DATA = ''.join([chr(i % 256) for i in range(1000)])
+
+
+def checkRanges(test, blob):
+    test.assertEquals(blob.readRange(100, 10), DATA[100:110])
+    test.assertEquals(blob.readRange(990), DATA[990:])
+    test.assertEquals(blob.readRange(995, 10), DATA[995:])
+    test.assertEquals(blob.readRange(2000, 10), '')
+    test.assertEquals(blob.readRange(-5, 10), DATA[:10])
+    f = blob.openRange(100, 50)
+    test.assertEquals(len(f), 50)
+    test.assertEquals(f.read(10), DATA[100:110])
+    test.assertEquals(f.tell(), 10)
+    f.seek(-5, 2)
+    test.assertEquals(f.read(), DATA[145:150])
+    test.assertEquals(f.read(), '')
+    f.seek(0)
+    test.assertEquals(''.join(f), DATA[100:150])
+    f.close()
+
+
+class DummyPdata(object):
+    """A link of a Zope 2 Pdata chain.
+    """
+    _p_jar = None
+
+    def __init__(self, data, next=None):
+        self.data = data
+        self.next = next
+
+def makePdata(data, size):
+    chain = None
+    for pos in reversed(range(0, len(data), size)):
+        chain = DummyPdata(data[pos:pos+size], chain)
+    return chain
+
+
+class BlobTests(unittest.TestCase):
+
+    def test_Blob(self):
+        blob = Blob(DATA)
+        self.assertEquals(len(blob), 1000)
+        self.assertEquals(list(blob.iterChunks(400)),
+                          [DATA[:400], DATA[400:800], DATA[800:]])
+        f = blob.open()
+        f.seek(990)
+        self.assertEquals(f.read(), DATA[990:])
+
+    def test_ranges(self):
+        blob = Blob(DATA)
+        checkRanges(self, blob)
+        buf = blob.getBuffer()
+        self.assert_(isinstance(buf, memoryview))
+        self.assertEquals(buf[10:20].tobytes(), DATA[10:20])
+
+    def test_digest(self):
+        blob = Blob(DATA)
+        self.assertEquals(blob.getDigest(), sha256(DATA).hexdigest())
+        self.assertEquals(blob.getDigest('sha1'), sha1(DATA).hexdigest())
+        self.assertEquals(blob.getETag(), '"%s"' % sha256(DATA).hexdigest())
+        self.assertRaises(ValueError, blob.getDigest, 'md5')
+        # Digests are computed once, and pickled with the blob
+        blob.data = 'changed'
+        self.assertEquals(blob.getDigest(), sha256(DATA).hexdigest())
+        blob = cPickle.loads(cPickle.dumps(blob, 1))
+        self.assertEquals(blob.getDigest('sha1'), sha1(DATA).hexdigest())
+
+    def test_resource_digest(self):
+        rp = ResourceProperty('file', Interface)
+        rp.setDTO(Resource(Blob(DATA), mime_type='application/octet-stream'))
+        blob = rp.getProperty('jcr:data')
+        # Computed when the resource was set
+        self.assertEquals(blob._digests, {'sha256': sha256(DATA).hexdigest()})
+        resource = rp.getDTO()
+        self.assertEquals(resource.getDigest(), sha256(DATA).hexdigest())
+        self.assertEquals(resource.getETag(), blob.getETag())
+
+    def test_resource_legacy_digest(self):
+        # A blob stored before digests existed
+        root = makeTree()
+        rp = ResourceProperty('file', Interface)
+        root['a'].setProperty('file', rp)
+        blob = Blob(DATA)
+        rp.setProperty('jcr:data', blob)
+        jar = StorageJar()
+        jar.add(rp)
+        resource = rp.getDTO()
+        self.assertEquals(resource.getETag(), blob.getETag())
+        # Reading doesn't write
+        self.failIf(rp._p_changed)
+        blob._digests = None
+        self.assertEquals(root.updateBlobDigests(), 1)
+        self.assertEquals(blob._digests, {'sha256': sha256(DATA).hexdigest()})
+        self.assert_(rp._p_changed)
+        rp._p_changed = False
+        self.assertEquals(root.updateBlobDigests(), 0)
+        self.failIf(rp._p_changed)
+
+
+class FileBlobTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.write(fd, DATA)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_file(self):
+        blob = FileBlob(self.filename)
+        self.assertEquals(len(blob), 1000)
+        self.assertEquals(str(blob), DATA)
+        self.assertEquals(''.join(blob.iterChunks(300)), DATA)
+        self.assertEquals(len(list(blob.iterChunks(300))), 4)
+        f = blob.open()
+        f.seek(500)
+        self.assertEquals(f.read(10), DATA[500:510])
+        f.close()
+        del blob
+        self.assert_(os.path.exists(self.filename))
+
+    def test_ranges(self):
+        blob = FileBlob(self.filename)
+        checkRanges(self, blob)
+        buf = blob.getBuffer()
+        self.assertEquals(len(buf), 1000)
+        self.assertEquals(buf[10:20], DATA[10:20])
+        f = StringIO()
+        f.write(buffer(buf, 990))
+        self.assertEquals(f.getvalue(), DATA[990:])
+        buf.close()
+
+    def test_openBuffer(self):
+        blob = FileBlob(self.filename)
+        with blob.openBuffer() as buf:
+            self.assertEquals(len(buf), 1000)
+            self.assertEquals(str(buffer(buf, 10, 10)), DATA[10:20])
+        # The mapping is closed
+        self.assertRaises(ValueError, len, buf)
+        with Blob(DATA).openBuffer() as buf:
+            self.assertEquals(buf[:5].tobytes(), DATA[:5])
+
+    def test_fromFile(self):
+        blob = FileBlob.fromFile(StringIO(DATA), chunk_size=64)
+        self.assert_(blob.temporary)
+        self.assertEquals(len(blob), 1000)
+        self.assertEquals(str(blob), DATA)
+        filename = blob.filename
+        self.assertNotEquals(filename, self.filename)
+        del blob
+        self.assert_(not os.path.exists(filename))
+
+    def test_temporary_copies(self):
+        blob = FileBlob.fromFile(StringIO(DATA))
+        filename = blob.filename
+        # Copies don't own the file
+        for copier in (copy.copy,
+                       lambda blob: cPickle.loads(cPickle.dumps(blob, 2))):
+            other = copier(blob)
+            self.failIf(other.temporary)
+            self.assertEquals(other.filename, filename)
+            del other
+            self.assert_(os.path.exists(filename))
+        self.assert_(blob.temporary)
+        del blob
+        self.assert_(not os.path.exists(filename))
+
+    def test_fromChunks(self):
+        blob = FileBlob.fromChunks(iterPdataChunks(makePdata(DATA, 300)))
+        self.assert_(blob.temporary)
+        self.assertEquals(str(blob), DATA)
+        self.assertEquals(blob._digests, {'sha256': sha256(DATA).hexdigest()})
+        def failing():
+            yield 'abc'
+            raise IOError
+        def tempFiles():
+            return [name for name in os.listdir(tempfile.gettempdir())
+                    if name.startswith('capsule-blob-')]
+        before = tempFiles()
+        self.assertRaises(IOError, FileBlob.fromChunks, failing())
+        self.assertEquals(tempFiles(), before)
+
+    def test_iterPdataChunks(self):
+        chunks = list(iterPdataChunks(makePdata(DATA, 300)))
+        self.assertEquals([len(chunk) for chunk in chunks],
+                          [300, 300, 300, 100])
+        self.assertEquals(''.join(chunks), DATA)
+        deactivated = []
+        class DummyJar(object):
+            pass
+        class PersistentPdata(DummyPdata):
+            _p_jar = DummyJar()
+            def _p_deactivate(self):
+                deactivated.append(self.data)
+        chain = PersistentPdata('ab', PersistentPdata('', PersistentPdata('c')))
+        self.assertEquals(list(iterPdataChunks(chain)), ['ab', 'c'])
+        self.assertEquals(deactivated, ['ab', '', 'c'])
+
+    def test_resource(self):
+        blob = FileBlob(self.filename)
+        rp = ResourceProperty('file', Interface)
+        rp.setDTO(Resource(blob, mime_type='application/octet-stream'))
+        resource = rp.getDTO()
+        self.assert_(resource.blob is blob)
+        self.assertEquals(len(resource), 1000)
+        f = resource.open()
+        self.assert_(isinstance(f, file))
+        self.assertEquals(f.read(), DATA)
+        f.close()
+        self.assertEquals(resource.readRange(10, 5), DATA[10:15])
+        f = resource.openRange(10, 5)
+        self.assertEquals(f.read(), DATA[10:15])
+        f.close()
+        self.assertEquals(len(resource.getBuffer()), 1000)
+
+    def test_resource_temporary(self):
+        # The file of a temporary blob doesn't outlive it, so its data
+        # is copied by chunks instead
+        blob = FileBlob.fromFile(StringIO(DATA))
+        rp = ResourceProperty('file', Interface)
+        rp.setDTO(Resource(blob, mime_type='text/plain'))
+        stored = rp.getDTO().blob
+        self.assertEquals(stored.__class__, ChunkedBlob)
+        self.assertEquals(str(stored), DATA)
+        self.assertEquals(stored._digests, blob._digests)
+
+
+class CompressedBlobTests(unittest.TestCase):
+
+    def test_blob(self):
+        blob = CompressedBlob.fromBlob(Blob(DATA * 10))
+        self.assert_(len(blob.compressed) < 2000)
+        self.assertEquals(len(blob), 10000)
+        self.assertEquals(str(blob), DATA * 10)
+        self.assertEquals(blob._digests,
+                          {'sha256': sha256(DATA * 10).hexdigest()})
+        chunks = list(blob.iterChunks(3000))
+        self.assertEquals([len(c) for c in chunks], [3000, 3000, 3000, 1000])
+        self.assertEquals(''.join(chunks), DATA * 10)
+        self.assertEquals(blob.getBuffer()[:5].tobytes(), DATA[:5])
+
+    def test_open(self):
+        blob = CompressedBlob.fromBlob(Blob(DATA * 10))
+        f = blob.open()
+        self.assertEquals(f.read(10), DATA[:10])
+        f.seek(5000)
+        self.assertEquals(f.read(10), DATA[:10])
+        f.seek(-10, 1)
+        self.assertEquals(f.tell(), 5000)
+        self.assertEquals(f.read(10), DATA[:10])
+        f.seek(990)
+        self.assertEquals(len(f.read()), 9010)
+        self.assertEquals(f.read(), '')
+
+    def test_readline(self):
+        blob = CompressedBlob.fromBlob(Blob(DATA * 10))
+        lines = StringIO(DATA * 10).readlines()
+        f = blob.open()
+        self.assertEquals(f.readline(), lines[0])
+        self.assertEquals(f.readline(5), lines[1][:5])
+        self.assertEquals(f.readline(), lines[1][5:])
+        self.assertEquals(f.tell(), len(lines[0] + lines[1]))
+        self.assertEquals(f.read(3), lines[2][:3])
+        self.assertEquals(f.readlines(), [lines[2][3:]] + lines[3:])
+        self.assertEquals(f.readline(), '')
+        f.seek(0)
+        self.assertEquals(f.readlines(1), lines[:1])
+
+    def test_ranges(self):
+        checkRanges(self, CompressedBlob.fromBlob(Blob(DATA)))
+
+    def test_resource(self):
+        rp = ResourceProperty('file', Interface)
+        text = 'Some text. ' * 1000
+        rp.setDTO(Resource(Blob(text), mime_type='text/plain'))
+        blob = rp.getProperty('jcr:data')
+        self.assert_(isinstance(blob, CompressedBlob))
+        resource = rp.getDTO()
+        self.assertEquals(len(resource), len(text))
+        self.assertEquals(resource.open().read(), text)
+        self.assertEquals(str(resource), text)
+        # Set again as is
+        rp.setDTO(resource)
+        self.assert_(rp.getProperty('jcr:data') is blob)
+        for mime_type in ('application/xml', 'application/atom+xml',
+                          'application/json', 'text/html'):
+            rp.setDTO(Resource(Blob(text), mime_type=mime_type))
+            self.assert_(isinstance(rp.getProperty('jcr:data'),
+                                    CompressedBlob), mime_type)
+        rp.setDTO(Resource(Blob(text), mime_type='image/png'))
+        self.assert_(isinstance(rp.getProperty('jcr:data'), Blob))
+        rp.setDTO(Resource(Blob('small'), mime_type='text/plain'))
+        self.assert_(isinstance(rp.getProperty('jcr:data'), Blob))
+
+
+class StorageJar(object):
+    """Jar keeping the state of the objects added, to reload them.
+    """
+    def __init__(self):
+        self.states = {}
+        self.loaded = []
+
+    def add(self, ob):
+        ob._p_jar = self
+        ob._p_oid = str(id(ob))
+        self.states[ob._p_oid] = ob.__getstate__()
+        ob._p_changed = False
+
+    def register(self, ob):
+        pass
+
+    def setstate(self, ob):
+        self.loaded.append(ob._p_oid)
+        ob.__setstate__(self.states[ob._p_oid])
+
+
+class ChunkedBlobTests(unittest.TestCase):
+
+    def test_blob(self):
+        blob = ChunkedBlob.fromBlob(Blob(DATA), chunk_size=300)
+        self.assertEquals(len(blob), 1000)
+        self.assertEquals(str(blob), DATA)
+        self.assertEquals([len(data) for data in blob.iterChunks(200)],
+                          [100, 200, 100, 200, 100, 200, 100])
+        checkRanges(self, blob)
+        self.assertEquals(blob.getBuffer()[10:20].tobytes(), DATA[10:20])
+
+    def test_jar(self):
+        jar = StorageJar()
+        source = FileBlob.fromFile(StringIO(DATA))
+        blob = ChunkedBlob.fromBlob(source, jar, chunk_size=300)
+        self.assertEquals(len(jar.states), 4)
+        self.assertEquals(blob._digests, source._digests)
+        # All chunks are ghosts, loaded and released again when read
+        self.assertEquals(blob._first._p_changed, None)
+        self.assertEquals(str(blob), DATA)
+        self.assertEquals(len(jar.loaded), 4)
+        self.assertEquals(blob._first._p_changed, None)
+
+
+class LazyFileTests(unittest.TestCase):
+
+    def test_lazy(self):
+        resource = Resource(Blob(DATA), mime_type='text/plain',
+                            encoding='utf-8')
+        opened = []
+        def opener():
+            opened.append(True)
+            return resource.open()
+        f = LazyFile(opener, len(resource), resource.getContentType())
+        self.assertEquals(len(f), 1000)
+        self.assertEquals(f.content_type, 'text/plain; charset=utf-8')
+        f.seek(0, 2)
+        self.assertEquals(f.tell(), 1000)
+        f.seek(-10, 1)
+        self.assertEquals(f.tell(), 990)
+        self.assertEquals(opened, [])
+        # Reading opens at the current position
+        self.assertEquals(f.read(5), DATA[990:995])
+        self.assertEquals(f.tell(), 995)
+        f.seek(0)
+        self.assertEquals(f.read(), DATA)
+        self.assertEquals(opened, [True])
+        f.close()
+        self.assertEquals(f.tell(), 0)
+        self.assertEquals(''.join(f.readlines()), DATA)
+        self.assertEquals(opened, [True, True])
+
+    def test_lines(self):
+        # As built by getFileUpload, over blobs opened as streams
+        data = DATA * 3
+        lines = StringIO(data).readlines()
+        for blob in (CompressedBlob.fromBlob(Blob(data)),
+                     ChunkedBlob.fromBlob(Blob(data), chunk_size=300)):
+            resource = Resource(blob, mime_type='text/plain')
+            f = LazyFile(resource.open, len(resource),
+                         resource.getContentType())
+            self.assertEquals(f.readline(), lines[0])
+            self.assertEquals(f.readline(), lines[1])
+            self.assertEquals(f.readlines(), lines[2:])
+            f.close()
+            f.seek(len(lines[0]) - 1)
+            self.assertEquals(f.readline(), '\n')
+            self.assertEquals(f.readline(10), lines[1][:10])
+            f.close()
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(BlobTests),
+        unittest.makeSuite(FileBlobTests),
+        unittest.makeSuite(CompressedBlobTests),
+        unittest.makeSuite(ChunkedBlobTests),
+        unittest.makeSuite(LazyFileTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
@@ -0,0 +1,193 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Blob store tests.
+"""
+
+import os
+import shutil
+import cPickle
+import unittest
+import tempfile
+from hashlib import sha256
+
+from zope.interface import Interface
+
+from nuxeo.capsule.base import Blob
+from nuxeo.capsule.base import FileBlob
+from nuxeo.capsule.base import Resource
+from nuxeo.capsule.base import ResourceProperty
+from nuxeo.capsule.blobstore import FileSystemBlobStore
+from nuxeo.capsule.tests.test_document import Folder
+from nuxeo.capsule.tests.test_document import Root
+from nuxeo.capsule.tests.test_document import makeTree
+from nuxeo.capsule.tests.test_property import makeList
+
+
+class BlobStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FileSystemBlobStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store(self):
+        store = self.store
+        digest = sha256('hello').hexdigest()
+        blob = store.store(Blob('hello'))
+        self.assertEquals(blob.digest, digest)
+        self.assertEquals(blob.getDigest(), digest)
+        self.assertEquals(str(blob), 'hello')
+        self.assert_(digest in store)
+        self.assertEquals(str(store.get(digest)), 'hello')
+        self.assertEquals(store.get('nosuchdigest'), None)
+        # Same content is stored once
+        again = store.store(Blob('hello'))
+        self.assertEquals(again.filename, blob.filename)
+        self.assertEquals(store.store(again).filename, blob.filename)
+        self.assertEquals(os.listdir(os.path.join(self.directory, 'tmp')),
+                          [])
+
+    def test_store_known_digest(self):
+        store = self.store
+        blob = store.store(Blob('hello'))
+        temp = FileBlob.fromChunks(['hel', 'lo'])
+        os.remove(temp.filename)
+        # The digest computed when writing is enough to find the content
+        self.assertEquals(store.store(temp).filename, blob.filename)
+
+    def test_refcounts_and_gc(self):
+        store = self.store
+        a = store.store(Blob('a')).digest
+        b = store.store(Blob('b')).digest
+        store.incref(a)
+        store.incref(a)
+        store.incref(b)
+        store.decref(b)
+        self.assertEquals(store.getRefCount(a), 2)
+        self.assertEquals(store.getRefCount(b), 0)
+        self.assertEquals(store.collectGarbage(), [b])
+        self.assert_(a in store)
+        self.assert_(b not in store)
+        store.recount([])
+        self.assertEquals(store.collectGarbage(), [a])
+
+    def test_resources(self):
+        root = makeTree()
+        root.setBlobStore(self.store)
+        files = []
+        for name in ('a', 'd'):
+            rp = ResourceProperty('file', Interface)
+            root[name].setProperty('file', rp)
+            rp.setDTO(Resource(Blob('same content')))
+            files.append(rp)
+        blobs = [rp.getDTO().blob for rp in files]
+        self.assertEquals(blobs[0].filename, blobs[1].filename)
+        self.assertEquals(self.store.getRefCount(blobs[0].digest), 2)
+        files[1].setDTO(Resource(Blob('other content')))
+        self.assertEquals(self.store.getRefCount(blobs[0].digest), 1)
+        self.assertEquals(self.store.collectGarbage(), [])
+        files[0].setDTO(Resource(Blob('other content')))
+        self.assertEquals(self.store.collectGarbage(), [blobs[0].digest])
+
+    def test_pickle(self):
+        blob = self.store.store(Blob('hello'))
+        self.assertEquals(sorted(vars(blob)),
+                          ['_digests', '_size', 'digest', 'directory'])
+        # The store isn't pickled with its blobs
+        self.store.incref(blob.digest)
+        data = cPickle.dumps(blob, 1)
+        self.assert_('FileSystemBlobStore' not in data)
+        blob = cPickle.loads(data)
+        self.assertEquals(blob.digest, sha256('hello').hexdigest())
+        self.assertEquals(str(blob), 'hello')
+
+    def test_recount_removed_content(self):
+        root = makeTree()
+        root.setBlobStore(self.store)
+        def addResource(ob, data):
+            rp = ResourceProperty('file', Interface)
+            ob.setProperty('file', rp)
+            rp.setDTO(Resource(Blob(data)))
+            return rp.getDTO().blob.digest
+        kept = addResource(root['a'], 'kept')
+        in_doc = addResource(root['d'], 'in removed document')
+        lp = makeList([{}, {}])
+        root['a']['b'].setProperty('lp', lp)
+        in_kept_item = addResource(lp[0], 'in kept item')
+        in_item = addResource(lp[1], 'in removed item')
+        unset = addResource(root['a']['b']['c'], 'unset')
+        root._children.removeChild('d')
+        lp.removeChild(lp[1].getName())
+        root['a']['b']['c'].getProperty('file').setProperty('jcr:data', None)
+        # Removals don't release references
+        self.assertEquals(self.store.collectGarbage(), [])
+        root.recountBlobs()
+        self.assertEquals(self.store.getRefCount(kept), 1)
+        self.assertEquals(self.store.collectGarbage(),
+                          sorted([in_doc, in_item, unset]))
+        self.assert_(kept in self.store)
+        self.assert_(in_kept_item in self.store)
+
+    def test_one_workspace(self):
+        root = makeTree()
+        root.setBlobStore(self.store)
+        self.assertEquals(self.store.workspace, root.getUUID())
+        root.setBlobStore(self.store)
+        self.assertRaises(ValueError, makeTree().setBlobStore, self.store)
+
+    def test_collectBlobGarbage(self):
+        class VersionedRoot(Root):
+            def _iterBlobRoots(self):
+                yield self
+                yield frozen
+        frozen = Folder('frozen')
+        root = VersionedRoot()
+        root.addChild('a', 'Folder')
+        root.addChild('b', 'Folder')
+        root.setBlobStore(self.store)
+        rp = ResourceProperty('file', Interface)
+        root['a'].setProperty('file', rp)
+        rp.setDTO(Resource(Blob('copied')))
+        copied = rp.getDTO().blob
+        # A copy made by a connector doesn't add a reference
+        copy = ResourceProperty('file', Interface)
+        root['b'].setProperty('file', copy)
+        copy.setProperty('jcr:data', copied)
+        # Nor does a frozen version kept outside the tree
+        version = ResourceProperty('file', Interface)
+        frozen.setProperty('file', version)
+        rp.setDTO(Resource(Blob('versioned')))
+        version.setProperty('jcr:data', rp.getDTO().blob)
+        rp.setDTO(Resource(Blob('current')))
+        self.assertEquals(self.store.getRefCount(copied.digest), 0)
+        self.assertEquals(root.collectBlobGarbage(), [])
+        self.assertEquals(self.store.getRefCount(copied.digest), 1)
+        root['b'].setProperty('file', None)
+        frozen.setProperty('file', None)
+        self.assertEquals(root.collectBlobGarbage(),
+                          sorted([copied.digest,
+                                  sha256('versioned').hexdigest()]))
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(BlobStoreTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
@@ -0,0 +1,140 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Property buckets tests.
+"""
+
+import unittest
+import cPickle
+from cStringIO import StringIO
+
+from persistent import Persistent
+from zope.interface import Interface
+
+from nuxeo.capsule.base import ObjectBase
+from nuxeo.capsule.base import setPropertyBuckets
+from nuxeo.capsule.tests.test_order import DummyJar
+
+
+class IPlain(Interface):
+    pass
+
+class IArticle(Interface):
+    pass
+
+class INewsArticle(IArticle):
+    pass
+
+
+def pickleSize(ob):
+    """Size of the pickle of an object's state, as written by ZODB.
+
+    Persistent subobjects are written as references.
+    """
+    f = StringIO()
+    pickler = cPickle.Pickler(f, 1)
+    def persistent_id(sub):
+        if sub is not ob and isinstance(sub, Persistent):
+            return str(id(sub))
+        return None
+    pickler.persistent_id = persistent_id
+    pickler.dump(ob.__getstate__())
+    return len(f.getvalue())
+
+def commitSize(jar):
+    """Total size of the objects a commit would write.
+    """
+    return sum([pickleSize(ob) for ob in jar.registered])
+
+
+def makeArticle(schema):
+    ob = ObjectBase('article', schema)
+    ob.setProperty('title', u'Title')
+    ob.setProperty('published', False)
+    ob.setProperty('content', 'x' * 500000)
+    jar = DummyJar()
+    jar.add(ob)
+    for bucket in (ob._buckets or {}).values():
+        jar.add(bucket)
+    return ob, jar
+
+
+class BucketTests(unittest.TestCase):
+
+    def setUp(self):
+        setPropertyBuckets(IArticle, {'body': ('content', 'content_html')})
+
+    def tearDown(self):
+        setPropertyBuckets(IArticle, {})
+
+    def test_storage(self):
+        ob, jar = makeArticle(IArticle)
+        self.assertEquals(sorted(ob._props.keys()), ['published', 'title'])
+        self.assertEquals(ob._buckets['body'].keys(), ['content'])
+        self.assertEquals(ob.getProperty('content'), 'x' * 500000)
+        self.assert_(ob.hasProperty('content'))
+        self.assertEquals(sorted(ob.getProperties().keys()),
+                          ['content', 'published', 'title'])
+        view = ob.getPropertiesView()
+        self.assertEquals(len(view), 3)
+        self.assertEquals(sorted(view), ['content', 'published', 'title'])
+        ob.setProperty('content', None)
+        self.assert_(not ob.hasProperty('content'))
+        self.assertEquals(ob.getProperty('content', None), None)
+
+    def test_inherited(self):
+        ob, jar = makeArticle(INewsArticle)
+        self.assertEquals(ob._buckets['body'].keys(), ['content'])
+
+    def test_writes(self):
+        ob, jar = makeArticle(IArticle)
+        ob.setProperty('published', True)
+        self.assertEquals(jar.registered, [ob])
+        jar.registered = []
+        ob.setProperty('content_html', '<p>x</p>')
+        self.assertEquals(jar.registered, [ob._buckets['body']])
+
+    def test_migration(self):
+        ob = ObjectBase('article', IPlain)
+        ob.setProperty('content', 'x')
+        ob._setSchema(IArticle)
+        self.assertEquals(ob.getProperty('content'), 'x')
+        ob.setProperty('content', 'y')
+        self.assertEquals(ob._props.keys(), [])
+        self.assertEquals(ob.getProperty('content'), 'y')
+
+    def test_measurements(self):
+        plain, plain_jar = makeArticle(IPlain)
+        article, article_jar = makeArticle(IArticle)
+        plain.setProperty('published', True)
+        article.setProperty('published', True)
+        # Changing a flag writes the whole body only without buckets
+        self.assertEquals(plain_jar.registered, [plain])
+        self.assertEquals(article_jar.registered, [article])
+        self.assert_(commitSize(plain_jar) > 500000, commitSize(plain_jar))
+        self.assert_(commitSize(article_jar) < 1000, commitSize(article_jar))
+        # The body is a record of its own
+        article_jar.registered = []
+        article.setProperty('content', 'y' * 500000)
+        self.assertEquals(article_jar.registered, [article._buckets['body']])
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(BucketTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
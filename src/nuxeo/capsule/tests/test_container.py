@@ -0,0 +1,158 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Container tests.
+"""
+
+import unittest
+
+from zope.interface import Interface
+
+from nuxeo.capsule.base import Children
+from nuxeo.capsule.base import BTreeChildren
+
+
+class LazyChildren(Children):
+    """Children loaded lazily from a fake storage.
+    """
+    def __init__(self, storage):
+        Children.__init__(self, 'ecm:children')
+        self._setLazy()
+        self.storage = storage
+        self.loads = []
+
+    def _loadChildren(self, names):
+        self.loads.append(list(names))
+        return dict((name, self.storage[name]) for name in names
+                    if name in self.storage)
+
+    def _loadChildNames(self):
+        self.loads.append(None)
+        return sorted(self.storage)
+
+
+class LazyContainerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = {'a': 'A', 'b': 'B', 'c': 'C'}
+        self.children = LazyChildren(self.storage)
+
+    def test_getChild(self):
+        children = self.children
+        self.assertEquals(children.getChild('a'), 'A')
+        self.assertEquals(children['a'], 'A')
+        self.assertEquals(children.getChild('x', None), None)
+        self.assertRaises(KeyError, children.__getitem__, 'x')
+        self.assert_('b' in children)
+        self.failIf(children.hasChild('x'))
+        self.assertEquals(children.loads, [['a'], ['x'], ['b']])
+        self.assertEquals(children._lazy, set(['a', 'b']))
+        self.assertEquals(children._missing, set(['x']))
+
+    def test_prefetchChildren(self):
+        children = self.children
+        children.getChild('a')
+        children.prefetchChildren(['a', 'b', 'x'])
+        children.prefetchChildren(['b', 'x'])
+        self.assertEquals(children.loads, [['a'], ['b', 'x']])
+        self.assertEquals(children['b'], 'B')
+        self.assertEquals(len(children.loads), 2)
+
+    def test_listing(self):
+        children = self.children
+        self.assertEquals(len(children), 3)
+        self.assert_(children.hasChildren())
+        self.assertEquals(children.keys(), ['a', 'b', 'c'])
+        self.assertEquals(list(children), ['A', 'B', 'C'])
+
+    def test_paging(self):
+        children = self.children
+        self.assertEquals(list(children.iterChildren('a', limit=1)), ['B'])
+        self.assertEquals(children.loads, [None, ['b']])
+
+    def test_removeChild(self):
+        children = self.children
+        self.assertEquals(children.removeChild('b'), 'B')
+        del self.storage['b']
+        self.failIf('b' in children)
+        self.assertEquals(children.loads, [['b']])
+        self.assertRaises(KeyError, children.removeChild, 'x')
+
+
+class Child(object):
+    def __init__(self, name):
+        self.__name__ = name
+
+
+class IFolderChildren(Interface):
+    pass
+
+class IBigFolderChildren(IFolderChildren):
+    pass
+
+
+class BTreeChildrenTests(unittest.TestCase):
+
+    def makeChildren(self, names):
+        children = BTreeChildren('ecm:children')
+        for name in names:
+            children._setChild(name, Child(name))
+        return children
+
+    def test_children(self):
+        children = self.makeChildren('dbca')
+        self.assertEquals(len(children), 4)
+        self.assert_(children.hasChildren())
+        self.assertEquals(list(children.keys()), ['a', 'b', 'c', 'd'])
+        self.assertEquals([c.__name__ for c in children], ['a', 'b', 'c', 'd'])
+        self.assert_(children['b'].__parent__ is children)
+        self.assert_('c' in children)
+        children.removeChild('c')
+        self.failIf('c' in children)
+        self.assertEquals(len(children), 3)
+        self.assertRaises(TypeError, children.reorder, ['a', 'b', 'd'])
+        children.clear()
+        self.assertEquals(len(children), 0)
+        self.failIf(children.hasChildren())
+        self.assertEquals(list(children.keys()), [])
+
+    def test_paging(self):
+        children = self.makeChildren('gfedcba')
+        self.assertEquals(list(children.keys('b', 3)), ['c', 'd', 'e'])
+        self.assertEquals([c.__name__ for c in
+                           children.iterChildren('e', limit=10)],
+                          ['f', 'g'])
+        self.assertEquals([c.__name__ for c in
+                           children.iterChildren(stop='c')], ['a', 'b'])
+
+    def test_schema_registration(self):
+        from nuxeo.capsule.schema import SchemaManager
+        sm = SchemaManager()
+        sm.addSchema('FolderChildren', IFolderChildren)
+        sm.addSchema('BigFolderChildren', IBigFolderChildren)
+        sm.setClass('FolderChildren', Children)
+        sm.setClass('BigFolderChildren', BTreeChildren)
+        self.assert_(sm.getClass('FolderChildren') is Children)
+        self.assert_(sm.getClass('BigFolderChildren') is BTreeChildren)
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(LazyContainerTests),
+        unittest.makeSuite(BTreeChildrenTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
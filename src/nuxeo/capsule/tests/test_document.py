@@ -0,0 +1,387 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Document tests.
+"""
+
+import unittest
+
+import transaction
+
+from zope.interface import Interface
+
+from nuxeo.capsule.base import ObjectBase
+from nuxeo.capsule.base import Children
+from nuxeo.capsule.base import Document
+from nuxeo.capsule.base import Workspace
+
+
+class IFolder(Interface):
+    pass
+
+class IArticle(Interface):
+    pass
+
+TYPES = {'Folder': IFolder, 'Article': IArticle}
+
+
+class FolderChildren(Children):
+    """Children creating in-memory folders.
+    """
+    def addChild(self, name, type_name):
+        if name in self:
+            raise KeyError(name)
+        child = Folder(name, TYPES[type_name])
+        self._setChild(name, child)
+        return child
+
+
+class FolderMixin:
+
+    def _initFolder(self, name, schema=IFolder):
+        ObjectBase.__init__(self, name, schema)
+        self._children = FolderChildren('ecm:children')
+        self._children.__parent__ = self
+        Folder._last += 1
+        # Padded so that UUIDs sort in creation order, whatever the
+        # number of documents made by earlier tests
+        self._uuid = 'uuid-%08d' % Folder._last
+
+    def getUUID(self):
+        return self._uuid
+
+
+class Folder(FolderMixin, Document):
+    """An in-memory folder.
+    """
+    _last = 0
+
+    def __init__(self, name, schema=IFolder):
+        self._initFolder(name, schema)
+
+
+class Root(FolderMixin, Workspace):
+    """An in-memory workspace.
+    """
+    def __init__(self):
+        self._initFolder('')
+
+
+def makeTree():
+    """Make a workspace with a few folders.
+
+    /a, /a/b, /a/b/c, /d
+    """
+    root = Root()
+    b = root.addChild('a', 'Folder').addChild('b', 'Folder')
+    b.addChild('c', 'Folder')
+    root.addChild('d', 'Folder')
+    return root
+
+
+def move(doc, container, name):
+    """Move a document the way a connector would.
+    """
+    doc.getParent()._children.removeChild(doc.getName())
+    doc.__name__ = name
+    container._children._setChild(name, doc)
+
+
+class PathTests(unittest.TestCase):
+
+    def test_getPath(self):
+        root = makeTree()
+        c = root['a']['b']['c']
+        self.assertEquals(root.getPath(), '/')
+        self.assertEquals(c.getPath(), '/a/b/c')
+        self.assert_(c.getPath() is c.getPath())
+        self.assert_(c._getPath() is c._getPath())
+        self.assertEquals(repr(c), '<Folder at /a/b/c>')
+        self.assertEquals(repr(root), '<Root at />')
+
+    def test_rename_ancestor(self):
+        root = makeTree()
+        c = root['a']['b']['c']
+        c.getPath()
+        move(root['a'], root, 'z')
+        self.assertEquals(c.getPath(), '/z/b/c')
+
+    def test_move(self):
+        root = makeTree()
+        c = root['a']['b']['c']
+        c.getPath()
+        move(root['a']['b'], root['d'], 'b')
+        self.assertEquals(c.getPath(), '/d/b/c')
+
+
+class ResolverTests(unittest.TestCase):
+
+    def test_resolvePath(self):
+        root = makeTree()
+        c = root['a']['b']['c']
+        self.assert_(root.resolvePath('/a/b/c') is c)
+        self.assert_(root.resolvePath('a/b/c/') is c)
+        self.assert_(root.resolvePath('/') is root)
+        self.assertRaises(KeyError, root.resolvePath, '/a/x')
+        self.assertEquals(root.resolvePath('/a/x', None), None)
+        self.assertEquals(root.resolvePaths(['/d', '/a/b/x', '/a/b']),
+                          [root['d'], None, root['a']['b']])
+
+    def test_resolvePathPrefix(self):
+        root = makeTree()
+        self.assertEquals(root.resolvePathPrefix('/a/b/x/y'),
+                          (root['a']['b'], ('x', 'y')))
+        self.assertEquals(root.resolvePathPrefix('/a/b/c'),
+                          (root['a']['b']['c'], ()))
+
+    def test_cache(self):
+        root = makeTree()
+        c = root['a']['b']['c']
+        root.resolvePath('/a/b/c')
+        self.assertEquals(sorted(root._getPathCache().keys()),
+                          [('a',), ('a', 'b'), ('a', 'b', 'c')])
+        # Cached entries are used without walking the tree
+        del root['a']._children._children['b']
+        self.assert_(root.resolvePath('/a/b/c') is c)
+
+    def test_cache_transaction(self):
+        root = makeTree()
+        root.resolvePath('/a/b/c')
+        # A removal committed by another connection is seen in the
+        # next transaction
+        del root['a']._children._children['b']
+        transaction.abort()
+        self.assertEquals(root.resolvePath('/a/b/c', None), None)
+
+    def test_invalidation(self):
+        root = makeTree()
+        root.resolvePaths(['/a/b/c', '/d'])
+        root['a'].removeChild('b')
+        self.assertEquals(sorted(root._getPathCache().keys()),
+                          [('a',), ('d',)])
+        self.assertEquals(root.resolvePath('/a/b/c', None), None)
+        move(root['d'], root['a'], 'b')
+        self.assertEquals(root.resolvePath('/d', None), None)
+        self.assertEquals(root.resolvePath('/a/b').getPath(), '/a/b')
+        root.clear()
+        self.assertEquals(root.resolvePath('/a', None), None)
+
+    def test_cache_size(self):
+        root = makeTree()
+        root.path_cache_size = 2
+        root.resolvePath('/a/b/c')
+        self.assertEquals(sorted(root._getPathCache().keys()),
+                          [('a', 'b'), ('a', 'b', 'c')])
+
+
+class UUIDIndexTests(unittest.TestCase):
+
+    def makeTree(self):
+        from nuxeo.capsule.index import UUIDIndex
+        root = makeTree()
+        root.setUUIDIndex(UUIDIndex())
+        return root
+
+    def test_no_index(self):
+        root = makeTree()
+        self.assertRaises(NotImplementedError, root.locateUUID, 'foo')
+
+    def test_locateUUID(self):
+        root = self.makeTree()
+        self.assertEquals(len(root.getUUIDIndex()), 5)
+        c = root['a']['b']['c']
+        self.assertEquals(c.locateUUID(c.getUUID()), '/a/b/c')
+        self.assertEquals(c.locateUUID(root.getUUID()), '/')
+        self.assertEquals(root.locateUUID('nosuchuuid'), None)
+        self.assertEquals(root.locateUUIDs([root['d'].getUUID(), 'foo']),
+                          ['/d', None])
+
+    def test_updates(self):
+        root = self.makeTree()
+        b = root['a']['b']
+        c = b['c']
+        e = b.addChild('e', 'Folder')
+        self.assertEquals(root.locateUUID(e.getUUID()), '/a/b/e')
+        move(b, root['d'], 'bb')
+        self.assertEquals(root.locateUUID(c.getUUID()), '/d/bb/c')
+        root['d'].removeChild('bb')
+        self.assertEquals(root.locateUUIDs([b.getUUID(), c.getUUID()]),
+                          [None, None])
+        root.clear()
+        self.assertEquals(len(root.getUUIDIndex()), 1)
+
+    def test_moveChild(self):
+        from nuxeo.capsule.index import UUIDIndex
+        class RecordingIndex(UUIDIndex):
+            calls = []
+            def index(self, uuid, doc):
+                self.calls.append(('index', uuid))
+                UUIDIndex.index(self, uuid, doc)
+            def unindex(self, uuid):
+                self.calls.append(('unindex', uuid))
+                UUIDIndex.unindex(self, uuid)
+        root = makeTree()
+        index = RecordingIndex()
+        root.setUUIDIndex(index)
+        b, c = root['a']['b'], root['a']['b']['c']
+        self.assertEquals(root.resolvePath('a/b/c'), c)
+        index.calls = []
+        root['a']._children._moveChild('b', root['d']._children, 'bb')
+        self.assertEquals(index.calls, [])
+        self.assertEquals(root.locateUUID(c.getUUID()), '/d/bb/c')
+        self.assertEquals(root.resolvePath('a/b/c', None), None)
+        self.assertEquals(root.resolvePath('d/bb/c'), c)
+        # Out of the workspace, the index is updated
+        other = makeTree()
+        root['d']._children._moveChild('bb', other._children, 'b')
+        self.assertEquals(root.locateUUID(c.getUUID()), None)
+
+    def test_persistent(self):
+        from nuxeo.capsule.tests.test_order import DummyJar
+        class Jar(DummyJar):
+            def readCurrent(self, ob):
+                pass
+        root = self.makeTree()
+        index = root.getUUIDIndex()
+        jar = Jar()
+        jar.add(index._docs)
+        root['d'].addChild('e', 'Folder')
+        # The change is written with the tree of documents
+        self.assertEquals(jar.registered, [index._docs])
+        self.assertEquals(len(index), 6)
+
+
+class PropertyIndexTests(unittest.TestCase):
+
+    def makeTree(self, names=None):
+        from nuxeo.capsule.index import UUIDIndex
+        from nuxeo.capsule.index import PropertyIndex
+        root = makeTree()
+        root['a'].setProperty('color', u'red')
+        root.setUUIDIndex(UUIDIndex())
+        root.setPropertyIndex(PropertyIndex(names))
+        return root
+
+    def test_no_index(self):
+        root = makeTree()
+        self.assertRaises(NotImplementedError,
+                          root.searchProperty, 'color', u'red')
+
+    def test_searchProperty(self):
+        root = self.makeTree()
+        a, b, d = root['a'], root['a']['b'], root['d']
+        self.assertEquals(root.searchProperty('color', u'red'),
+                          [(a.getUUID(), '/a')])
+        b.setProperty('color', u'red')
+        d.setProperty('color', u'blue')
+        self.assertEquals(sorted(root.searchProperty('color', u'red')),
+                          [(a.getUUID(), '/a'), (b.getUUID(), '/a/b')])
+        a.setProperty('color', None)
+        self.assertEquals(root.searchProperty('color', u'red'),
+                          [(b.getUUID(), '/a/b')])
+        self.assertEquals(root.searchProperty('color', u'green'), [])
+        self.assertEquals(root.searchProperty('size', 1), [])
+
+    def test_persistent(self):
+        from nuxeo.capsule.tests.test_order import DummyJar
+        class Jar(DummyJar):
+            def readCurrent(self, ob):
+                pass
+        root = self.makeTree()
+        a = root['a']
+        index = root._property_index
+        jar = Jar()
+        jar.add(index._values)
+        a.setProperty('color', u'blue')
+        # The change is written with the tree of documents
+        self.assertEquals(jar.registered, [index._values])
+        self.assertEquals(index.getValues(a.getUUID(), 'color'), (u'blue',))
+
+    def test_multivalued_and_references(self):
+        from nuxeo.capsule.base import Reference
+        root = self.makeTree()
+        a, d = root['a'], root['d']
+        a.setProperty('tags', [u'x', u'y'])
+        d.setProperty('tags', (u'y',))
+        d.setProperty('target', Reference(a.getUUID()))
+        self.assertEquals(root.searchProperty('tags', u'x'),
+                          [(a.getUUID(), '/a')])
+        self.assertEquals(len(root.searchProperty('tags', u'y')), 2)
+        self.assertEquals(
+            root.searchProperty('target', Reference(a.getUUID())),
+            [(d.getUUID(), '/d')])
+        self.assertEquals(root.searchProperty('target', a.getUUID()), [])
+        self.assertEquals(root.searchProperty('tags', [u'x']), [])
+
+    def test_tree_updates(self):
+        root = self.makeTree()
+        a = root['a']
+        e = root['d'].addChild('e', 'Folder')
+        e.setProperty('color', u'red')
+        self.assertEquals(len(root.searchProperty('color', u'red')), 2)
+        root.removeChild('a')
+        self.assertEquals(root.searchProperty('color', u'red'),
+                          [(e.getUUID(), '/d/e')])
+        root['d']._children._setChild('a', a)
+        self.assertEquals(len(root.searchProperty('color', u'red')), 2)
+
+    def test_names(self):
+        root = self.makeTree(['size'])
+        root['d'].setProperty('size', 3)
+        self.assertEquals(root.searchProperty('color', u'red'), [])
+        self.assertEquals(len(root.searchProperty('size', 3)), 1)
+
+
+class DTOChangesTests(unittest.TestCase):
+
+    def tearDown(self):
+        import transaction
+        transaction.abort()
+
+    def test_document(self):
+        from nuxeo.capsule.base import ObjectProperty
+        root = makeTree()
+        a = root['a']
+        a.setProperty('color', u'red')
+        a.markDTOChanges()
+        ob = ObjectProperty('ob', IFolder)
+        a.setProperty('ob', ob)
+        ob.setProperty('size', 3)
+        a['b'].setProperty('color', u'blue')
+        self.assertEquals(a.getDTOChanges(),
+                          {'ob': {'size': 3, '__name__': 'ob'}})
+        ob.setProperty('size', 4)
+        a.setProperty('color', None)
+        d = root['d']
+        d.applyDTOPatch(a.getDTOChanges())
+        self.assertEquals(d.getProperty('ob'), {'size': 4, '__name__': 'ob'})
+        d.setProperty('ob', ObjectProperty('ob', IFolder))
+        d.applyDTOPatch({'ob/size': 5})
+        self.assertEquals(d.getProperty('ob').getProperty('size'), 5)
+        # A document can't be replaced as a whole
+        self.assertRaises(ValueError, d.applyDTOPatch, {'': {}})
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(PathTests),
+        unittest.makeSuite(DTOChangesTests),
+        unittest.makeSuite(ResolverTests),
+        unittest.makeSuite(UUIDIndexTests),
+        unittest.makeSuite(PropertyIndexTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
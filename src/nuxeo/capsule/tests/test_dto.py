@@ -0,0 +1,151 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""DTO serialization tests.
+"""
+
+import sys
+import cPickle
+import unittest
+from cStringIO import StringIO
+from datetime import datetime
+
+from zope.interface import Interface
+
+from nuxeo.capsule.base import ObjectProperty
+from nuxeo.capsule.base import ResourceProperty
+from nuxeo.capsule.base import Resource
+from nuxeo.capsule.base import Blob
+from nuxeo.capsule.base import Reference
+from nuxeo.capsule.dto import iterDTOEvents
+from nuxeo.capsule.dto import buildDTO
+from nuxeo.capsule.dto import copyDTO
+from nuxeo.capsule.dto import ReadOnlyDict
+from nuxeo.capsule.dto import writeJSON
+from nuxeo.capsule.dto import json
+from nuxeo.capsule.tests.test_property import IItem
+from nuxeo.capsule.tests.test_property import makeList
+
+
+class DTOTests(unittest.TestCase):
+
+    def test_events(self):
+        ob = ObjectProperty('ob', IItem)
+        ob.setProperty('a', 1)
+        lp = makeList([{'b': 2}])
+        ob.setProperty('lp', lp)
+        events = list(iterDTOEvents(lp))
+        self.assertEquals(events, [
+            ('start_list', None),
+            ('start_object', None),
+            ('key', 'b'), ('value', 2),
+            ('key', '__name__'), ('value', u'item1'),
+            ('end_object', None),
+            ('end_list', None)])
+        self.assertEquals(buildDTO(iterDTOEvents(ob)),
+                          {'a': 1, 'lp': [{'b': 2, '__name__': u'item1'}],
+                           '__name__': 'ob'})
+        self.assertEquals(ob.getDTO(), buildDTO(iterDTOEvents(ob)))
+
+    def test_overridden_getDTO(self):
+        class UpperProperty(ObjectProperty):
+            def getDTO(self):
+                dto = copyDTO(ObjectProperty.getDTO(self))
+                dto['a'] = dto['a'].upper()
+                return dto
+        ob = ObjectProperty('ob', IItem)
+        sub = UpperProperty('sub', IItem)
+        ob.setProperty('sub', sub)
+        sub.setProperty('a', u'x')
+        self.assertEquals(sub.getDTO(), {'a': u'X', '__name__': 'sub'})
+        self.assertEquals(ob.getDTO()['sub'], sub.getDTO())
+        self.assertEquals(list(iterDTOEvents(sub)),
+                          [('value', sub.getDTO())])
+
+    def test_deep(self):
+        ob = top = ObjectProperty('ob', IItem)
+        depth = sys.getrecursionlimit() + 100
+        for i in xrange(depth):
+            sub = ObjectProperty('ob', IItem)
+            ob.setProperty('sub', sub)
+            ob = sub
+        ob.setProperty('a', 1)
+        dto = top.getDTO()
+        for i in xrange(depth):
+            dto = dto['sub']
+        self.assertEquals(dto, {'a': 1, '__name__': 'ob'})
+        f = StringIO()
+        writeJSON(top, f)
+        self.assertEquals(f.getvalue().count('{'), depth + 1)
+        self.assertEquals(f.getvalue().count('}'), depth + 1)
+
+    def test_readonly(self):
+        ob = ObjectProperty('ob', IItem)
+        ob.setProperty('lp', makeList([{'b': 2}]))
+        dto = buildDTO(iterDTOEvents(ob), readonly=True)
+        self.assert_(isinstance(dto, ReadOnlyDict))
+        self.assertRaises(TypeError, dto.update, {})
+        self.assertRaises(TypeError, dto['lp'].pop)
+        self.assertEquals(cPickle.loads(cPickle.dumps(dto, 2)), dto)
+        copy = copyDTO(dto)
+        self.assertEquals(copy, dto)
+        self.assertEquals(type(copy['lp']), list)
+        copy['lp'][0]['b'] = 3
+        self.assertEquals(dto['lp'][0]['b'], 2)
+
+    def test_writeJSON(self):
+        ob = ObjectProperty('ob', IItem)
+        ob.setProperty('ref', Reference('abc'))
+        ob.setProperty('date', datetime(2026, 10, 1))
+        ob.setProperty('tags', [u'x', u'y'])
+        ob.setProperty('data', Blob('xxx'))
+        lp = makeList([{'b': 2}, {}])
+        ob.setProperty('lp', lp)
+        f = StringIO()
+        blobs = writeJSON(ob, f)
+        self.assertEquals(len(blobs), 1)
+        self.assert_(blobs[0] is ob.getProperty('data'))
+        self.assertEquals(json.loads(f.getvalue()), {
+            'ref': {'$ref': 'abc'},
+            'date': {'$date': '2026-10-01T00:00:00'},
+            'tags': ['x', 'y'],
+            'data': {'$blob': 0},
+            'lp': [{'b': 2, '__name__': 'item1'},
+                   {'__name__': 'item2'}],
+            '__name__': 'ob',
+            })
+        self.assertEquals(f.getvalue().count(' '), 0)
+
+    def test_writeJSON_resource(self):
+        ob = ObjectProperty('ob', IItem)
+        res = ResourceProperty('res', Interface)
+        blob = Blob('hello')
+        res.setDTO(Resource(blob, mime_type='text/plain'))
+        ob.setProperty('res', res)
+        f = StringIO()
+        blobs = writeJSON(ob, f, blob_ref=lambda blob: 'sha:%d' % len(blob))
+        self.assertEquals(blobs, [blob])
+        self.assertEquals(json.loads(f.getvalue())['res'], {'$resource': {
+            'data': 'sha:5', 'length': 5, 'mimeType': 'text/plain',
+            'encoding': None, 'lastModified': None}})
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(DTOTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
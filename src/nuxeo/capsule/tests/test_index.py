@@ -0,0 +1,116 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Index tests.
+"""
+
+import unittest
+from datetime import datetime
+
+from nuxeo.capsule.base import Blob
+from nuxeo.capsule.base import Reference
+from nuxeo.capsule.index import PropertyIndex
+
+
+class PropertyIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        index = self.index = PropertyIndex()
+        for i in range(10):
+            index.index('doc%d' % i, 'size', i)
+        index.index('date', 'size', datetime(2006, 1, 1))
+        index.index('text', 'size', u'big')
+        index.index('multi', 'size', (2, 3, 20))
+
+    def search(self, *args, **kw):
+        return list(self.index.searchRange('size', *args, **kw))
+
+    def test_searchRange(self):
+        self.assertEquals(self.search(0, 2), ['doc0', 'doc1', 'doc2', 'multi'])
+        self.assertEquals(self.search(0, 2, excludemin=True, excludemax=True),
+                          ['doc1'])
+        self.assertEquals(self.search(min=8), ['doc8', 'doc9', 'multi'])
+        self.assertEquals(self.search(max=0), ['doc0'])
+        self.assertEquals(self.search(max=0, excludemax=True), [])
+        self.assertEquals(len(self.search()), 13)
+        self.assertEquals(self.search(u'a'), ['text'])
+        self.assertEquals(self.search(min=datetime(2000, 1, 1)), ['date'])
+        # Bounds not comparable with each other
+        self.assertEquals(self.search(0, u'z'), [])
+        self.assertEquals(list(self.index.searchRange('nosuchname', 0)), [])
+
+    def test_countRange(self):
+        index = self.index
+        self.assertEquals(index.countRange('size', 0, 1), 2)
+        self.assertEquals(index.countRange('size', min=datetime(2000, 1, 1)),
+                          1)
+        # Multi-valued properties are counted once per value
+        self.assertEquals(index.countRange('size', 2, 3), 4)
+        self.assertEquals(len(self.search(2, 3)), 3)
+
+    def test_unindex(self):
+        index = self.index
+        index.unindex('multi')
+        index.index('doc1', 'size', None)
+        self.assertEquals(self.search(0, 2), ['doc0', 'doc2'])
+        self.assertEquals(list(index.search('size', 2)), ['doc2'])
+
+    def test_unordered_values(self):
+        index = self.index
+        index.index('blob', 'data', Blob('abc'))
+        index.index('object', 'data', object())
+        self.assertEquals(index.getValues('blob', 'data'), ())
+        self.assertEquals(list(index.searchRange('data')), [])
+        self.assertEquals(list(index.search('data', Blob('abc'))), [])
+
+    def test_text(self):
+        index = self.index
+        index.index('str', 'title', 'caf\xc3\xa9')
+        index.index('unicode', 'title', u'caf\xe9')
+        index.index('latin', 'title', 'caf\xe9')
+        self.assertEquals(list(index.search('title', u'caf\xe9')),
+                          ['str', 'unicode'])
+        self.assertEquals(index.getValues('latin', 'title'), ())
+
+    def test_long_text(self):
+        index = self.index
+        body = u'x' * (index.max_length + 1)
+        index.index('doc', 'body', body)
+        index.index('multi', 'body', [u'short', body])
+        self.assertEquals(index.getValues('doc', 'body'), ())
+        self.assertEquals(list(index.search('body', body)), [])
+        self.assertEquals(list(index.searchRange('body')), ['multi'])
+
+    def test_references(self):
+        index = self.index
+        index.index('doc', 'ref', Reference('uuid-1'))
+        self.assertEquals(list(index.search('ref', Reference('uuid-1'))),
+                          ['doc'])
+        self.assertEquals(list(index.search('ref', 'uuid-1')), [])
+
+    def test_search_copy(self):
+        result = self.index.search('size', 2)
+        result.insert('other')
+        self.assertEquals(list(self.index.search('size', 2)),
+                          ['doc2', 'multi'])
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(PropertyIndexTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
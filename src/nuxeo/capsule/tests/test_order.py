@@ -0,0 +1,251 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Order tests.
+"""
+
+import unittest
+
+from nuxeo.capsule.order import Order
+
+
+class SmallOrder(Order):
+    chunk_size = 3
+
+
+class DummyJar(object):
+    """Minimal jar recording the objects that are modified.
+    """
+    def __init__(self):
+        self.registered = []
+
+    def add(self, ob):
+        ob._p_jar = self
+        ob._p_oid = str(id(ob))
+        ob._p_changed = False
+
+    def register(self, ob):
+        self.registered.append(ob)
+
+
+class OrderTests(unittest.TestCase):
+
+    def names(self, n):
+        return [u'n%03d' % i for i in range(n)]
+
+    def test_basic(self):
+        names = self.names(10)
+        order = SmallOrder(names)
+        self.assertEquals(list(order), names)
+        self.assertEquals(len(order), 10)
+        self.assertEquals(len(order._chunks), 4)
+        self.assert_(u'n005' in order)
+        self.failIf(u'foo' in order)
+        self.assertEquals(order[0], u'n000')
+        self.assertEquals(order[7], u'n007')
+        self.assertEquals(order[-1], u'n009')
+        self.assertRaises(IndexError, order.__getitem__, 10)
+        self.assertEquals(order.index(u'n008'), 8)
+        self.assertRaises(ValueError, order.index, u'foo')
+
+    def test_append(self):
+        order = SmallOrder()
+        for name in self.names(7):
+            order.append(name)
+        self.assertEquals(list(order), self.names(7))
+        self.assertEquals(order._sizes, [3, 3, 1])
+        self.assertRaises(ValueError, order.append, u'n001')
+
+    def test_remove(self):
+        names = self.names(10)
+        order = SmallOrder(names)
+        for name in (u'n004', u'n003', u'n005', u'n009'):
+            order.remove(name)
+            names.remove(name)
+            self.assertEquals(list(order), names)
+            self.assertEquals(len(order), len(names))
+        self.assertEquals(order._sizes, [3, 3])
+        self.assertEquals(order[3], u'n006')
+        self.assertEquals(order.index(u'n007'), 4)
+        self.assertRaises(ValueError, order.remove, u'n004')
+
+    def test_remove_chunk_only(self):
+        order = SmallOrder(self.names(9))
+        jar = DummyJar()
+        for chunk in order._chunks:
+            jar.add(chunk)
+        order.remove(u'n004')
+        self.assertEquals(jar.registered, [order._chunks[1]])
+
+    def test_insert(self):
+        names = self.names(6)
+        order = SmallOrder(names)
+        order.insert(1, u'a')
+        order.insert(1, u'b')
+        order.insert(1, u'c')
+        order.insert(100, u'z')
+        order.insert(-1, u'y')
+        names[1:1] = [u'c', u'b', u'a']
+        names.append(u'z')
+        names.insert(-1, u'y')
+        self.assertEquals(list(order), names)
+        self.assertEquals(order._sizes, [6, 3, 2])
+        order.insert(0, u'd')
+        names.insert(0, u'd')
+        self.assertEquals(list(order), names)
+        self.assertEquals(order._sizes, [3, 4, 3, 2])
+        for i, name in enumerate(names):
+            self.assertEquals(order.index(name), i)
+            self.assertEquals(order[i], name)
+        self.assertRaises(ValueError, order.insert, 0, u'a')
+
+    def test_move(self):
+        order = SmallOrder(self.names(9))
+        jar = DummyJar()
+        for chunk in order._chunks:
+            jar.add(chunk)
+        order.move(u'n006', 8)
+        self.assertEquals(list(order)[5:], [u'n005', u'n007', u'n008', u'n006'])
+        self.assertEquals(jar.registered, [order._chunks[2]])
+        order.move(u'n000', 8)
+        self.assertEquals(order[8], u'n000')
+        self.assertEquals(order[0], u'n001')
+
+    def test_iterSlice(self):
+        names = self.names(10)
+        order = SmallOrder(names)
+        for start, stop in ((0, None), (2, 7), (3, 6), (4, 5), (5, 4),
+                            (8, 20), (-3, None), (0, -2), (10, None)):
+            self.assertEquals(list(order.iterSlice(start, stop)),
+                              names[start:stop])
+
+    def test_reorder(self):
+        order = SmallOrder(self.names(5))
+        order.reorder([u'n004', u'n000', u'n003'])
+        self.assertEquals(list(order), [u'n004', u'n000', u'n003'])
+        self.assertRaises(ValueError, order.reorder, [u'a', u'a'])
+
+
+class ContainerOrderTests(unittest.TestCase):
+
+    def test_legacy_list(self):
+        from nuxeo.capsule.base import ContainerBase
+        container = ContainerBase('foo')
+        state = container.__getstate__()
+        state['_order'] = ['a', 'b', 'c']
+        container.__setstate__(state)
+        for name in 'abc':
+            container._children[name] = name.upper()
+        jar = DummyJar()
+        jar.add(container)
+        # Read as is
+        self.assertEquals(container.keys(), ['a', 'b', 'c'])
+        self.assertEquals(container.keys(1), ['b', 'c'])
+        self.assertEquals(jar.registered, [])
+        # Small, so changed in place, which writes the container
+        container.moveChildToPosition('c', 0)
+        self.assert_(isinstance(container._order, list))
+        self.assertEquals(container.keys(), ['c', 'a', 'b'])
+        self.assertEquals(jar.registered, [container])
+        # Long ones are migrated on the first change
+        names = self.names(Order.chunk_size)
+        state['_order'] = names[:]
+        state['_children'] = {}
+        container.__setstate__(state)
+        for name in names:
+            container._children[name] = name.upper()
+        container.moveChildToPosition(names[-1], 0)
+        self.assert_(isinstance(container._order, Order))
+        self.assertEquals(container.keys(), names[-1:] + names[:-1])
+
+    def names(self, n):
+        return [u'n%03d' % i for i in range(n)]
+
+    def test_small_order(self):
+        from nuxeo.capsule.base import ContainerBase
+        container = self.makeContainer('abc')
+        self.assertEquals(container._order, ['a', 'b', 'c'])
+        container.moveChildrenToTop(['c'])
+        container.reorder(['b', 'c', 'a'])
+        self.assertEquals(container._order, ['b', 'c', 'a'])
+        self.assertRaises(ValueError, container.reorder, ['b', 'b', 'c'])
+        # Becomes an Order when it fills a chunk
+        for name in self.names(Order.chunk_size - 3):
+            container._setChild(name, ContainerBase(name))
+        self.assert_(isinstance(container._order, list))
+        container._setChild(u'last', ContainerBase(u'last'))
+        self.assert_(isinstance(container._order, Order))
+        self.assertEquals(len(container._order), Order.chunk_size + 1)
+        self.assertEquals(container.keys()[:3], ['b', 'c', 'a'])
+        container.clear()
+        self.assertEquals(container._order, [])
+
+    def test_remove_and_reorder(self):
+        container = self.makeContainer('abcd')
+        self.assertEquals(container.removeChild('b'), 'B')
+        self.assertEquals(container.keys(), ['a', 'c', 'd'])
+        container.reorder(['d', 'a', 'c'])
+        self.assertEquals(list(container), ['D', 'A', 'C'])
+        self.assertRaises(ValueError, container.reorder, ['a', 'c'])
+
+    def makeContainer(self, names):
+        from nuxeo.capsule.base import ContainerBase
+        container = ContainerBase('foo')
+        for name in names:
+            container._children[name] = name.upper()
+            container._order.append(name)
+        return container
+
+    def test_moves(self):
+        container = self.makeContainer('abcdef')
+        container.moveChildBefore('e', 'b')
+        self.assertEquals(''.join(container.keys()), 'aebcdf')
+        container.moveChildAfter('a', 'c')
+        self.assertEquals(''.join(container.keys()), 'ebcadf')
+        container.moveChildAfter('f', 'f')
+        self.assertEquals(''.join(container.keys()), 'ebcadf')
+        container.moveChildToPosition('e', 4)
+        self.assertEquals(''.join(container.keys()), 'bcadef')
+        container.moveChildrenToTop(['f', 'd'])
+        self.assertEquals(''.join(container.keys()), 'fdbcae')
+        container.moveChildrenToBottom(['f', 'b'])
+        self.assertEquals(''.join(container.keys()), 'dcaefb')
+        self.assertRaises(KeyError, container.moveChildBefore, 'a', 'x')
+        self.assertRaises(KeyError, container.moveChildrenToTop, ['x'])
+        container._order = None
+        self.assertRaises(TypeError, container.moveChildToPosition, 'a', 0)
+
+    def test_paging(self):
+        container = self.makeContainer('abcdef')
+        self.assertEquals(container.keys(2, 3), ['c', 'd', 'e'])
+        self.assertEquals(container.keys(limit=2), ['a', 'b'])
+        self.assertEquals(list(container.iterChildren(1, 3)), ['B', 'C'])
+        self.assertEquals(list(container.iterChildren(4, limit=5)),
+                          ['E', 'F'])
+        container._order = None
+        self.assertEquals(container.keys('b', 2), ['c', 'd'])
+        self.assertEquals(list(container.iterChildren('b', 'e')),
+                          ['C', 'D'])
+        self.assertEquals(list(container.iterChildren(limit=1)), ['A'])
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(OrderTests),
+        unittest.makeSuite(ContainerOrderTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
@@ -0,0 +1,357 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Property tests.
+"""
+
+import unittest
+
+import transaction
+
+from zope.interface import Interface
+from zope.app.container.constraints import contains
+
+from nuxeo.capsule.base import ObjectProperty
+from nuxeo.capsule.base import ListProperty
+from nuxeo.capsule.base import ResourceProperty
+from nuxeo.capsule.base import Resource
+from nuxeo.capsule.base import Blob
+from nuxeo.capsule.dto import copyDTO
+from nuxeo.capsule.tests.test_order import DummyJar
+from nuxeo.capsule.tests.test_blob import StorageJar
+
+
+class IItem(Interface):
+    pass
+
+class IItems(Interface):
+    contains(IItem)
+
+
+class MyListProperty(ListProperty):
+    """A list property creating its values in memory.
+    """
+    _last = 0
+
+    def addValue(self, name=None):
+        if name is None:
+            self._last += 1
+            name = u'item%d' % self._last
+        ob = ObjectProperty(name, self.getValueSchema())
+        self._setChild(name, ob)
+        return ob
+
+
+def makeList(values):
+    lp = MyListProperty(u'lp', IItems)
+    lp.setDTO(values)
+    return lp
+
+
+class ListPropertyTests(unittest.TestCase):
+
+    def test_getDTO(self):
+        lp = makeList([{'a': 1}, {'a': 2}])
+        self.assertEquals(lp.getDTO(), [{'a': 1, '__name__': u'item1'},
+                                        {'a': 2, '__name__': u'item2'}])
+        self.assertEquals(lp[1].getProperty('a'), 2)
+
+    def test_setDTO_touches_only_changes(self):
+        lp = makeList([{'a': i} for i in range(10)])
+        jar = DummyJar()
+        for ob in lp:
+            jar.add(ob)
+        dto = copyDTO(lp.getDTO())
+        dto[3]['a'] = 33
+        changes = lp.setDTO(dto)
+        self.assertEquals(changes, {'added': [], 'removed': [],
+                                    'modified': [u'item4'], 'moved': []})
+        self.assertEquals(jar.registered, [lp[3]])
+        self.assertEquals(lp.getDTO(), dto)
+
+    def test_setDTO_add_remove_move(self):
+        lp = makeList([{'a': i} for i in range(5)])
+        dto = lp.getDTO()
+        dto = [dto[4], dto[0], {'a': 'new'}, dto[2], dto[3]]
+        changes = lp.setDTO(dto)
+        self.assertEquals(changes, {'added': [u'item6'],
+                                    'removed': [u'item2'],
+                                    'modified': [],
+                                    'moved': [u'item5']})
+        self.assertEquals(lp.keys(),
+                          [u'item5', u'item1', u'item6', u'item3', u'item4'])
+
+    def test_setDTO_move_forward(self):
+        lp = makeList([{'a': i} for i in range(4)])
+        dto = lp.getDTO()
+        changes = lp.setDTO([dto[1], dto[2], dto[0], dto[3]])
+        self.assertEquals(changes['moved'], [u'item1'])
+        self.assertEquals(lp.keys(), [u'item2', u'item3', u'item1', u'item4'])
+
+    def test_setDTO_random_moves(self):
+        import random
+        rnd = random.Random(42)
+        for i in range(300):
+            lp = makeList([{'a': j} for j in range(rnd.randint(1, 8))])
+            dto = list(lp.getDTO())
+            rnd.shuffle(dto)
+            lp.setDTO(dto)
+            self.assertEquals(lp.keys(), [v['__name__'] for v in dto])
+
+    def test_setDTO_matches_unnamed_by_value(self):
+        lp = makeList([{'a': 1}, {'a': 2}])
+        changes = lp.setDTO([{'a': 2}, {'a': 3}])
+        self.assertEquals(changes, {'added': [u'item3'],
+                                    'removed': [u'item1'],
+                                    'modified': [],
+                                    'moved': []})
+        self.assertEquals(lp.keys(), [u'item2', u'item3'])
+
+    def test_setDTO_matches_many_unnamed(self):
+        lp = makeList([{'a': i % 250} for i in range(500)])
+        names = lp.keys()
+        values = [{'a': i % 250} for i in reversed(range(500))]
+        changes = lp.setDTO(values)
+        self.assertEquals(changes['added'], [])
+        self.assertEquals(changes['removed'], [])
+        self.assertEquals(changes['modified'], [])
+        # Equal values are matched in order
+        keys = lp.keys()
+        self.assertEquals((keys[0], keys[250]), (names[249], names[499]))
+
+    def test_setDTO_resources(self):
+        lp = makeList([{}, {}])
+        for i, ob in enumerate(lp):
+            rp = ResourceProperty('file', Interface)
+            ob.setProperty('file', rp)
+            rp.setDTO(Resource(Blob('data%d' % i), mime_type='text/plain'))
+        dto = lp.getDTO()
+        changes = lp.setDTO(dto)
+        self.assertEquals(changes['modified'], [])
+        dto = copyDTO(dto)
+        for v in dto:
+            del v['__name__']
+        dto.reverse()
+        changes = lp.setDTO(dto)
+        self.assertEquals(changes, {'added': [], 'removed': [],
+                                    'modified': [], 'moved': [u'item2']})
+        dto[0]['file'] = Resource(Blob('other'), mime_type='text/plain')
+        changes = lp.setDTO(dto)
+        self.assertEquals(changes['added'], [u'item3'])
+
+    def test_setDTO_named_new(self):
+        lp = makeList([{'a': 1}])
+        changes = lp.setDTO([{'__name__': u'foo', 'a': 0},
+                             {'__name__': u'item1', 'a': 1}])
+        self.assertEquals(changes, {'added': [u'foo'], 'removed': [],
+                                    'modified': [], 'moved': []})
+        self.assertEquals(lp.keys(), [u'foo', u'item1'])
+
+    def test_setDTO_errors(self):
+        lp = makeList([])
+        self.assertRaises(ValueError, lp.setDTO, [1])
+        self.assertRaises(ValueError, lp.setDTO,
+                          [{'__name__': u'a'}, {'__name__': u'a'}])
+
+
+class DTOCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lp = makeList([{'a': i} for i in range(3)])
+        self.ob = ObjectProperty(u'ob', IItem)
+        self.ob.setProperty('lp', self.lp)
+        self.dto = self.ob.getDTO()
+
+    def tearDown(self):
+        transaction.abort()
+
+    def assertCached(self, *obs):
+        for ob in obs:
+            self.assert_(ob._v_dto is not None, ob)
+
+    def assertNotCached(self, *obs):
+        for ob in obs:
+            self.assert_(ob._v_dto is None, ob)
+
+    def test_cached(self):
+        ob = self.ob
+        self.assertCached(ob)
+        self.assert_(ob._getDTO() is ob._getDTO())
+        # Shared and read-only
+        self.assert_(ob.getDTO() is self.dto)
+        self.assertRaises(TypeError, self.dto['lp'][0].__setitem__,
+                          'a', 'changed')
+        self.assertRaises(TypeError, self.dto['lp'].append, {})
+        dto = copyDTO(self.dto)
+        dto['lp'][0]['a'] = 'changed'
+        self.assertEquals(ob.getDTO()['lp'][0]['a'], 0)
+
+    def test_new_transaction(self):
+        cached = self.ob._getDTO()
+        transaction.abort()
+        self.assert_(self.ob._getDTO() is not cached)
+        self.assertEquals(self.ob._getDTO(), cached)
+
+    def test_setProperty(self):
+        self.lp.getDTO()
+        self.lp[1].setProperty('a', 11)
+        self.assertNotCached(self.lp, self.ob)
+        self.assertEquals(self.ob.getDTO()['lp'][1]['a'], 11)
+        self.ob.setProperty('b', 2)
+        self.assertEquals(self.ob.getDTO()['b'], 2)
+
+    def test_children(self):
+        lp, ob = self.lp, self.ob
+        lp.addValue()
+        self.assertNotCached(ob)
+        self.assertEquals(len(ob.getDTO()['lp']), 4)
+        lp.removeChild(u'item1')
+        self.assertEquals(len(ob.getDTO()['lp']), 3)
+        lp.reorder([u'item4', u'item3', u'item2'])
+        self.assertEquals([v['__name__'] for v in ob.getDTO()['lp']],
+                          [u'item4', u'item3', u'item2'])
+        lp.moveChildToPosition(u'item2', 0)
+        self.assertEquals(ob.getDTO()['lp'][0]['__name__'], u'item2')
+        lp.setDTO([])
+        self.assertEquals(ob.getDTO()['lp'], [])
+        lp.addValue()
+        ob.getDTO()
+        lp.clear()
+        self.assertEquals(ob.getDTO()['lp'], [])
+
+    def test_setDTO_reorder(self):
+        lp, ob = self.lp, self.ob
+        lp.setDTO(list(reversed(self.dto['lp'])))
+        self.assertNotCached(lp, ob)
+        self.assertEquals([v['__name__'] for v in ob.getDTO()['lp']],
+                          [u'item3', u'item2', u'item1'])
+
+
+class DTOChangesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lp = makeList([{'a': i} for i in range(3)])
+        self.ob = ObjectProperty(u'ob', IItem)
+        self.ob.setProperty('lp', self.lp)
+        self.ob.setProperty('title', u'Foo')
+        self.ob.markDTOChanges()
+        self.lp.markDTOChanges()
+
+    def tearDown(self):
+        transaction.abort()
+
+    def test_no_changes(self):
+        self.assertEquals(self.ob.getDTOChanges(), {})
+
+    def test_changes(self):
+        ob, lp = self.ob, self.lp
+        lp[1].setProperty('a', 11)
+        ob.setProperty('title', None)
+        ob.setProperty('size', 3)
+        self.assertEquals(ob.getDTOChanges(), {
+            'lp/item2/a': 11,
+            'title': None,
+            'size': 3,
+            })
+        self.assertEquals(lp.getDTOChanges(), {'item2/a': 11})
+        self.assertEquals(lp[1].getDTOChanges(), {'a': 11})
+        ob.markDTOChanges()
+        self.assertEquals(ob.getDTOChanges(), {})
+        self.assertEquals(lp.getDTOChanges(), {})
+        # Changed again below the marked object
+        lp[1].setProperty('a', 12)
+        self.assertEquals(ob.getDTOChanges(), {'lp/item2/a': 12})
+
+    def test_changes_before_mark(self):
+        ob, lp = self.ob, self.lp
+        lp[0].setProperty('a', 100)
+        ob.markDTOChanges()
+        self.assertEquals(ob.getDTOChanges(), {})
+        lp[1].setProperty('a', 11)
+        self.assertEquals(ob.getDTOChanges(), {'lp/item2/a': 11})
+        lp[0].setProperty('a', 101)
+        self.assertEquals(ob.getDTOChanges(), {'lp/item1/a': 101,
+                                               'lp/item2/a': 11})
+
+    def test_mark_subproperty(self):
+        ob, lp = self.ob, self.lp
+        lp[0].setProperty('a', 100)
+        ob.setProperty('size', 3)
+        lp.markDTOChanges()
+        self.assertEquals(ob.getDTOChanges(), {'size': 3})
+        lp[1].setProperty('a', 11)
+        self.assertEquals(ob.getDTOChanges(), {'lp/item2/a': 11,
+                                               'size': 3})
+
+    def test_list_changes(self):
+        ob, lp = self.ob, self.lp
+        lp[1].setProperty('a', 11)
+        lp.moveChildToPosition(u'item3', 0)
+        self.assertEquals(ob.getDTOChanges(), {'lp': lp.getDTO()})
+        self.assertEquals(lp.getDTOChanges(), {'': lp.getDTO()})
+
+    def test_list_reorder_changes(self):
+        ob, lp = self.ob, self.lp
+        lp.setDTO(list(reversed(lp.getDTO())))
+        self.assertEquals(ob.getDTOChanges(), {'lp': lp.getDTO()})
+        self.assertEquals(lp.getDTO()[0]['__name__'], u'item3')
+
+    def test_transaction(self):
+        self.ob.setProperty('size', 3)
+        transaction.abort()
+        self.assertEquals(self.ob.getDTOChanges(), {})
+        self.ob.setProperty('size', 4)
+        self.assertEquals(self.ob.getDTOChanges(), {'size': 4})
+
+    def test_ghost(self):
+        ob, lp = self.ob, self.lp
+        StorageJar().add(ob)
+        lp[1].setProperty('a', 11)
+        # Not modified itself, so it can be turned into a ghost
+        ob._p_deactivate()
+        self.assertEquals(ob._p_changed, None)
+        self.assertEquals(ob.getDTOChanges(), {'lp/item2/a': 11})
+
+    def test_applyDTOPatch(self):
+        ob, lp = self.ob, self.lp
+        other = ObjectProperty(u'ob', IItem)
+        other.setProperty('lp', makeList([{'a': i} for i in range(3)]))
+        other.setProperty('title', u'Foo')
+        jar = DummyJar()
+        jar.add(other)
+        for item in other.getProperty('lp'):
+            jar.add(item)
+        lp[1].setProperty('a', 11)
+        ob.setProperty('title', None)
+        other.applyDTOPatch(ob.getDTOChanges())
+        self.assertEquals(other.getDTO(), ob.getDTO())
+        self.assertEquals(jar.registered,
+                          [other.getProperty('lp')[1], other])
+        lp.setDTO([{'a': 'new'}] + lp.getDTO())
+        other.applyDTOPatch(ob.getDTOChanges())
+        self.assertEquals(other.getDTO(), ob.getDTO())
+        self.assertEquals(other.getProperty('lp').getDTO()[0]['__name__'],
+                          lp.getDTO()[0]['__name__'])
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(ListPropertyTests),
+        unittest.makeSuite(DTOCacheTests),
+        unittest.makeSuite(DTOChangesTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
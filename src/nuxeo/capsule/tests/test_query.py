@@ -0,0 +1,220 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Query tests.
+"""
+
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from datetime import tzinfo
+
+from nuxeo.capsule.index import UUIDIndex
+from nuxeo.capsule.index import PropertyIndex
+from nuxeo.capsule.query import QueryContext
+from nuxeo.capsule.query import Query
+from nuxeo.capsule.query import Eq
+from nuxeo.capsule.query import In
+from nuxeo.capsule.query import Range
+from nuxeo.capsule.query import TypeIs
+from nuxeo.capsule.query import PathPrefix
+from nuxeo.capsule.query import And
+from nuxeo.capsule.query import Or
+from nuxeo.capsule.tests.test_document import Root
+
+
+class UTC(tzinfo):
+    def utcoffset(self, dt):
+        return timedelta(0)
+
+
+def makeSite(names=None):
+    """Make a workspace with sections holding articles.
+
+    /news/art0 .. /news/art9, /events/art0 .. /events/art4
+    """
+    root = Root()
+    root.setUUIDIndex(UUIDIndex())
+    root.setPropertyIndex(PropertyIndex(names))
+    for section, count in (('news', 10), ('events', 5)):
+        folder = root.addChild(section, 'Folder')
+        for i in range(count):
+            doc = folder.addChild('art%d' % i, 'Article')
+            doc.setProperty('dc:modified', datetime(2026, 10, i+1))
+            doc.setProperty('lang', i % 2 and u'fr' or u'en')
+    return root
+
+
+class QueryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = makeSite()
+
+    def paths(self, query):
+        return [path for uuid, path in self.root.searchQuery(query)]
+
+    def test_simple(self):
+        self.assertEquals(sorted(self.paths(Query(TypeIs('IFolder')))),
+                          ['/', '/events', '/news'])
+        self.assertEquals(len(self.paths(Query(TypeIs('IArticle')))), 15)
+        self.assertEquals(len(self.paths(Query(Eq('lang', u'fr')))), 7)
+        self.assertEquals(len(self.paths(Query(In('lang', [u'fr', u'de'])))),
+                          7)
+        self.assertEquals(self.paths(Query(PathPrefix('events/art3'))),
+                          ['/events/art3'])
+
+    def test_range(self):
+        t = datetime(2026, 10, 3)
+        self.assertEquals(len(self.paths(Query(Range('dc:modified', min=t)))),
+                          11)
+        self.assertEquals(len(self.paths(Query(
+            Range('dc:modified', min=t, excludemin=True)))), 9)
+        self.assertEquals(len(self.paths(Query(
+            Range('dc:modified', max=t)))), 6)
+
+    def test_and_or_sort_limit(self):
+        t = datetime(2026, 10, 2)
+        query = Query(And(TypeIs('IArticle'),
+                          Range('dc:modified', min=t),
+                          PathPrefix('/news')),
+                      sort_on='dc:modified', reverse=True, limit=3)
+        self.assertEquals(self.paths(query),
+                          ['/news/art9', '/news/art8', '/news/art7'])
+        query = Query(Or(PathPrefix('events'), Eq('lang', u'fr')) &
+                      Range('dc:modified', max=t),
+                      sort_on='dc:modified')
+        paths = self.paths(query)
+        self.assertEquals(paths[0], '/events/art0')
+        self.assertEquals(sorted(paths[1:]), ['/events/art1', '/news/art1'])
+
+    def test_planner(self):
+        t = datetime(2026, 10, 9)
+        where = And(PathPrefix('news'), TypeIs('IArticle'),
+                    Eq('lang', u'en'), Range('dc:modified', min=t))
+        context = QueryContext(self.root)
+        uuids = Query(where).execute(context)
+        self.assertEquals(len(uuids), 1)
+        self.assertEquals([(step, p) for step, p, e in context.plan],
+                          [('index', where.predicates[3]),
+                           ('filter', where.predicates[0]),
+                           ('filter', where.predicates[2]),
+                           ('filter', where.predicates[1])])
+
+    def test_intersect(self):
+        where = And(In('lang', [u'fr']), Eq('lang', u'fr'))
+        context = QueryContext(self.root)
+        self.assertEquals(len(Query(where).execute(context)), 7)
+        self.assertEquals([(step, p) for step, p, e in context.plan],
+                          [('index', where.predicates[0]),
+                           ('intersect', where.predicates[1])])
+
+    def test_sort_mixed_types(self):
+        news = self.root['news']
+        news['art0'].setProperty('dc:modified', u'unknown')
+        news['art1'].setProperty('dc:modified', 3)
+        query = Query(PathPrefix('news'), sort_on='dc:modified')
+        paths = self.paths(query)
+        self.assertEquals(len(paths), 11)
+        # Grouped by type of value, missing values first
+        self.assertEquals(paths[0], '/news')
+        self.assertEquals(paths[-2:], ['/news/art1', '/news/art0'])
+
+    def test_not_indexed(self):
+        root = makeSite(['lang'])
+        query = Query(And(Eq('lang', u'en'), TypeIs('IArticle')))
+        self.assertEquals(len(root.searchQuery(query)), 8)
+        query = Query(TypeIs('IArticle'))
+        context = QueryContext(root)
+        self.assertEquals(len(query.execute(context)), 15)
+        self.assertEquals(context.plan[0][0], 'scan')
+
+    def test_filter_like_index(self):
+        # Filters compare values as the index does
+        root = makeSite(['lang'])
+        news = root['news']
+        news['art0'].setProperty('flag', True)
+        news['art1'].setProperty('flag', 1)
+        news['art2'].setProperty('title', 'caf\xc3\xa9')
+        news['art3'].setProperty('dc:modified',
+                                 datetime(2026, 10, 4, tzinfo=UTC()))
+        def paths(where):
+            query = Query(And(PathPrefix('news'), where))
+            return [path for uuid, path in root.searchQuery(query)]
+        self.assertEquals(paths(Eq('flag', True)), ['/news/art0'])
+        self.assertEquals(paths(In('flag', [1, 2])), ['/news/art1'])
+        self.assertEquals(paths(Eq('title', u'caf\xe9')), ['/news/art2'])
+        self.assertEquals(paths(Eq('dc:modified', datetime(2026, 10, 4))),
+                          ['/news/art3'])
+
+
+class CursorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = makeSite()
+
+    def test_fetch(self):
+        all = self.root.searchQuery(Query(Eq('lang', u'en')))
+        cursor = self.root.searchPropertyCursor('lang', u'en')
+        self.assertEquals(cursor.getToken(), None)
+        self.assertEquals(cursor.count(), 8)
+        self.assertEquals(cursor.fetch(3), all[:3])
+        self.assertEquals(cursor.fetch(3), all[3:6])
+        self.assertEquals(cursor.fetch(3), all[6:])
+        self.assertEquals(cursor.fetch(3), [])
+        self.assertEquals(cursor.count(), 8)
+
+    def test_token(self):
+        query = Query(And(Eq('lang', u'en'), PathPrefix('news')))
+        all = self.root.searchQuery(query)
+        self.assertEquals(len(all), 5)
+        cursor = self.root.searchQueryCursor(query)
+        self.assertEquals(cursor.fetch(2), all[:2])
+        token = cursor.getToken()
+        self.assert_(isinstance(token, str))
+        cursor = self.root.searchQueryCursor(query, token)
+        self.assertEquals(list(cursor), all[2:])
+        self.assertEquals(cursor.count(), 5)
+        self.assertRaises(ValueError, self.root.searchQueryCursor,
+                          query, 'x')
+
+    def test_index_set(self):
+        # Walks the set of the index rather than a copy
+        index = self.root.getPropertyIndex()
+        cursor = self.root.searchPropertyCursor('lang', u'en')
+        self.assert_(cursor._uuids is index._getUUIDs('lang', u'en'))
+        self.assertEquals(cursor.count(), 8)
+        self.assertEquals(len(cursor.fetch(10)), 8)
+        cursor = self.root.searchPropertyCursor('lang', u'de')
+        self.assertEquals(cursor.count(), 0)
+        self.assertEquals(cursor.fetch(10), [])
+
+    def test_batches(self):
+        cursor = self.root.searchQueryCursor(Query(TypeIs('IArticle')))
+        cursor.batch_size = 4
+        self.assertEquals(len(list(cursor)), 15)
+
+    def test_sorted(self):
+        self.assertRaises(ValueError, self.root.searchQueryCursor,
+                          Query(TypeIs('IArticle'), sort_on='lang'))
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(QueryTests),
+        unittest.makeSuite(CursorTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())
@@ -0,0 +1,126 @@
+##############################################################################
+#
+# Copyright (c) 2006 Nuxeo and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+# Author: Florent Guillaume <fg@nuxeo.com>
+# $Id$
+"""Schema manager tests.
+"""
+
+import unittest
+
+from zope.interface import Interface
+from zope.interface.interface import InterfaceClass
+
+from nuxeo.capsule.schema import SchemaManager
+
+
+class IBase(Interface):
+    pass
+
+class IFolder(IBase):
+    pass
+
+class IBigFolder(IFolder):
+    pass
+
+class INote(IBase):
+    pass
+
+class IFolderishNote(INote, IFolder):
+    pass
+
+
+class Base(object):
+    pass
+
+class Folder(Base):
+    pass
+
+class Note(Base):
+    pass
+
+class SpecialNote(Note):
+    pass
+
+
+class SchemaManagerTests(unittest.TestCase):
+
+    def setUp(self):
+        sm = self.sm = SchemaManager()
+        for schema in (IBase, IFolder, IBigFolder, INote, IFolderishNote):
+            sm.addSchema(schema.getName()[1:], schema)
+
+    def test_resolution(self):
+        sm = self.sm
+        self.assertRaises(KeyError, sm.getClass, 'Folder')
+        self.assertEquals(sm.getClass('Folder', None), None)
+        sm.setClass('Base', Base)
+        sm.setClass('Folder', Folder)
+        self.assert_(sm.getClass('Base') is Base)
+        self.assert_(sm.getClass('BigFolder') is Folder)
+        self.assert_(sm.getClass('Note') is Base)
+        # Aliases resolve too
+        self.assert_(sm.getClass('IBigFolder') is Folder)
+        # The first base in resolution order wins
+        sm.setClass('Note', Note)
+        self.assert_(sm.getClass('FolderishNote') is Note)
+
+    def test_invalidation(self):
+        sm = self.sm
+        sm.setClass('Base', Base)
+        for name in ('Base', 'Folder', 'BigFolder', 'Note', 'FolderishNote'):
+            self.assert_(sm.getClass(name) is Base)
+        sm.setClass('Note', Note)
+        # Only the descendants of Note are resolved again
+        self.assertEquals(sorted(sm._classes),
+                          ['Base', 'BigFolder', 'Folder'])
+        self.assert_(sm.getClass('FolderishNote') is Note)
+        self.assert_(sm.getClass('BigFolder') is Base)
+        sm.setClass('Note', SpecialNote)
+        self.assert_(sm.getClass('Note') is SpecialNote)
+        self.assert_(sm.getClass('FolderishNote') is SpecialNote)
+        self.assertRaises(ValueError, sm.setClass, 'Note', Folder)
+
+    def test_class_before_schema(self):
+        sm = self.sm
+        sm.setClass('Base', Base)
+        sm.setClass('Other', Note)
+        self.assert_(sm.getClass('Note') is Base)
+        IOther = InterfaceClass('IOther', (INote,))
+        IOtherSub = InterfaceClass('IOtherSub', (IOther,))
+        sm.addSchema('OtherSub', IOtherSub)
+        self.assert_(sm.getClass('OtherSub') is Base)
+        sm.addSchema('Other', IOther)
+        self.assert_(sm.getClass('OtherSub') is Note)
+        self.assert_(sm.getClass('Note') is Base)
+
+    def test_many_schemas(self):
+        sm = self.sm
+        sm.setClass('Base', Base)
+        schema = IBase
+        for i in xrange(200):
+            schema = InterfaceClass('ILevel%d' % i, (schema,))
+            sm.addSchema('Level%d' % i, schema)
+            if i == 100:
+                sm.setClass('Level%d' % i, Folder)
+        self.assert_(sm.getClass('Level50') is Base)
+        self.assert_(sm.getClass('Level199') is Folder)
+
+
+def test_suite():
+    return unittest.TestSuite((
+        unittest.makeSuite(SchemaManagerTests),
+        ))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner().run(test_suite())